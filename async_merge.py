@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import codecs
+import asyncio
+import locale
+import logging
+import functools
+import traceback
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from merge_scheduler import GameResult, MergeScheduler, game_context, game_prefix
+from decompress_pool import DecompressError
+from ncz_engine import NczError
+from tool_registry import ToolNotFoundError
+from profiler import Phase
+from progress import ByteCallback, FileGrowthMonitor
+from space_planner import device_of, format_size
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 解压失败时在错误信息中保留的输出行数
+_OUTPUT_TAIL_LINES = 20
+
+# 每次读取nsz输出的字节数
+_OUTPUT_CHUNK = 65536
+
+# nsz用\r刷新进度，\r、\n和\r\n都作为行结束
+_LINE_BREAK = re.compile(r'\r\n?|\n')
+
+# 当前游戏提交到线程池的任务，取消步骤不会中断已经开始的线程，清理前要等待它们结束
+_game_futures = contextvars.ContextVar('game_futures', default=None)
+
+
+class _AsyncTempBudget:
+    """TempBudget的asyncio版本: 等待临时空间的游戏挂起在事件循环中，不占用线程池中的线程"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+        self.peak = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, nbytes: int) -> int:
+        nbytes = min(max(0, nbytes), self.budget)
+        if not nbytes:
+            return 0
+        async with self._condition:
+            if self.used + nbytes > self.budget:
+                logger.info(f"等待临时空间: 需要 {format_size(nbytes)}，已占用 {format_size(self.used)} / {format_size(self.budget)}")
+                await self._condition.wait_for(lambda: self.used + nbytes <= self.budget)
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+        return nbytes
+
+    async def release(self, nbytes: int):
+        if not nbytes:
+            return
+        async with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+
+class AsyncMergeEngine:
+    """基于asyncio的合并引擎，与MergeScheduler可以互相替换
+
+    每个游戏是一个任务依赖图: 需要解压的文件先解压再输出，其余文件直接输出，
+    所有输出完成后保存清单，最后清理暂存目录。任务按资源类型限制并发:
+    解压占用CPU槽位（共decompress_workers个），复制和重命名占用源文件和目标所在磁盘的槽位
+    （每个磁盘disk_slots个，按设备号顺序获取），同时处理的游戏不超过jobs个。
+    nsz通过asyncio子进程运行，内置引擎解压和文件复制在线程池中执行。
+    """
+
+    def __init__(self, merger, jobs: int, disk_slots: int):
+        self.merger = merger
+        self.jobs = max(1, jobs)
+        self.cpu_slots = max(1, merger.decompress_workers)
+        self.disk_slots = max(1, disk_slots)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cpu: Optional[asyncio.Semaphore] = None
+        self._games: Optional[asyncio.Semaphore] = None
+        self._disks: Dict[int, asyncio.Semaphore] = {}
+        self._temp: Optional[_AsyncTempBudget] = None
+
+    def run(self, games: List[Tuple[str, Dict]], on_done: Optional[Callable[[GameResult], None]] = None
+            ) -> List[GameResult]:
+        """合并所有游戏，返回按输入顺序排列的结果"""
+        results = asyncio.run(self._run_all(games, on_done))
+        MergeScheduler.report(results)
+        return results
+
+    async def _run_all(self, games: List[Tuple[str, Dict]],
+                       on_done: Optional[Callable[[GameResult], None]]) -> List[GameResult]:
+        total = len(games)
+        logger.info(f"asyncio引擎合并 {total} 个游戏，游戏并发数: {self.jobs}，解压并发数: {self.cpu_slots}，"
+                    f"每个磁盘并发数: {self.disk_slots}")
+        # 信号量要在事件循环中创建
+        self._cpu = asyncio.Semaphore(self.cpu_slots)
+        self._games = asyncio.Semaphore(self.jobs)
+        self._disks = {}
+        budget = self.merger._temp_budget
+        self._temp = _AsyncTempBudget(budget.budget) if budget is not None else None
+        # 线程池容纳解压、源和目标磁盘上的复制，以及每个游戏的规划和收尾
+        self._executor = ThreadPoolExecutor(max_workers=self.cpu_slots + 2 * self.disk_slots + self.jobs,
+                                            thread_name_prefix='async-merge')
+        try:
+            return list(await asyncio.gather(*(
+                self._run_one(game_prefix(i, total, files_dict['name']), group_id, files_dict, on_done)
+                for i, (group_id, files_dict) in enumerate(games))))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    async def _run_one(self, prefix: str, group_id: str, files_dict: Dict,
+                       on_done: Optional[Callable[[GameResult], None]]) -> GameResult:
+        async with self._games:
+            with game_context(prefix, files_dict['name']) as context:
+                try:
+                    success = await self._merge(group_id, files_dict)
+                except Exception as e:
+                    logger.error(f"合并游戏 {files_dict['name']} 时出错: {str(e)}")
+                    success = False
+        result = GameResult(group_id, files_dict['name'], success and not context.errors, tuple(context.errors))
+        if on_done:
+            on_done(result)
+        return result
+
+    async def _in_thread(self, func: Callable, *args):
+        """在线程池中执行func，线程中的日志仍带有当前游戏的前缀"""
+        context = contextvars.copy_context()
+        future = self._executor.submit(functools.partial(context.run, func, *args))
+        futures = _game_futures.get()
+        if futures is not None:
+            futures.append(future)
+        return await asyncio.wrap_future(future)
+
+    @staticmethod
+    async def _wait_threads(futures: List[Future]):
+        """取消尚未开始的线程任务，等待已经开始的执行完毕"""
+        for future in futures:
+            future.cancel()
+        running = [asyncio.wrap_future(future) for future in futures if not future.done()]
+        if running:
+            await asyncio.wait(running)
+
+    @staticmethod
+    def _devices(items: List[Tuple[str, Path, Optional[Path], Path]]) -> Dict[Path, int]:
+        """各文件所在磁盘的设备号（需要stat，在线程池中执行）"""
+        return {path: device_of(path) for item in items for path in item[1:] if path is not None}
+
+    @asynccontextmanager
+    async def _disk(self, *devices: int) -> AsyncIterator[None]:
+        """占用各磁盘的槽位，按设备号顺序获取以避免互相等待"""
+        acquired = []
+        try:
+            for device in sorted(set(devices)):
+                slots = self._disks.get(device)
+                if slots is None:
+                    slots = self._disks[device] = asyncio.Semaphore(self.disk_slots)
+                await slots.acquire()
+                acquired.append(slots)
+            yield
+        finally:
+            for slots in reversed(acquired):
+                slots.release()
+
+    async def _merge(self, title_id: str, files_dict: Dict) -> bool:
+        """合并一个游戏，与SwitchRomMerger.merge_files的步骤相同"""
+        merger = self.merger
+        name = files_dict['name']
+        plan = None
+        temp_reserved = 0
+        success = False
+        game_start = time.perf_counter()
+        progress = merger.progress.callback(name)
+        futures: List[Future] = []
+        futures_token = _game_futures.set(futures)
+        try:
+            plan = await self._in_thread(merger._plan_merge, title_id, files_dict)
+            if plan is None:
+                return False
+            if plan.up_to_date:
+                success = True
+                return True
+            if self._temp is not None:
+                temp_reserved = await self._temp.acquire(merger._temp_need(plan))
+
+            remaining = await self._in_thread(merger._pending_items, plan, progress)
+            devices = await self._in_thread(self._devices, remaining)
+            decompressed = [item for item in remaining if item[2] is not None]
+            if merger.move and decompressed:
+                logger.info(f"{len(decompressed)} 个NSZ/XCZ源文件解压后保留在原位置，不会被移动")
+
+            # 各文件的解压和输出互相独立，全部完成后才能收尾；任一步骤失败时取消其余步骤
+            steps = [asyncio.ensure_future(self._decompress_step(plan, item, devices, progress) if item[2] is not None
+                                           else self._output_step(plan, item, devices, progress))
+                     for item in remaining]
+            try:
+                if steps:
+                    await asyncio.wait(steps, return_when=asyncio.FIRST_EXCEPTION)
+            finally:
+                for step in steps:
+                    step.cancel()
+                await asyncio.gather(*steps, return_exceptions=True)
+            errors = [step.exception() for step in steps if not step.cancelled() and step.exception()]
+            for error in errors:
+                logger.error(f"创建XCI文件失败: {str(error)}")
+                logger.error(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+            if not errors:
+                await self._in_thread(merger._finish_merge, plan)
+                success = True
+            logger.info(f"游戏 {plan.game_name} 处理完成，输出目录: {plan.output_game_dir}")
+        except Exception as e:
+            logger.error(f"合并游戏 {name} 时出错: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            # 被取消的步骤可能仍有线程在写.part或暂存文件，全部结束后才能清理和释放临时空间
+            await self._wait_threads(futures)
+            _game_futures.reset(futures_token)
+            if plan is not None:
+                await self._in_thread(merger._cleanup_merge, plan)
+            if self._temp is not None:
+                await self._temp.release(temp_reserved)
+            merger.profiler.record_game(name, time.perf_counter() - game_start, success)
+            merger.progress.finish(name)
+        return success
+
+    async def _output_step(self, plan, item: Tuple[str, Path, Optional[Path], Path], devices: Dict[Path, int],
+                           progress: ByteCallback):
+        label, source, staged, output = item
+        async with self._disk(devices[source], devices[output]):
+            await self._in_thread(self.merger._output_direct, plan, label, source, output, progress)
+
+    async def _decompress_step(self, plan, item: Tuple[str, Path, Optional[Path], Path], devices: Dict[Path, int],
+                               progress: ByteCallback):
+        label, source, staged, output = item
+        await self._in_thread(self.merger.job_journal.begin, plan.title_id, f"解压{label}", source, output)
+        async with self._cpu:
+            await self._decompress(source, staged, progress)
+        async with self._disk(devices[staged], devices[output]):
+            await self._in_thread(self.merger._output_decompressed, plan, label, source, staged, output)
+
+    async def _decompress(self, source: Path, output: Path, progress: ByteCallback):
+        """解压到output，缓存、引擎选择和失败时改用nsz的规则与DecompressPool相同"""
+        pool = self.merger.decompress_pool
+        profiler = self.merger.profiler
+        # 同一线程中的多个任务交替执行，字节数和外部进程耗时直接记到本阶段上
+        phase = profiler.begin('merge.decompress')
+        try:
+            with FileGrowthMonitor(output, progress):
+                output.parent.mkdir(exist_ok=True, parents=True)
+                hit, cache_key = await self._in_thread(pool.lookup_cache, source, output)
+                if hit:
+                    return
+
+                if pool.use_builtin():
+                    try:
+                        await self._in_thread(pool.run_builtin, source, output)
+                    except NczError as e:
+                        if not pool.can_fall_back():
+                            raise DecompressError(f"解压 {source.name} 失败: {str(e)}") from e
+                        logger.warning(f"内置引擎无法解压 {source.name}: {str(e)}，改用nsz")
+                        await self._run_nsz(source, output, phase)
+                elif pool.tools.available('nsz'):
+                    await self._run_nsz(source, output, phase)
+                else:
+                    raise DecompressError(f"无法解压 {source.name}: 未安装zstandard模块，也找不到nsz工具")
+
+                phase.add_bytes(read=source.stat().st_size, written=output.stat().st_size)
+                await self._in_thread(pool.store_cache, cache_key, source, output)
+        finally:
+            profiler.end(phase)
+
+    async def _run_nsz(self, source: Path, output: Path, phase: Phase):
+        pool = self.merger.decompress_pool
+        try:
+            command = pool.tools.require('nsz') + [str(arg) for arg in pool.nsz_args(source, output)]
+        except ToolNotFoundError as e:
+            raise DecompressError(f"无法运行nsz: {str(e)}") from e
+        logger.debug(f"执行命令: {' '.join(command)}")
+
+        start_time = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.STDOUT)
+        except OSError as e:
+            raise DecompressError(f"无法运行nsz: {str(e)}") from e
+
+        tail = deque(maxlen=_OUTPUT_TAIL_LINES)
+        try:
+            returncode = await asyncio.wait_for(self._read_output(process, tail), pool.timeout)
+        except asyncio.TimeoutError:
+            raise DecompressError(f"解压 {source.name} 超时 ({pool.timeout:.0f} 秒)") from None
+        finally:
+            # 超时或任务被取消时结束进程
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            phase.stats.subprocess_seconds += time.perf_counter() - start_time
+
+        elapsed = time.perf_counter() - start_time
+        if returncode != 0:
+            raise DecompressError(f"解压 {source.name} 失败 (返回码 {returncode}): " + " | ".join(tail))
+        if not output.exists():
+            raise DecompressError(f"解压 {source.name} 后未找到输出文件 {output}: " + " | ".join(tail))
+        logger.info(f"解压完成: {output.name} ({elapsed:.1f} 秒)")
+
+    @staticmethod
+    async def _read_output(process: asyncio.subprocess.Process, tail: Deque[str]) -> int:
+        # 按块读取输出，避免缓冲区写满阻塞子进程；nsz的进度行只以\r结束，
+        # 不能用StreamReader按\n分行（单行会超过其长度限制）
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors='replace')
+        pending = ''
+        while True:
+            chunk = await process.stdout.read(_OUTPUT_CHUNK)
+            lines = _LINE_BREAK.split(pending + decoder.decode(chunk, final=not chunk))
+            # 最后一段可能是不完整的行，留到下一块；输出结束时全部处理
+            pending = lines.pop() if chunk else ''
+            for line in lines:
+                line = line.rstrip()
+                if line:
+                    tail.append(line)
+                    logger.debug(f"NSZ输出: {line}")
+            if not chunk:
+                break
+        return await process.wait()
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""性能测试
+
+synthetic_library生成与真实游戏库结构相同的合成目录树（稀疏文件），
+suite在合成游戏库上测试扫描、文件名解析和合并，结果输出为JSON以便跨提交对比。
+其余bench_*.py为针对单个模块的对比测试。
+"""
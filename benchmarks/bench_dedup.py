@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""同名游戏整合阶段的扩展性测试
+
+用法: python benchmarks/bench_dedup.py [--max-groups 50000]
+"""
+
+import re
+import sys
+import time
+import random
+import argparse
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from switch_rom_merger import SwitchRomMerger, logger
+from file_record import FileRecord
+
+
+def make_game_files(group_count: int, dup_ratio: float = 0.2):
+    """生成合成的游戏分组，其中一部分名称仅大小写/符号不同"""
+    rng = random.Random(group_count)
+    game_files = {}
+    for i in range(group_count):
+        if i and rng.random() < dup_ratio:
+            # 与之前某个游戏同名（标准化后相同）
+            name = f"Game-{rng.randrange(i)}".upper()
+        else:
+            name = f"Game {i}"
+        root = Path(f"/rom/{name}/{i}")
+        game_files[f"{i:016X}"] = {
+            'base': FileRecord(root / 'base.xci', rng.randrange(1, 1 << 34), 0, i),
+            'updates': [FileRecord(root / f'upd{j}.nsp', j, 0, i) for j in range(2)],
+            'dlcs': [FileRecord(root / f'dlc{j}.nsp', j, 0, i) for j in range(3)],
+            'name': name,
+        }
+    return game_files
+
+
+def legacy_merge(game_files):
+    """原先的嵌套循环实现，仅用于对比"""
+    normalize = lambda name: re.sub(r'[^a-z0-9]', '', name.lower())
+    final_games = {}
+    processed_names = set()
+    for game_id, game_data in game_files.items():
+        norm_name = normalize(game_data['name'])
+        if norm_name in processed_names:
+            continue
+        same_games = [(other_id, other_data) for other_id, other_data in game_files.items()
+                      if normalize(other_data['name']) == norm_name]
+        merged = {'base': None, 'updates': [], 'dlcs': [], 'name': game_data['name']}
+        for _, data in same_games:
+            if data['base'] and (not merged['base'] or data['base'].size > merged['base'].size):
+                merged['base'] = data['base']
+            for update in data['updates']:
+                if update not in merged['updates']:
+                    merged['updates'].append(update)
+            for dlc in data['dlcs']:
+                if dlc not in merged['dlcs']:
+                    merged['dlcs'].append(dlc)
+        final_games[same_games[0][0]] = merged
+        processed_names.add(norm_name)
+    return final_games
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同名游戏整合性能测试')
+    parser.add_argument('--max-groups', type=int, default=50000, help='最大分组数量')
+    parser.add_argument('--legacy-limit', type=int, default=2000, help='旧实现只测到该分组数量')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    # 跳过构造函数中的工具检查，只测试整合阶段
+    merger = object.__new__(SwitchRomMerger)
+
+    sizes = []
+    n = 1000
+    while n <= args.max_groups:
+        sizes.append(n)
+        n *= 2
+    if sizes and sizes[-1] != args.max_groups:
+        sizes.append(args.max_groups)
+
+    print(f"{'分组数':>8} {'新实现(秒)':>12} {'每千组(毫秒)':>14} {'旧实现(秒)':>12}")
+    for size in sizes:
+        game_files = make_game_files(size)
+        elapsed, result = timed(merger._merge_same_name_games, game_files)
+        legacy = '-'
+        if size <= args.legacy_limit:
+            legacy_elapsed, legacy_result = timed(legacy_merge, game_files)
+            assert len(legacy_result) == len(result)
+            legacy = f"{legacy_elapsed:.3f}"
+        print(f"{size:>8} {elapsed:>12.4f} {elapsed / size * 1e6:>14.2f} {legacy:>12}")
+
+
+if __name__ == '__main__':
+    main()
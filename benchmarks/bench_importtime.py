@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""检查导入switch_rom_merger的耗时和副作用，防止启动变慢
+
+用 python -X importtime 在独立进程中导入模块（重复多次取最小值），输出累计耗时最多的模块，
+超过预算或加载了不应在导入时加载的模块时返回非零退出码，可用于回归检查。
+
+用法: python benchmarks/bench_importtime.py [--module switch_rom_merger] [--budget-ms 150] [--runs 5]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 只在实际工作时才需要的重型依赖，导入库时不应加载
+LAZY_MODULES = ('tqdm', 'py7zr', 'zstandard', 'Cryptodome', 'Crypto', 'tkinter', 'ssl')
+
+# 子进程中导入模块后输出已加载的模块，并检查是否在当前目录创建了文件
+_PROBE = """
+import os, sys
+before = set(os.listdir('.'))
+import {module}
+import logging
+print(','.join(sorted(sys.modules)))
+print(','.join(sorted(set(os.listdir('.')) - before)))
+print(len(logging.getLogger().handlers))
+"""
+
+
+def run_importtime(module: str, cwd: Path) -> Tuple[Dict[str, int], List[str], List[str], int]:
+    """返回 ({模块: 累计微秒}, 已加载的模块, 新建的文件, 根日志处理器数量)"""
+    env = dict(os.environ, PYTHONPATH=str(ROOT), PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+                             cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # 格式: import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, _, fields = line.partition(':')
+        _, cumulative_us, name = fields.split('|')
+        cumulative[name.strip()] = int(cumulative_us)
+    loaded, created, handlers = (result.stdout.splitlines() + ['', '', '0'])[:3]
+    return cumulative, loaded.split(','), [name for name in created.split(',') if name], int(handlers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入耗时测试')
+    parser.add_argument('--module', default='switch_rom_merger', help='要导入的模块')
+    parser.add_argument('--budget-ms', type=float, default=150, help='导入耗时预算（毫秒），超过时返回1')
+    parser.add_argument('--runs', type=int, default=5, help='重复次数，取最小值')
+    parser.add_argument('--top', type=int, default=10, help='显示累计耗时最多的模块数量')
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='bench_importtime_') as cwd:
+        runs = [run_importtime(args.module, Path(cwd)) for _ in range(max(1, args.runs))]
+
+    best = min(runs, key=lambda run: run[0].get(args.module, 0))
+    cumulative, loaded, created, handlers = best
+    total_ms = cumulative.get(args.module, 0) / 1000
+    print(f"导入 {args.module}: {total_ms:.1f} 毫秒 (最快的一次，共 {len(runs)} 次)")
+    print(f"累计耗时最多的 {args.top} 个模块:")
+    for name, us in sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {us / 1000:8.1f} 毫秒  {name}")
+
+    if total_ms > args.budget_ms:
+        failures.append(f"导入耗时 {total_ms:.1f} 毫秒超过预算 {args.budget_ms:.0f} 毫秒")
+    eager = sorted({name.split('.')[0] for name in loaded} & set(LAZY_MODULES))
+    if eager:
+        failures.append(f"导入时加载了应延迟导入的模块: {', '.join(eager)}")
+    if created:
+        failures.append(f"导入时创建了文件或目录: {', '.join(created)}")
+    if handlers:
+        failures.append(f"导入时配置了根日志处理器 ({handlers} 个)")
+
+    for failure in failures:
+        print(f"失败: {failure}")
+    if not failures:
+        print("通过")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""文件名解析微基准：对比原先的多次正则匹配与预编译+缓存的parse_name
+
+用法: python benchmarks/bench_parser.py [--names 100000]
+"""
+
+import re
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from name_parser import parse_name
+
+NAME_TEMPLATES = [
+    "rom/{game}/xci本体/[XCI][HK][{base}][1.0.0][14.0.0].xcz",
+    "rom/{game}/upd-v1.0.{n}/[UPD][v1.0.{n}][{upd}][v{ver}].nsz",
+    "rom/{game}/dlc/[DLC][{dlc}][v0].nsz",
+    "rom/{game}/{game} [{base}][v0].nsp",
+    "rom/{game}/{game} [{upd}][v{n}.0.0] (Update).nsp",
+    "rom/{game}_{base}.xci",
+]
+
+
+def make_names(count: int):
+    rng = random.Random(count)
+    names = []
+    for i in range(count):
+        base_int = 0x0100000000000000 + (i << 13)
+        names.append(rng.choice(NAME_TEMPLATES).format(
+            game=f"Game {i}",
+            base=f"{base_int:016X}",
+            upd=f"{base_int + 0x800:016X}",
+            dlc=f"{base_int + 0x1000 + rng.randrange(1, 16):016X}",
+            n=rng.randrange(10),
+            ver=rng.randrange(1, 20) << 16,
+        ))
+    return names
+
+
+def legacy_parse(path_str: str):
+    """原先的实现：每个判断函数各自执行未预编译的正则"""
+    def extract_title_id(text):
+        for pattern in (r'\[([0-9A-Fa-f]{16})\]', r'(?<!\[)([0-9A-Fa-f]{16})(?!\])'):
+            match = re.search(pattern, text)
+            if match:
+                return match.group(1).upper()
+        return None
+
+    file_path = Path(path_str)
+    file_str = str(file_path).lower()
+    filename = file_path.name.lower()
+    title_id = extract_title_id(str(file_path))
+
+    is_dlc = 'dlc' in file_str
+    tid = extract_title_id(file_str)
+    if not is_dlc and tid and tid[13:15] == '00' and tid[15] != '0':
+        is_dlc = True
+
+    is_update = any(k in filename for k in ('upd', 'update', '更新', 'patch', '补丁', 'v1.', 'v2.'))
+    tid = extract_title_id(file_str)
+    if not is_update and tid and tid[13:] == '800':
+        is_update = True
+
+    version = None
+    for pattern in (r'v(\d+\.\d+(\.\d+)?)', r'v(\d+_\d+(_\d+)?)', r'[vV](\d+)',
+                    r'(\d+\.\d+(\.\d+)?)', r'(\d+_\d+(_\d+)?)'):
+        match = re.search(pattern, str(file_path))
+        if match:
+            version = match.group(1).replace('_', '.')
+            break
+
+    name = re.sub(r'\[.*?\]', '', file_path.name)
+    name = re.sub(r'\(.*?\)', '', name)
+    name = re.sub(r'v\d+(\.\d+)*', '', name)
+    if title_id:
+        name = name.replace(title_id, '')
+    name = name.strip('_.- ')
+    return title_id, version, is_update, is_dlc, name
+
+
+def rate(func, names):
+    start = time.perf_counter()
+    for name in names:
+        func(name)
+    elapsed = time.perf_counter() - start
+    return len(names) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文件名解析性能测试')
+    parser.add_argument('--names', type=int, default=100000, help='文件名数量')
+    args = parser.parse_args()
+
+    names = make_names(args.names)
+
+    # 结果一致性检查
+    for name in names[:2000]:
+        parsed = parse_name(name)
+        assert legacy_parse(name)[:4] == (parsed.title_id, parsed.version, parsed.is_update, parsed.is_dlc), name
+
+    legacy_rate = rate(legacy_parse, names)
+    parse_name.cache_clear()
+    cold_rate = rate(parse_name, names)
+    warm_rate = rate(parse_name, names)
+
+    print(f"原实现:           {legacy_rate:>12,.0f} 文件/秒")
+    print(f"parse_name(冷):   {cold_rate:>12,.0f} 文件/秒 ({cold_rate / legacy_rate:.1f}x)")
+    print(f"parse_name(缓存): {warm_rate:>12,.0f} 文件/秒 ({warm_rate / legacy_rate:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
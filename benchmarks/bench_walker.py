@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""对比单次遍历的walk_files与原先按扩展名多次rglob的扫描耗时
+
+用法: python benchmarks/bench_walker.py [--files 100000] [--dirs 2000]
+"""
+
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from file_walker import walk_files
+
+EXTENSIONS = ['.xci', '.xcz', '.nsp', '.nsz']
+
+
+def build_tree(root: Path, file_count: int, dir_count: int):
+    """生成合成目录树：空文件，混入部分大写扩展名和无关文件"""
+    rng = random.Random(42)
+    dirs = [root]
+    for i in range(dir_count):
+        parent = rng.choice(dirs)
+        d = parent / f"游戏目录_{i}"
+        d.mkdir()
+        dirs.append(d)
+    for i in range(file_count):
+        ext = rng.choice(EXTENSIONS + ['.txt', '.NSP'])
+        (rng.choice(dirs) / f"[{i:016X}][v0]{ext}").touch()
+
+
+def rglob_scan(directory: Path):
+    """原先的实现：每个扩展名一次rglob，并单独stat每个文件"""
+    files = []
+    for ext in EXTENSIONS:
+        files.extend(directory.rglob(f"*{ext}"))
+    return [(f, f.stat()) for f in files]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='目录遍历性能测试')
+    parser.add_argument('--files', type=int, default=100000, help='合成文件数量')
+    parser.add_argument('--dirs', type=int, default=2000, help='合成目录数量')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最优值')
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix='bench_walker_'))
+    try:
+        print(f"生成 {args.files} 个文件, {args.dirs} 个目录: {root}")
+        build_tree(root, args.files, args.dirs)
+
+        rglob_times, walk_times = [], []
+        for _ in range(args.repeat):
+            elapsed, rglob_result = timed(rglob_scan, root)
+            rglob_times.append(elapsed)
+            elapsed, walk_result = timed(walk_files, root, EXTENSIONS)
+            walk_times.append(elapsed)
+
+        print(f"rglob x{len(EXTENSIONS)}: {min(rglob_times):.3f} 秒, {len(rglob_result)} 个文件")
+        print(f"walk_files:  {min(walk_times):.3f} 秒, {len(walk_result)} 个文件 (扩展名不区分大小写)")
+        print(f"加速比: {min(rglob_times) / min(walk_times):.2f}x")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
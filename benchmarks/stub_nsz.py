@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""代替nsz的测试工具: 接受与nsz相同的解压参数，把源文件原样复制为.nsp/.xci
+
+用法: python benchmarks/stub_nsz.py -D -w -o 输出目录 源文件
+"""
+
+import sys
+import shutil
+import argparse
+from pathlib import Path
+
+DECOMPRESSED_SUFFIXES = {'.nsz': '.nsp', '.xcz': '.xci'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='nsz测试替身')
+    parser.add_argument('-D', action='store_true')
+    parser.add_argument('-w', action='store_true')
+    parser.add_argument('-o', type=Path, required=True)
+    parser.add_argument('source', type=Path)
+    args = parser.parse_args()
+
+    suffix = DECOMPRESSED_SUFFIXES.get(args.source.suffix.lower())
+    if suffix is None:
+        print(f"不支持的文件: {args.source}")
+        sys.exit(1)
+    args.o.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(args.source, args.o / (args.source.stem + suffix))
+    print(f"解压完成: {args.source.name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""在合成游戏库上测试扫描、文件名解析和合并，结果输出为JSON
+
+- scan:  scan_directory，分别测试无索引（冷）、有索引（热）和不读取文件头三种情况
+- parse: extract_title_id 和 _extract_version，分别测试解析缓存为空和已缓存的情况
+- merge: 逐个游戏调用merge_files，nsz替换为stub_nsz.py，只测合并流程本身的开销
+
+每项重复多次，记录最小值和中位数。--compare指定之前的结果文件时，对比各项耗时，
+变慢超过阈值时返回非零退出码。
+
+用法: python -m benchmarks.suite [--games 500] [--merge-games 10] [--output results.json] [--compare old.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synthetic_library import LibraryShape, SyntheticFile, generate_library, MB
+from switch_rom_merger import SwitchRomMerger, logger
+from name_parser import parse_name
+from file_transfer import LINK_MODES
+
+STUB_NSZ = Path(__file__).resolve().parent / 'stub_nsz.py'
+
+
+@contextmanager
+def working_directory(path: Path) -> Iterator[None]:
+    """合并器使用相对路径的output、temp和cache目录，测试期间切换到临时目录"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def timings(times: List[float]) -> Dict[str, float]:
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def environment() -> Dict:
+    """记录测试环境，便于对比不同提交的结果"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def bench_scan(rom_dir: Path, file_count: int, repeat: int) -> Dict:
+    cold, warm, names_only = [], [], []
+    games = {}
+    for _ in range(repeat):
+        merger = SwitchRomMerger()
+        elapsed, games = timed(merger.scan_directory, rom_dir, True)
+        cold.append(elapsed)
+        elapsed, _ = timed(merger.scan_directory, rom_dir)
+        warm.append(elapsed)
+        merger = SwitchRomMerger(use_index=False, read_headers=False)
+        elapsed, _ = timed(merger.scan_directory, rom_dir)
+        names_only.append(elapsed)
+    return {
+        'games': len(games),
+        'files': file_count,
+        'cold_seconds': timings(cold),
+        'warm_seconds': timings(warm),
+        'no_header_seconds': timings(names_only),
+        'cold_files_per_second': file_count / min(cold) if min(cold) else None,
+    }
+
+
+def bench_parse(files: List[SyntheticFile], repeat: int) -> Dict:
+    merger = SwitchRomMerger()
+    paths = [f.path for f in files]
+
+    def parse_all():
+        for path in paths:
+            merger.extract_title_id(str(path))
+            merger._extract_version(path)
+
+    cold, warm = [], []
+    for _ in range(repeat):
+        parse_name.cache_clear()
+        cold.append(timed(parse_all)[0])
+        warm.append(timed(parse_all)[0])
+
+    # 识别准确率: 文件名中的Title ID应被完整识别
+    correct = sum(merger.extract_title_id(str(f.path)) == f.title_id for f in files)
+    return {
+        'names': len(paths),
+        'cold_seconds': timings(cold),
+        'warm_seconds': timings(warm),
+        'cold_names_per_second': len(paths) / min(cold) if min(cold) else None,
+        'title_id_accuracy': correct / len(files) if files else None,
+    }
+
+
+def _use_stub_nsz():
+    """把stub_nsz.py写入工具配置，ToolRegistry会直接使用缓存的命令"""
+    config = Path('cache') / 'tools.json'
+    config.parent.mkdir(exist_ok=True)
+    config.write_text(json.dumps({'nsz': {'command': [sys.executable, str(STUB_NSZ)], 'source': 'stub'}}),
+                      encoding='utf-8')
+
+
+def bench_merge(rom_dir: Path, repeat: int, link_mode: str) -> Dict:
+    _use_stub_nsz()
+    times, successes, output_bytes = [], 0, 0
+    for _ in range(repeat):
+        for leftover in ('output', 'temp'):
+            shutil.rmtree(leftover, ignore_errors=True)
+        merger = SwitchRomMerger(force=True, link_mode=link_mode, decompress_engine='nsz')
+        games = [(group_id, files) for group_id, files in merger.scan_directory(rom_dir).items() if files['base']]
+        start = time.perf_counter()
+        successes = sum(merger.merge_files(group_id, files) for group_id, files in games)
+        times.append(time.perf_counter() - start)
+        merger.close()
+        output_bytes = sum(path.stat().st_size for path in Path('output').rglob('*') if path.is_file())
+    return {
+        'games': len(games),
+        'succeeded': successes,
+        'link_mode': link_mode,
+        'seconds': timings(times),
+        'output_mb': output_bytes / MB,
+        'mb_per_second': output_bytes / MB / min(times) if min(times) else None,
+    }
+
+
+def _flatten_timings(results: Dict, prefix: str = '') -> Dict[str, float]:
+    """取出所有耗时项的最小值，键为 benchmark.项目"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if 'min' in value and 'median' in value:
+                flat[f"{prefix}{key}"] = value['min']
+            else:
+                flat.update(_flatten_timings(value, f"{prefix}{key}."))
+    return flat
+
+
+def compare(previous: Dict, current: Dict, threshold: float) -> List[str]:
+    """返回变慢超过阈值的项目"""
+    old = _flatten_timings(previous.get('results', {}))
+    new = _flatten_timings(current.get('results', {}))
+    regressions = []
+    print(f"\n与 {previous.get('environment', {}).get('commit') or '之前的结果'} 对比:", file=sys.stderr)
+    for key in sorted(new):
+        if key not in old or not old[key]:
+            continue
+        ratio = new[key] / old[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- 变慢'
+            regressions.append(key)
+        print(f"  {key:<32} {old[key]:>10.4f} -> {new[key]:>10.4f} 秒 ({ratio:.2f}x){flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='扫描/解析/合并性能测试')
+    parser.add_argument('--games', type=int, default=500, help='扫描和解析测试的游戏数量')
+    parser.add_argument('--updates', type=int, default=2, help='每个游戏的更新数量')
+    parser.add_argument('--dlcs', type=int, default=3, help='每个游戏的DLC数量')
+    parser.add_argument('--depth', type=int, default=2, help='目录嵌套层数')
+    parser.add_argument('--merge-games', type=int, default=10, help='合并测试的游戏数量')
+    parser.add_argument('--base-mb', type=float, default=64.0, help='合并测试中基础游戏文件大小（MB）')
+    parser.add_argument('--link-mode', choices=LINK_MODES, default='copy', help='合并测试的输出方式')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数')
+    parser.add_argument('--only', choices=('scan', 'parse', 'merge'), nargs='+', help='只运行指定的测试')
+    parser.add_argument('--output', type=Path, help='结果JSON文件（默认输出到标准输出）')
+    parser.add_argument('--compare', type=Path, help='与之前的结果JSON对比')
+    parser.add_argument('--threshold', type=float, default=0.2, help='判定变慢的比例（默认0.2即20%%）')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    selected = set(args.only or ('scan', 'parse', 'merge'))
+    scan_shape = LibraryShape(games=args.games, updates=args.updates, dlcs=args.dlcs, depth=args.depth)
+    merge_shape = scan_shape._replace(games=args.merge_games, base_mb=args.base_mb, seed=scan_shape.seed + 1)
+
+    results = {}
+    work = Path(tempfile.mkdtemp(prefix='bench_suite_'))
+    try:
+        with working_directory(work):
+            if selected & {'scan', 'parse'}:
+                files = generate_library(work / 'rom', scan_shape)
+                print(f"扫描测试游戏库: {len(files)} 个文件", file=sys.stderr)
+                if 'scan' in selected:
+                    results['scan'] = bench_scan(work / 'rom', len(files), args.repeat)
+                if 'parse' in selected:
+                    results['parse'] = bench_parse(files, args.repeat)
+            if 'merge' in selected:
+                files = generate_library(work / 'merge_rom', merge_shape)
+                print(f"合并测试游戏库: {len(files)} 个文件", file=sys.stderr)
+                results['merge'] = bench_merge(work / 'merge_rom', args.repeat, args.link_mode)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        'environment': environment(),
+        'params': {'scan': scan_shape._asdict(), 'merge': merge_shape._asdict(),
+                   'repeat': args.repeat, 'link_mode': args.link_mode},
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n', encoding='utf-8')
+        print(f"结果已保存: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        previous = json.loads(args.compare.read_text(encoding='utf-8'))
+        regressions = compare(previous, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项变慢超过 {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""生成合成的Switch游戏库
+
+文件名沿用真实游戏库中的命名方式（如 [UPD][v1.0.2][01001F0019804800][v131072].nsz），
+文件开头写入可被rom_header解析的PFS0/XCI文件头，其余部分为稀疏文件，不占用磁盘空间。
+相同的参数和种子总是生成相同的目录树。
+
+用法: python -m benchmarks.synthetic_library 输出目录 [--games 100] [--updates 2] [--dlcs 3] [--depth 2]
+"""
+
+import struct
+import random
+import argparse
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+MB = 1024 * 1024
+
+# 游戏名称素材，混合中英文
+_NAME_WORDS = ['Zelda', 'Mario', 'Kirby', 'Metroid', 'Xenoblade', 'Pikmin', 'Splatoon',
+               '集合啦', '动物森友会', '异度神剑', '星之卡比', '塞尔达传说', '王国之泪', '宝可梦']
+
+# XCI卡带头中根HFS0分区的位置（与nsz生成的XCI相同）
+_XCI_ROOT_OFFSET = 0xF000
+
+
+class LibraryShape(NamedTuple):
+    """合成游戏库的规模"""
+    games: int = 100               # 游戏数量
+    updates: int = 2               # 每个游戏的更新数量
+    dlcs: int = 3                  # 每个游戏的DLC数量
+    depth: int = 2                 # ROM目录到文件之间的目录层数（0表示文件直接放在ROM目录下）
+    base_mb: float = 64.0          # 基础游戏文件大小
+    update_mb: float = 8.0         # 更新文件大小
+    dlc_mb: float = 1.0            # DLC文件大小
+    compressed_ratio: float = 0.5  # NSZ/XCZ格式所占比例
+    extras_ratio: float = 0.3      # 游戏目录中出现无关文件（说明、封面）的比例
+    seed: int = 42
+
+
+class SyntheticFile(NamedTuple):
+    path: Path
+    title_id: str
+    kind: str        # base / update / dlc
+    size: int
+
+
+def _string_table(names: List[str]) -> bytes:
+    table = b''.join(name.encode('utf-8') + b'\0' for name in names)
+    return table + bytes(-len(table) % 0x20)
+
+
+def _pfs0_header(files: List[Tuple[str, int]]) -> bytes:
+    """PFS0 (NSP/NSZ) 分区头"""
+    strings = _string_table([name for name, _ in files])
+    header = struct.pack('<4sIII', b'PFS0', len(files), len(strings), 0)
+    offset = name_offset = 0
+    for name, size in files:
+        header += struct.pack('<QQII', offset, size, name_offset, 0)
+        offset += size
+        name_offset += len(name.encode('utf-8')) + 1
+    return header + strings
+
+
+def _hfs0_header(files: List[Tuple[str, int]]) -> bytes:
+    """HFS0 (XCI分区) 分区头，哈希字段留空"""
+    strings = _string_table([name for name, _ in files])
+    header = struct.pack('<4sIII', b'HFS0', len(files), len(strings), 0)
+    offset = name_offset = 0
+    for name, size in files:
+        header += struct.pack('<QQIIQ32s', offset, size, name_offset, 0x200, 0, bytes(32))
+        offset += size
+        name_offset += len(name.encode('utf-8')) + 1
+    header += strings
+    return header + bytes(-len(header) % 0x200)
+
+
+def _content_entries(rng: random.Random, title_id: str, compressed: bool, data_size: int) -> List[Tuple[str, int]]:
+    """容器内的文件: 票据、cnmt和一个承载剩余大小的NCA"""
+    ext = 'ncz' if compressed else 'nca'
+    ticket = (f"{title_id}{0:015X}{rng.randrange(16):X}.tik".lower(), 0x2C0)
+    cnmt = (f"{rng.getrandbits(128):032x}.cnmt.nca", 0x1000)
+    return [(f"{rng.getrandbits(128):032x}.{ext}", max(0, data_size - 0x12C0)), cnmt, ticket]
+
+
+def _write_sparse(path: Path, header: bytes, size: int):
+    """写入文件头，其余部分留为稀疏区域"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(max(size, len(header)))
+
+
+def _write_container(rng: random.Random, path: Path, title_id: str, size: int):
+    suffix = path.suffix.lower()
+    compressed = suffix in ('.nsz', '.xcz')
+    if suffix in ('.nsp', '.nsz'):
+        entries = _content_entries(rng, title_id, compressed, size)
+        header = _pfs0_header(entries)
+        size = len(header) + sum(entry_size for _, entry_size in entries)
+    else:
+        secure = _hfs0_header(_content_entries(rng, title_id, compressed, size - _XCI_ROOT_OFFSET))
+        root = _hfs0_header([('update', 0), ('normal', 0), ('secure', size)])
+        head = bytearray(_XCI_ROOT_OFFSET)
+        head[0x100:0x104] = b'HEAD'
+        struct.pack_into('<QQ', head, 0x130, _XCI_ROOT_OFFSET, len(root))
+        header = bytes(head) + root + secure
+    _write_sparse(path, header, size)
+    return max(size, len(header))
+
+
+def _game_name(rng: random.Random, index: int) -> str:
+    words = rng.sample(_NAME_WORDS, rng.randrange(1, 3))
+    return f"{' '.join(words)} {index}"
+
+
+def _nested(game_dir: Path, depth: int, kind_dir: str) -> Path:
+    """游戏目录之下再按类型和分卷建立目录，直到达到指定层数"""
+    path = game_dir
+    for level in range(depth - 1):
+        path = path / (kind_dir if level == 0 else f"part{level}")
+    return path
+
+
+def generate_library(root: Path, shape: LibraryShape = LibraryShape()) -> List[SyntheticFile]:
+    """在root下生成合成游戏库，返回生成的游戏文件"""
+    rng = random.Random(shape.seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    files = []
+
+    def size_of(mb: float) -> int:
+        # 大小在±10%之间变化，避免所有文件大小相同
+        return max(0x10000, int(mb * MB * rng.uniform(0.9, 1.1)))
+
+    def ext(uncompressed: str, compressed: str) -> str:
+        return compressed if rng.random() < shape.compressed_ratio else uncompressed
+
+    for i in range(shape.games):
+        game = _game_name(rng, i)
+        base_int = 0x0100000000000000 + ((i + 1) << 13)
+        base_id = f"{base_int:016X}"
+        game_dir = root / game if shape.depth > 0 else root
+
+        # 基础游戏
+        if rng.random() < 0.5:
+            name = f"[XCI][HK][{base_id}][1.0.0][14.0.0].{ext('xci', 'xcz')}"
+        else:
+            name = f"{game} [{base_id}][v0].{ext('nsp', 'nsz')}"
+        path = _nested(game_dir, shape.depth, 'xci本体') / name
+        files.append(SyntheticFile(path, base_id, 'base', _write_container(rng, path, base_id, size_of(shape.base_mb))))
+
+        # 更新，版本号为 1.0.n，内部版本为 n << 16
+        update_id = f"{base_int + 0x800:016X}"
+        for n in range(1, shape.updates + 1):
+            version = n << 16
+            if rng.random() < 0.7:
+                name = f"[UPD][v1.0.{n}][{update_id}][v{version}].{ext('nsp', 'nsz')}"
+            else:
+                name = f"{game} [{update_id}][v{version}] (Update).nsp"
+            path = _nested(game_dir, shape.depth, f"upd-v1.0.{n}") / name
+            files.append(SyntheticFile(path, update_id, 'update',
+                                       _write_container(rng, path, update_id, size_of(shape.update_mb))))
+
+        # DLC
+        for k in range(1, shape.dlcs + 1):
+            dlc_id = f"{base_int + 0x1000 + k:016X}"
+            if rng.random() < 0.7:
+                name = f"[DLC][{dlc_id}][v0].{ext('nsp', 'nsz')}"
+            else:
+                name = f"{game} DLC{k} [{dlc_id}][v0].nsp"
+            path = _nested(game_dir, shape.depth, 'dlc') / name
+            files.append(SyntheticFile(path, dlc_id, 'dlc',
+                                       _write_container(rng, path, dlc_id, size_of(shape.dlc_mb))))
+
+        # 无关文件，扫描时应被忽略
+        if rng.random() < shape.extras_ratio:
+            game_dir.mkdir(parents=True, exist_ok=True)
+            (game_dir / f"说明_{i}.txt").write_text(game, encoding='utf-8')
+            (game_dir / f"cover_{i}.jpg").touch()
+
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成的Switch游戏库')
+    parser.add_argument('output', type=Path, help='输出目录')
+    defaults = LibraryShape()
+    for field in LibraryShape._fields:
+        default = getattr(defaults, field)
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    shape = LibraryShape(**{field: getattr(args, field) for field in LibraryShape._fields})
+    files = generate_library(args.output, shape)
+    total = sum(f.size for f in files)
+    print(f"生成 {len(files)} 个文件 ({shape.games} 个游戏)，逻辑大小 {total / MB:.1f} MB: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
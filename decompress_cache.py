@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict
+
+from fingerprint import quick_fingerprint
+from file_transfer import transfer_file
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 解压缓存默认位置
+DEFAULT_CACHE_DIR = Path('cache') / 'decompressed'
+
+GB = 1024 ** 3
+
+
+class DecompressCache:
+    """NSZ/XCZ解压结果的持久缓存
+
+    以源文件指纹（大小、修改时间、抽样哈希）为键保存解压后的文件，
+    总大小超过预算时按最近最少使用的顺序淘汰。
+    命中时优先用硬链接输出，同一磁盘上不需要复制数据。
+    """
+
+    def __init__(self, budget_bytes: int, cache_dir: Path = DEFAULT_CACHE_DIR):
+        self.budget_bytes = budget_bytes
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.index_path = self.cache_dir / 'index.json'
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict] = self._load_index()
+
+        # 本次运行的统计
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 丢弃文件已不存在的条目
+        return {key: entry for key, entry in entries.items() if (self.cache_dir / entry['file']).exists()}
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry['size'] for entry in self.entries.values())
+
+    @staticmethod
+    def key_for(source: Path) -> str:
+        """计算源文件的缓存键"""
+        return hashlib.blake2b(quick_fingerprint(source).encode(), digest_size=16).hexdigest()
+
+    def fetch(self, key: str, output: Path) -> bool:
+        """缓存命中时将解压结果输出到output并返回True"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or not (self.cache_dir / entry['file']).exists():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return False
+            entry['last_used'] = time.time()
+            self.hits += 1
+            self.bytes_saved += entry['size']
+            self._save_index()
+            cached_file = self.cache_dir / entry['file']
+
+        output.parent.mkdir(exist_ok=True, parents=True)
+        strategy = transfer_file(cached_file, output, 'auto', allow_symlink=False)
+        logger.info(f"解压缓存命中: {output.name} (方式: {strategy})")
+        return True
+
+    def store(self, key: str, source: Path, output: Path):
+        """将解压结果加入缓存，必要时淘汰旧条目"""
+        size = output.stat().st_size
+        if size > self.budget_bytes:
+            logger.info(f"{output.name} 大于缓存预算，不加入解压缓存")
+            return
+
+        with self._lock:
+            self._evict(self.budget_bytes - size)
+            cached_name = key + output.suffix.lower()
+            strategy = transfer_file(output, self.cache_dir / cached_name, 'auto', allow_symlink=False)
+            self.entries[key] = {
+                'file': cached_name,
+                'size': size,
+                'source': str(source),
+                'last_used': time.time(),
+            }
+            self._save_index()
+        logger.debug(f"已加入解压缓存: {output.name} (方式: {strategy})")
+
+    def _evict(self, target_bytes: int):
+        """按LRU顺序淘汰，直到缓存总大小不超过target_bytes"""
+        total = self.total_bytes
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= target_bytes:
+                break
+            try:
+                (self.cache_dir / entry['file']).unlink()
+            except FileNotFoundError:
+                pass
+            total -= entry['size']
+            del self.entries[key]
+            logger.info(f"淘汰解压缓存: {Path(entry['source']).name} ({entry['size'] / GB:.2f} GB)")
+
+    def report(self):
+        """输出命中统计"""
+        logger.info(f"解压缓存: 命中 {self.hits} 次，未命中 {self.misses} 次，"
+                    f"节省解压 {self.bytes_saved / GB:.2f} GB，"
+                    f"缓存占用 {self.total_bytes / GB:.2f}/{self.budget_bytes / GB:.2f} GB")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import logging
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from merge_scheduler import bind_game_context
+from tool_registry import ToolRegistry, ToolNotFoundError
+from decompress_cache import DecompressCache
+import ncz_engine
+from ncz_engine import NczError
+from profiler import Profiler, add_bytes
+from progress import ByteCallback, FileGrowthMonitor
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 默认并发解压数量等于CPU核心数
+DEFAULT_DECOMPRESS_WORKERS = os.cpu_count() or 1
+
+# 解压引擎: auto优先使用内置引擎、失败时改用nsz；builtin只用内置引擎；nsz只用外部nsz工具
+DECOMPRESS_ENGINES = ('auto', 'builtin', 'nsz')
+
+# 解压失败时在错误信息中保留的输出行数
+_OUTPUT_TAIL_LINES = 20
+
+
+class DecompressError(RuntimeError):
+    """解压失败（返回码非零、超时或未生成输出文件）"""
+
+
+class DecompressPool:
+    """NSZ/XCZ并发解压池
+
+    默认在进程内用zstandard解压（ncz_engine），不可用或失败时每个任务启动一个nsz进程，
+    输出逐行读取写入日志，支持超时（仅对nsz进程有效）。
+    submit返回Future，结果为解压后的文件路径，失败时抛出DecompressError。
+    提供cache时先查询解压缓存，命中则不进行解压。提供profiler时每个任务记为一个merge.decompress阶段。
+    线程池在第一次submit时才创建，asyncio引擎只使用缓存和引擎选择等方法，不会创建线程池。
+    """
+
+    def __init__(self, tools: ToolRegistry, max_workers: int = DEFAULT_DECOMPRESS_WORKERS,
+                 timeout: Optional[float] = None, cache: Optional[DecompressCache] = None,
+                 engine: str = 'auto', profiler: Optional[Profiler] = None):
+        if engine not in DECOMPRESS_ENGINES:
+            raise ValueError(f"不支持的解压引擎: {engine}")
+        self.tools = tools
+        self.engine = engine
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.cache = cache
+        self.profiler = profiler
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def submit(self, source: Path, output: Path, progress: Optional[ByteCallback] = None) -> Future:
+        """提交解压任务，output为期望得到的解压后文件路径
+
+        提供progress时根据输出文件的增长报告解压进度。
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='decompress')
+        return self._executor.submit(bind_game_context(self._run), Path(source), Path(output), progress)
+
+    def decompress(self, source: Path, output: Path) -> Path:
+        """同步解压"""
+        return self.submit(source, output).result()
+
+    def _run(self, source: Path, output: Path, progress: Optional[ByteCallback] = None) -> Path:
+        with FileGrowthMonitor(output, progress):
+            if self.profiler is None:
+                return self._decompress(source, output)
+            with self.profiler.phase('merge.decompress'):
+                return self._decompress(source, output)
+
+    def _decompress(self, source: Path, output: Path) -> Path:
+        output.parent.mkdir(exist_ok=True, parents=True)
+
+        hit, cache_key = self.lookup_cache(source, output)
+        if hit:
+            return output
+
+        if self.use_builtin():
+            try:
+                self.run_builtin(source, output)
+            except NczError as e:
+                if not self.can_fall_back():
+                    raise DecompressError(f"解压 {source.name} 失败: {str(e)}") from e
+                logger.warning(f"内置引擎无法解压 {source.name}: {str(e)}，改用nsz")
+                self._run_nsz(source, output)
+        elif self.tools.available('nsz'):
+            self._run_nsz(source, output)
+        else:
+            raise DecompressError(f"无法解压 {source.name}: 未安装zstandard模块，也找不到nsz工具")
+
+        self.store_cache(cache_key, source, output)
+        return output
+
+    def lookup_cache(self, source: Path, output: Path) -> Tuple[bool, Optional[str]]:
+        """查询解压缓存，命中时将缓存的文件放到output，返回(是否命中, 缓存键)"""
+        if not self.cache:
+            return False, None
+        cache_key = self.cache.key_for(source)
+        return self.cache.fetch(cache_key, output), cache_key
+
+    def store_cache(self, cache_key: Optional[str], source: Path, output: Path):
+        if not cache_key:
+            return
+        try:
+            self.cache.store(cache_key, source, output)
+        except OSError as e:
+            # 缓存失败不影响本次合并
+            logger.warning(f"加入解压缓存失败: {str(e)}")
+
+    def use_builtin(self) -> bool:
+        """是否先尝试内置引擎"""
+        return self.engine != 'nsz' and ncz_engine.AVAILABLE
+
+    def can_fall_back(self) -> bool:
+        """内置引擎失败时能否改用nsz"""
+        return self.engine != 'builtin' and self.tools.available('nsz')
+
+    def run_builtin(self, source: Path, output: Path):
+        start_time = time.perf_counter()
+        ncz_engine.decompress(source, output)
+        elapsed = time.perf_counter() - start_time
+        add_bytes(read=source.stat().st_size, written=output.stat().st_size)
+        logger.info(f"解压完成: {output.name} ({elapsed:.1f} 秒, 内置引擎)")
+
+    @staticmethod
+    def nsz_args(source: Path, output: Path) -> List:
+        """nsz的解压参数，nsz会在输出目录中生成同名的.nsp/.xci文件"""
+        return [
+            "-D", "-w",  # -w表示覆盖现有文件
+            "-o", output.parent,
+            source
+        ]
+
+    def _run_nsz(self, source: Path, output: Path):
+        args = self.nsz_args(source, output)
+
+        start_time = time.perf_counter()
+        timed_out = threading.Event()
+        tail = deque(maxlen=_OUTPUT_TAIL_LINES)
+        try:
+            with self.tools.process('nsz', args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, errors='replace', bufsize=1) as process:
+                timer = None
+                if self.timeout:
+                    def kill():
+                        timed_out.set()
+                        process.kill()
+                    timer = threading.Timer(self.timeout, kill)
+                    timer.daemon = True
+                    timer.start()
+
+                # 逐行读取输出，避免缓冲区写满阻塞子进程
+                try:
+                    for line in process.stdout:
+                        line = line.rstrip()
+                        if line:
+                            tail.append(line)
+                            logger.debug(f"NSZ输出: {line}")
+                    returncode = process.wait()
+                finally:
+                    if timer:
+                        timer.cancel()
+                    process.stdout.close()
+        except (ToolNotFoundError, OSError) as e:
+            raise DecompressError(f"无法运行nsz: {str(e)}") from e
+
+        elapsed = time.perf_counter() - start_time
+        if timed_out.is_set():
+            raise DecompressError(f"解压 {source.name} 超时 ({self.timeout:.0f} 秒)")
+        if returncode != 0:
+            raise DecompressError(f"解压 {source.name} 失败 (返回码 {returncode}): " + " | ".join(tail))
+        if not output.exists():
+            raise DecompressError(f"解压 {source.name} 后未找到输出文件 {output}: " + " | ".join(tail))
+        add_bytes(read=source.stat().st_size, written=output.stat().st_size)
+
+        logger.info(f"解压完成: {output.name} ({elapsed:.1f} 秒)")
+
+    def shutdown(self, wait: bool = True):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
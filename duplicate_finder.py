@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from file_record import FileRecord
+from fingerprint import Fingerprinter, sampled_hash
+
+logger = logging.getLogger('SwitchRomMerger')
+
+
+class DuplicateGroup(NamedTuple):
+    """内容完全相同的一组文件"""
+    size: int
+    digest: str
+    paths: List[Path]
+
+    @property
+    def wasted_bytes(self) -> int:
+        return self.size * (len(self.paths) - 1)
+
+
+def _group(items: Iterable, key) -> List[List]:
+    """按key分组，只保留至少有两个成员的组"""
+    buckets: Dict = defaultdict(list)
+    for item in items:
+        buckets[key(item)].append(item)
+    return [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+
+def _file_identity(record: FileRecord) -> Optional[Tuple[int, int]]:
+    """文件的 (设备号, inode)，遍历时未获得设备号（Windows）的文件单独stat，无法访问时返回None"""
+    if record.device:
+        return record.device, record.inode
+    try:
+        st = os.stat(record.path)
+    except OSError as e:
+        logger.warning(f"无法读取文件 {record.path}: {str(e)}")
+        return None
+    return st.st_dev, st.st_ino or record.inode
+
+
+def find_duplicates(records: List[FileRecord], fingerprinter: Fingerprinter) -> List[DuplicateGroup]:
+    """查找内容相同的文件
+
+    先按大小分桶，大小唯一的文件不可能重复；再比较抽样哈希，
+    只有抽样哈希也相同的文件才计算完整哈希确认。
+    已经互为硬链接的文件（同一设备上的同一inode）只算一个。
+    """
+    # 第1步: 按大小分桶，同一大小内按(设备号, inode)去掉已经是硬链接的文件，
+    # 不同磁盘上的inode号相同并不代表是同一个文件
+    candidates = []
+    for bucket in _group(records, lambda r: r.size):
+        unique = {}
+        for record in bucket:
+            identity = _file_identity(record)
+            if identity is None:
+                continue
+            unique.setdefault(identity, record)
+        if len(unique) > 1:
+            candidates.extend(unique.values())
+    logger.info(f"重复检测: {len(records)} 个文件中 {len(candidates)} 个存在大小相同的文件")
+
+    # 第2步: 抽样哈希
+    sampled = []
+    for record in candidates:
+        try:
+            sampled.append((record, sampled_hash(record.path)))
+        except OSError as e:
+            logger.warning(f"无法读取文件 {record.path}: {str(e)}")
+    sampled_groups = _group(sampled, lambda item: (item[0].size, item[1]))
+    to_hash = [record for bucket in sampled_groups for record, _ in bucket]
+    logger.info(f"重复检测: 抽样哈希后剩余 {len(to_hash)} 个候选文件，计算完整哈希确认")
+
+    # 第3步: 完整哈希确认
+    digests = fingerprinter.full_hashes(record.path for record in to_hash)
+    hashed = [(record, digests[record.path]) for record in to_hash if record.path in digests]
+    groups = [
+        DuplicateGroup(bucket[0][0].size, bucket[0][1], sorted(record.path for record, _ in bucket))
+        for bucket in _group(hashed, lambda item: (item[0].size, item[1]))
+    ]
+    groups.sort(key=lambda group: group.wasted_bytes, reverse=True)
+    return groups
+
+
+def hardlink_duplicates(groups: List[DuplicateGroup], within: Path) -> Tuple[int, int]:
+    """将位于within目录下的重复文件替换为指向同组第一个文件的硬链接
+
+    返回 (替换的文件数, 释放的字节数)。不同设备上的文件无法硬链接，会被跳过；
+    被替换的文件还有其他硬链接（如--link-mode hardlink的输出）时数据仍然保留，不计入释放的字节数。
+    """
+    within = Path(within).absolute()
+    linked = freed = 0
+    for group in groups:
+        members = [path for path in group.paths if within in Path(path).absolute().parents]
+        if len(members) < 2:
+            continue
+        target = members[0]
+        for path in members[1:]:
+            part = path.with_name(path.name + '.part')
+            try:
+                links = os.stat(path).st_nlink
+                os.link(target, part)
+                os.replace(part, path)
+            except OSError as e:
+                if part.exists():
+                    part.unlink()
+                logger.warning(f"创建硬链接失败 {path}: {str(e)}")
+                continue
+            linked += 1
+            if links == 1:
+                freed += group.size
+            logger.info(f"已硬链接: {path} -> {target}")
+    return linked, freed
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+# 全局stat调用计数: 遍历时创建FileRecord和读取文件头时的stat/fstat都会计入，
+# 用于观察扫描流程中实际的stat次数（使用扫描索引时每个文件只有遍历时的一次）
+_stat_lock = threading.Lock()
+_stat_calls = 0
+
+
+def count_stat():
+    """记录一次stat调用"""
+    global _stat_calls
+    with _stat_lock:
+        _stat_calls += 1
+
+
+def fstat(fd: int) -> os.stat_result:
+    """os.fstat并记录一次stat调用"""
+    count_stat()
+    return os.fstat(fd)
+
+
+def stat_calls() -> int:
+    """返回目前为止记录的stat调用次数"""
+    return _stat_calls
+
+
+class FileRecord:
+    """扫描得到的单个文件记录
+
+    遍历目录时一次性记录路径、大小、修改时间、inode和设备号，后续解析出的
+    Title ID、类型和版本号也保存在这里，整个扫描和合并流程传递该记录，
+    不再对同一个文件重复stat。
+    """
+
+    __slots__ = ('path', 'size', 'mtime_ns', 'inode', 'title_id', 'kind', 'version', 'device')
+
+    def __init__(self, path: Path, size: int, mtime_ns: int, inode: int,
+                 title_id: Optional[str] = None, kind: Optional[str] = None,
+                 version: Optional[str] = None, device: int = 0):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.title_id = title_id
+        self.kind = kind
+        self.version = version
+        # 设备号，Windows上遍历目录时无法直接获得，为0
+        self.device = device
+
+    @classmethod
+    def from_stat(cls, path: Path, st: os.stat_result) -> 'FileRecord':
+        return cls(path, st.st_size, st.st_mtime_ns, st.st_ino, device=st.st_dev)
+
+    @classmethod
+    def from_entry(cls, entry: os.DirEntry) -> 'FileRecord':
+        """从os.scandir的DirEntry创建记录"""
+        st = entry.stat()
+        count_stat()
+        # Windows上DirEntry.stat()不含inode，需要inode()单独获取
+        return cls(Path(entry.path), st.st_size, st.st_mtime_ns, st.st_ino or entry.inode(), device=st.st_dev)
+
+    @classmethod
+    def from_path(cls, path: Path) -> 'FileRecord':
+        st = path.stat()
+        count_stat()
+        return cls.from_stat(path, st)
+
+    @property
+    def mtime(self) -> float:
+        return self.mtime_ns / 1e9
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @property
+    def suffix(self) -> str:
+        return self.path.suffix
+
+    def __fspath__(self) -> str:
+        return os.fspath(self.path)
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    def __repr__(self) -> str:
+        return f"FileRecord({str(self.path)!r}, size={self.size})"
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, FileRecord):
+            return self.path == other.path
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    def __lt__(self, other: 'FileRecord') -> bool:
+        return self.path < other.path
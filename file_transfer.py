@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import errno
+import shutil
+import logging
+from pathlib import Path
+from typing import Optional
+
+import profiler
+from progress import ByteCallback
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 可选的输出方式
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'auto')
+
+# Linux FICLONE ioctl，btrfs/XFS等文件系统上创建写时复制的副本
+FICLONE = 0x40049409
+
+# 内核复制时每次调用的最大字节数
+_KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+# 需要报告进度时普通复制每次读写的字节数
+_COPY_CHUNK = 8 * 1024 * 1024
+
+
+def _reflink(src: Path, dst: Path):
+    """创建reflink（写时复制，不占用额外空间）"""
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "当前系统不支持reflink")
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def kernel_copy(src: Path, dst: Path, progress: Optional[ByteCallback] = None) -> str:
+    """在内核中复制数据（copy_file_range/sendfile），不支持时退回到普通复制
+
+    每复制一块调用一次progress(字节数)。
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+
+        for name in ('copy_file_range', 'sendfile'):
+            func = getattr(os, name, None)
+            if func is None or not sys.platform.startswith('linux'):
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    count = min(_KERNEL_COPY_CHUNK, size - offset)
+                    if name == 'copy_file_range':
+                        sent = func(in_fd, out_fd, count, offset, offset)
+                    else:
+                        sent = func(out_fd, in_fd, offset, count)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    if progress:
+                        progress(sent)
+            except OSError as e:
+                # 跨文件系统（旧内核）或文件系统不支持时尝试下一种方式
+                if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                               errno.EOPNOTSUPP, errno.EPERM):
+                    continue
+                raise
+            if offset == size:
+                shutil.copystat(src, dst)
+                profiler.add_bytes(read=size, written=size)
+                return name
+            # 数据不完整（例如文件被截断），从头用普通复制
+            fdst.seek(0)
+            fdst.truncate()
+            fsrc.seek(0)
+            if progress and offset:
+                progress(-offset)
+            break
+
+        if progress:
+            while True:
+                chunk = fsrc.read(_COPY_CHUNK)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                progress(len(chunk))
+        else:
+            shutil.copyfileobj(fsrc, fdst, _KERNEL_COPY_CHUNK)
+    shutil.copystat(src, dst)
+    profiler.add_bytes(read=size, written=size)
+    return 'copy'
+
+
+def _same_device(src: Path, dst: Path) -> bool:
+    try:
+        return os.stat(src).st_dev == os.stat(dst.parent).st_dev
+    except OSError:
+        return False
+
+
+def transfer_file(src: Path, dst: Path, mode: str = 'copy', allow_symlink: bool = True,
+                  progress: Optional[ByteCallback] = None) -> str:
+    """按指定方式将src输出到dst，返回实际使用的方式
+
+    mode:
+      copy     - 复制数据（优先使用内核复制）
+      hardlink - 硬链接，失败时复制
+      reflink  - 写时复制的克隆，失败时复制
+      symlink  - 符号链接，失败时复制
+      auto     - 依次尝试 reflink、硬链接（同一设备）、内核复制
+    allow_symlink为False时（如源文件位于会被清理的临时目录），symlink模式按auto处理。
+    progress为字节进度回调，复制时按块调用，链接方式完成后一次性报告整个文件的大小。
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"不支持的输出方式: {mode}")
+    src, dst = Path(src), Path(dst)
+
+    # 先写入.part文件，完成后原子重命名，中断时不会留下不完整的目标文件
+    part = dst.with_name(dst.name + '.part')
+    if part.is_symlink() or part.exists():
+        part.unlink()
+    try:
+        strategy = _transfer(src, part, mode, allow_symlink, progress)
+        os.replace(part, dst)
+    except BaseException:
+        if part.is_symlink() or part.exists():
+            part.unlink()
+        raise
+    # dst原本就是src的硬链接时rename不会做任何事，需要删除残留的.part
+    if part.is_symlink() or part.exists():
+        part.unlink()
+    return strategy
+
+
+def _transfer(src: Path, dst: Path, mode: str, allow_symlink: bool, progress: Optional[ByteCallback]) -> str:
+    strategy = _link(src, dst, mode, allow_symlink)
+    if strategy is None:
+        return kernel_copy(src, dst, progress)
+    if progress:
+        progress(os.stat(src).st_size)
+    return strategy
+
+
+def _link(src: Path, dst: Path, mode: str, allow_symlink: bool) -> Optional[str]:
+    """按mode尝试各种链接方式，都不可用时返回None"""
+    if mode == 'symlink' and not allow_symlink:
+        mode = 'auto'
+
+    if mode == 'symlink':
+        try:
+            os.symlink(src.absolute(), dst)
+            return 'symlink'
+        except OSError as e:
+            logger.debug(f"创建符号链接失败，改为复制: {str(e)}")
+
+    if mode in ('reflink', 'auto'):
+        try:
+            _reflink(src, dst)
+            return 'reflink'
+        except OSError as e:
+            logger.debug(f"reflink失败: {str(e)}")
+
+    if mode == 'hardlink' or (mode == 'auto' and _same_device(src, dst)):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as e:
+            logger.debug(f"创建硬链接失败，改为复制: {str(e)}")
+
+    return None
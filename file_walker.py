@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import FrozenSet, Iterable, List, Tuple
+
+from file_record import FileRecord
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 目录遍历线程数，网络共享和USB设备上多线程可以重叠IO延迟
+DEFAULT_WALK_WORKERS = min(16, (os.cpu_count() or 1) * 4)
+
+
+def _scan_one(directory: str, extensions: frozenset,
+              exclude: FrozenSet[str] = frozenset()) -> Tuple[List[FileRecord], List[str]]:
+    """扫描单个目录，返回匹配的文件和子目录列表，exclude中的目录（绝对路径）不返回"""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    # 与rglob一致，不进入符号链接目录
+                    if entry.is_dir(follow_symlinks=False):
+                        if not exclude or os.path.abspath(entry.path) not in exclude:
+                            subdirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                        # DirEntry会缓存stat结果（Windows上无需额外系统调用）
+                        files.append(FileRecord.from_entry(entry))
+                except OSError as e:
+                    logger.warning(f"无法读取 {entry.path}: {str(e)}")
+    except OSError as e:
+        logger.warning(f"无法访问目录 {directory}: {str(e)}")
+    return files, subdirs
+
+
+def walk_files(directory: Path, extensions: Iterable[str],
+               max_workers: int = DEFAULT_WALK_WORKERS, exclude: Iterable[Path] = ()) -> List[FileRecord]:
+    """单次遍历目录树，返回扩展名匹配（不区分大小写）的文件记录
+
+    子目录会分发到线程池中并发扫描，结果按路径排序保证输出稳定。exclude中的目录不进入。
+    """
+    exts = frozenset(ext.lower() for ext in extensions)
+    excluded = frozenset(os.path.abspath(path) for path in exclude)
+    results = []
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        pending = {pool.submit(_scan_one, str(directory), exts, excluded)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                results.extend(files)
+                for subdir in subdirs:
+                    pending.add(pool.submit(_scan_one, subdir, exts, excluded))
+
+    results.sort(key=lambda record: record.path)
+    return results
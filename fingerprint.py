@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""分级文件指纹
+
+第1级: 文件大小 + 修改时间，只需要stat
+第2级: 抽样哈希，读取开头、中间和结尾各一块
+第3级: 完整BLAKE2b，使用大缓冲区在线程池中并行计算，结果持久化保存
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 抽样哈希时每个位置读取的块大小
+SAMPLE_BLOCK_SIZE = 1024 * 1024
+
+# 完整哈希的读取缓冲区大小
+FULL_HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+# 完整哈希数据库默认位置
+DEFAULT_HASH_DB_PATH = Path('cache') / 'fingerprints.db'
+
+# hashlib计算大块数据时会释放GIL，线程数取决于磁盘而不是CPU
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def stat_fingerprint(path: Path) -> Tuple[int, int]:
+    """第1级指纹: (大小, 修改时间)"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def sampled_hash(path: Path, block_size: int = SAMPLE_BLOCK_SIZE) -> str:
+    """第2级指纹: 读取文件开头、中间和结尾各一块计算BLAKE2b，多GB文件也只需读取几MB"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, 'little'))
+        if size <= block_size * 3:
+            h.update(f.read())
+        else:
+            for offset in (0, (size - block_size) // 2, size - block_size):
+                f.seek(offset)
+                h.update(f.read(block_size))
+    return h.hexdigest()
+
+
+def quick_fingerprint(path: Path) -> str:
+    """文件大小 + 修改时间 + 抽样哈希组成的快速指纹"""
+    size, mtime_ns = stat_fingerprint(path)
+    return f"{size:x}-{mtime_ns:x}-{sampled_hash(path)}"
+
+
+def full_hash(path: Path, buffer_size: int = FULL_HASH_BUFFER_SIZE) -> str:
+    """第3级指纹: 完整文件的BLAKE2b"""
+    h = hashlib.blake2b()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+class _DeviceStats:
+    """单个设备上的哈希统计，用首个任务开始到最后一个任务结束的时间计算吞吐量"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = None
+        self.end = None
+
+    def add(self, size: int, start: float, end: float):
+        self.files += 1
+        self.bytes += size
+        self.start = start if self.start is None else min(self.start, start)
+        self.end = end if self.end is None else max(self.end, end)
+
+    @property
+    def mb_per_second(self) -> float:
+        elapsed = (self.end - self.start) if self.start is not None else 0
+        return self.bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+
+
+class Fingerprinter:
+    """完整哈希计算与持久化
+
+    以路径为键保存 (大小, 修改时间, inode, 哈希)，第1级指纹未变化时直接复用，
+    否则在线程池中并行计算完整哈希。按设备统计哈希吞吐量。
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path: Path = DEFAULT_HASH_DB_PATH, max_workers: int = DEFAULT_HASH_WORKERS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.max_workers = max(1, max_workers)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+        self._stats_lock = threading.Lock()
+        self.device_stats: Dict[int, _DeviceStats] = {}
+        self.reused = 0
+
+    def _init_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS hashes")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS hashes (
+                path     TEXT PRIMARY KEY,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode    INTEGER NOT NULL,
+                digest   TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def _lookup(self, path: Path, st: os.stat_result) -> Optional[str]:
+        row = self.conn.execute("SELECT size, mtime_ns, inode, digest FROM hashes WHERE path = ?",
+                                (str(path),)).fetchone()
+        if row and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return row[3]
+        return None
+
+    def _hash_one(self, path: Path, st: os.stat_result) -> str:
+        start = time.perf_counter()
+        digest = full_hash(path)
+        end = time.perf_counter()
+        with self._stats_lock:
+            self.device_stats.setdefault(st.st_dev, _DeviceStats()).add(st.st_size, start, end)
+        return digest
+
+    def full_hashes(self, paths: Iterable[Path]) -> Dict[Path, str]:
+        """返回 {路径: 完整哈希}，无法读取的文件会被忽略"""
+        results = {}
+        todo = []
+        for path in paths:
+            path = Path(path)
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                logger.warning(f"无法读取文件 {path}: {str(e)}")
+                continue
+            digest = self._lookup(path, st)
+            if digest:
+                self.reused += 1
+                results[path] = digest
+            else:
+                todo.append((path, st))
+
+        if not todo:
+            return results
+
+        rows = []
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hash') as executor:
+            futures = {executor.submit(self._hash_one, path, st): (path, st) for path, st in todo}
+            for future in as_completed(futures):
+                path, st = futures[future]
+                try:
+                    digest = future.result()
+                except OSError as e:
+                    logger.warning(f"计算哈希失败 {path}: {str(e)}")
+                    continue
+                results[path] = digest
+                rows.append((str(path), st.st_size, st.st_mtime_ns, st.st_ino, digest))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        return results
+
+    def report(self):
+        """输出每个设备的哈希吞吐量"""
+        if self.reused:
+            logger.info(f"完整哈希: 复用已保存的结果 {self.reused} 个")
+        for device, stats in sorted(self.device_stats.items()):
+            logger.info(f"完整哈希 设备 {device:#x}: {stats.files} 个文件, "
+                        f"{stats.bytes / 1024 ** 3:.2f} GB, {stats.mb_per_second:.1f} MB/s")
+
+    def close(self):
+        self.conn.close()
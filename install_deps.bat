@@ -23,7 +23,7 @@ python -m pip install --upgrade pip --trusted-host pypi.org --trusted-host files
 
 :: 安装依赖
 echo 安装依赖库...
-python -m pip install tqdm py7zr pillow --trusted-host pypi.org --trusted-host files.pythonhosted.org
+python -m pip install tqdm pillow zstandard pycryptodomex --trusted-host pypi.org --trusted-host files.pythonhosted.org
 
 echo.
 echo 依赖安装完成！
@@ -23,7 +23,7 @@ python -m pip install --upgrade pip -i https://pypi.tuna.tsinghua.edu.cn/simple
 
 :: 安装依赖
 echo 安装依赖库(使用清华镜像)...
-python -m pip install tqdm py7zr pillow -i https://pypi.tuna.tsinghua.edu.cn/simple
+python -m pip install tqdm pillow zstandard pycryptodomex -i https://pypi.tuna.tsinghua.edu.cn/simple
 
 echo.
 echo 依赖安装完成！
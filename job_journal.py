@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 任务日志默认位置
+DEFAULT_JOB_JOURNAL_PATH = Path('cache') / 'job_journal.jsonl'
+
+
+class JobJournal:
+    """批量合并的预写日志
+
+    每个游戏的每个步骤（解压、输出基础游戏、输出更新、输出DLC）开始前写入begin记录，
+    输出文件重命名到最终位置后写入done记录，记录均立即落盘。
+    使用--resume继续时，已完成且源文件与输出文件都未变化的步骤直接跳过，不会重新读取数据。
+    移动模式下完成后源文件已不在原位置，这类步骤按记录的输出文件状态判断是否完成。
+    """
+
+    def __init__(self, path: Path = DEFAULT_JOB_JOURNAL_PATH, resume: bool = False):
+        self.path = Path(path)
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._completed: Dict[Tuple[str, str], Dict] = {}
+        # 步骤开始时的源文件状态（移动模式下完成后源文件已不存在）
+        self._started: Dict[Tuple[str, str], Tuple[int, int]] = {}
+
+        # 本次运行跳过的步骤统计
+        self.resumed_steps = 0
+        self.resumed_bytes = 0
+
+    def start_batch(self):
+        """开始新的批次: 继续模式下加载已完成的步骤，否则清空旧日志"""
+        self.resumed_steps = 0
+        self.resumed_bytes = 0
+        if self.resume:
+            self._completed = self._load()
+            if self._completed:
+                logger.info(f"任务日志中有 {len(self._completed)} 个已完成的步骤，将从中断处继续")
+        else:
+            self._completed = {}
+            self.clear()
+
+    def _load(self) -> Dict[Tuple[str, str], Dict]:
+        completed = {}
+        if not self.path.exists():
+            return completed
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 最后一行可能因中断而不完整
+                    continue
+                key = (entry['game'], entry['output'])
+                if entry['state'] == 'done':
+                    completed[key] = entry
+                else:
+                    completed.pop(key, None)
+        return completed
+
+    def _append(self, entry: Dict):
+        with self._lock:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _source_stat(source: Path) -> Tuple[int, int]:
+        st = os.stat(source)
+        return st.st_size, st.st_mtime_ns
+
+    def is_done(self, game: str, source: Path, output: Path) -> bool:
+        """步骤在上次运行中已完成，且源文件和输出文件都未变化
+
+        已移动的步骤不检查源文件（已不存在），只要求源路径上没有文件（未被移回）且输出文件未变化。
+        """
+        entry = self._completed.get((game, str(output)))
+        if entry is None:
+            return False
+        try:
+            if entry.get('moved'):
+                if os.path.exists(source):
+                    return False
+                if list(self._source_stat(output)) != entry['output_stat']:
+                    return False
+            else:
+                if list(self._source_stat(source)) != entry['source_stat']:
+                    return False
+                if os.stat(output).st_size != entry['size']:
+                    return False
+        except OSError:
+            return False
+        with self._lock:
+            self.resumed_steps += 1
+            self.resumed_bytes += entry['size']
+        return True
+
+    def begin(self, game: str, step: str, source: Path, output: Path):
+        with self._lock:
+            self._started[(game, str(output))] = self._source_stat(source)
+        self._append({'game': game, 'step': step, 'state': 'begin',
+                      'source': str(source), 'output': str(output)})
+
+    def done(self, game: str, step: str, source: Path, output: Path, moved: bool = False):
+        """记录步骤完成，moved表示源文件已被移动到output"""
+        with self._lock:
+            source_stat = self._started.pop((game, str(output)))
+        st = os.stat(output)
+        entry = {'game': game, 'step': step, 'state': 'done',
+                 'source': str(source), 'source_stat': list(source_stat),
+                 'output': str(output), 'size': st.st_size}
+        if moved:
+            entry['moved'] = True
+            entry['output_stat'] = [st.st_size, st.st_mtime_ns]
+        self._append(entry)
+
+    def moved_sources(self) -> List[Tuple[Path, os.stat_result]]:
+        """上次运行中已移动到输出目录的源文件: [(原路径, 输出文件的stat)]
+
+        扫描时据此补回已经不在游戏目录中的文件，继续时游戏的文件组成与中断前一致。
+        """
+        moved = []
+        for entry in self._load().values():
+            if not entry.get('moved') or os.path.exists(entry['source']):
+                continue
+            try:
+                st = os.stat(entry['output'])
+            except OSError:
+                continue
+            if [st.st_size, st.st_mtime_ns] == entry['output_stat']:
+                moved.append((Path(entry['source']), st))
+        return moved
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
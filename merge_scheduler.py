@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 当前线程（asyncio引擎中为当前任务）正在处理的游戏，用于日志前缀和错误收集
+_current_game = contextvars.ContextVar('game', default=None)
+
+
+class GameResult(NamedTuple):
+    """单个游戏的合并结果"""
+    group_id: str
+    name: str
+    success: bool
+    errors: Tuple[str, ...]
+
+
+class _GameContext:
+    def __init__(self, prefix: str, name: str):
+        self.prefix = prefix
+        self.name = name
+        self.errors = []
+
+
+def current_game_prefix() -> Optional[str]:
+    """返回当前线程绑定的游戏日志前缀"""
+    context = _current_game.get()
+    return context.prefix if context else None
+
+
+def current_game_name() -> Optional[str]:
+    """返回当前线程绑定的游戏名称"""
+    context = _current_game.get()
+    return context.name if context else None
+
+
+@contextmanager
+def game_context(prefix: str, name: str) -> Iterator[_GameContext]:
+    """在with块内将当前线程（或asyncio任务）绑定到一个游戏"""
+    context = _GameContext(prefix, name)
+    token = _current_game.set(context)
+    try:
+        yield context
+    finally:
+        _current_game.reset(token)
+
+
+def bind_game_context(func: Callable) -> Callable:
+    """将当前线程的游戏上下文绑定到func，供提交到其他线程池的任务使用"""
+    context = _current_game.get()
+    if context is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_game.set(context)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_game.reset(token)
+    return wrapper
+
+
+def game_prefix(index: int, total: int, name: str) -> str:
+    """日志前缀 [序号/总数 游戏名]"""
+    return f"[{index + 1:0{len(str(total))}d}/{total} {name}]"
+
+
+class GameLogFilter(logging.Filter):
+    """为并发合并时的日志加上游戏前缀，并收集每个游戏的错误信息"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _current_game.get()
+        if context is not None and not getattr(record, 'game_prefix', None):
+            message = record.getMessage()
+            record.game_prefix = context.prefix
+            record.msg = f"{context.prefix} {message}"
+            record.args = None
+            if record.levelno >= logging.ERROR and not message.startswith('Traceback'):
+                # 只保留第一行，traceback留在完整日志中
+                context.errors.append(message.splitlines()[0] if message else message)
+        return True
+
+
+_log_filter = GameLogFilter()
+logger.addFilter(_log_filter)
+
+
+class MergeScheduler:
+    """并发执行多个游戏的合并任务
+
+    每个游戏是一个独立的工作单元（各自使用 temp/<游戏名> 临时目录），
+    日志带有固定的 [序号/总数 游戏名] 前缀，所有游戏完成后汇总错误。
+    """
+
+    def __init__(self, merge_func: Callable[[str, Dict], bool], jobs: int = 1):
+        self.merge_func = merge_func
+        self.jobs = max(1, jobs)
+
+    def _run_one(self, prefix: str, group_id: str, files_dict: Dict) -> GameResult:
+        with game_context(prefix, files_dict['name']) as context:
+            try:
+                success = bool(self.merge_func(group_id, files_dict))
+            except Exception as e:
+                logger.error(f"合并游戏 {files_dict['name']} 时出错: {str(e)}")
+                success = False
+        return GameResult(group_id, files_dict['name'], success and not context.errors, tuple(context.errors))
+
+    def run(self, games: List[Tuple[str, Dict]], on_done: Optional[Callable[[GameResult], None]] = None
+            ) -> List[GameResult]:
+        """合并所有游戏，返回按输入顺序排列的结果"""
+        total = len(games)
+        results: List[Optional[GameResult]] = [None] * total
+
+        if self.jobs > 1:
+            logger.info(f"并发合并 {total} 个游戏，并发数: {self.jobs}")
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {}
+            for i, (group_id, files_dict) in enumerate(games):
+                prefix = game_prefix(i, total, files_dict['name'])
+                futures[pool.submit(self._run_one, prefix, group_id, files_dict)] = i
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if on_done:
+                    on_done(result)
+
+        self.report(results)
+        return results
+
+    @staticmethod
+    def report(results: List[GameResult]):
+        """输出汇总信息"""
+        failed = [result for result in results if not result.success]
+        logger.info(f"合并完成: 成功 {len(results) - len(failed)} 个，失败 {len(failed)} 个")
+        for result in failed:
+            logger.error(f"  失败: {result.name} (ID: {result.group_id})")
+            for error in result.errors[:3]:
+                logger.error(f"    {error}")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import errno
+import logging
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+from file_transfer import kernel_copy
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 移动日志默认位置
+DEFAULT_JOURNAL_PATH = Path('cache') / 'move_journal.jsonl'
+
+
+class MoveJournal:
+    """移动模式的回滚日志
+
+    每次移动前写入begin记录，完成后写入done记录，记录均立即落盘。
+    运行中断或需要撤销时，按相反顺序把文件移回原位置。
+    """
+
+    def __init__(self, path: Path = DEFAULT_JOURNAL_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def _append(self, op: str, src: Path, dst: Path):
+        with self._lock:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'op': op, 'src': str(Path(src).absolute()),
+                                    'dst': str(Path(dst).absolute())}, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def entries(self) -> List[Tuple[Path, Path, bool]]:
+        """返回 [(源路径, 目标路径, 是否完成)]，按移动顺序排列"""
+        if not self.path.exists():
+            return []
+        moves = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 最后一行可能因中断而不完整
+                    continue
+                key = (entry['src'], entry['dst'])
+                moves[key] = entry['op'] == 'done'
+        return [(Path(src), Path(dst), done) for (src, dst), done in moves.items()]
+
+    def move(self, src: Path, dst: Path) -> str:
+        """移动文件，返回使用的方式
+
+        同一设备上使用原子的os.replace，跨设备时先复制再删除源文件。
+        """
+        src, dst = Path(src), Path(dst)
+        self._append('begin', src, dst)
+        try:
+            os.replace(src, dst)
+            strategy = 'rename'
+        except OSError as e:
+            if not _is_cross_device(e):
+                raise
+            part = dst.with_name(dst.name + '.part')
+            kernel_copy(src, part)
+            os.replace(part, dst)
+            os.unlink(src)
+            strategy = 'copy+unlink'
+        self._append('done', src, dst)
+        return strategy
+
+    def rollback(self) -> Tuple[int, int]:
+        """把日志中记录的文件移回原位置，返回 (恢复数, 失败数)"""
+        restored = failed = 0
+        for src, dst, done in reversed(self.entries()):
+            try:
+                part = dst.with_name(dst.name + '.part')
+                if part.exists():
+                    part.unlink()
+                if src.exists():
+                    # 源文件还在（移动未完成），只需删除可能残留的目标文件
+                    if not done and dst.exists() and not os.path.samefile(src, dst):
+                        dst.unlink()
+                    continue
+                if not dst.exists():
+                    logger.warning(f"无法恢复 {src}: {dst} 已不存在")
+                    failed += 1
+                    continue
+                src.parent.mkdir(exist_ok=True, parents=True)
+                try:
+                    os.replace(dst, src)
+                except OSError as e:
+                    if not _is_cross_device(e):
+                        raise
+                    kernel_copy(dst, src)
+                    os.unlink(dst)
+                restored += 1
+                logger.info(f"已恢复: {src}")
+            except OSError as e:
+                logger.error(f"恢复 {src} 失败: {str(e)}")
+                failed += 1
+
+        if not failed:
+            self.clear()
+        return restored, failed
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+def _is_cross_device(error: OSError) -> bool:
+    # Windows上跨盘移动的错误码为ERROR_NOT_SAME_DEVICE(17)
+    return error.errno == errno.EXDEV or getattr(error, 'winerror', None) == 17
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+# Title ID: 优先匹配 [0100000000000XXX]，其次匹配不在括号内的 0100000000000XXX
+_TITLE_ID_BRACKET_RE = re.compile(r'\[([0-9A-Fa-f]{16})\]')
+_TITLE_ID_BARE_RE = re.compile(r'(?<!\[)([0-9A-Fa-f]{16})(?!\])')
+
+# 版本号格式，按优先级排列
+_VERSION_RES = [
+    re.compile(r'v(\d+\.\d+(\.\d+)?)'),   # v1.2.3 格式
+    re.compile(r'v(\d+_\d+(_\d+)?)'),     # v1_2_3 格式
+    re.compile(r'[vV](\d+)'),             # v1 格式
+    re.compile(r'(\d+\.\d+(\.\d+)?)'),    # 1.2.3 格式
+    re.compile(r'(\d+_\d+(_\d+)?)'),      # 1_2_3 格式
+]
+
+# 清理游戏名称：一次性移除方括号、圆括号内容和版本号
+_NAME_NOISE_RE = re.compile(r'\[.*?\]|\(.*?\)|v\d+(?:\.\d+)*')
+
+# 文件名中表示更新的关键字
+_UPDATE_KEYWORDS = ('upd', 'update', '更新', 'patch', '补丁', 'v1.', 'v2.')
+
+# 解析结果缓存大小，足够覆盖大型游戏库
+PARSE_CACHE_SIZE = 1 << 17
+
+
+class ParsedName(NamedTuple):
+    """文件路径的解析结果"""
+    title_id: Optional[str]
+    version: Optional[str]
+    version_tuple: Tuple[int, int, int]
+    is_update: bool
+    is_dlc: bool
+    display_name: str
+
+    @property
+    def kind(self) -> str:
+        """文件类型: dlc / update / base"""
+        if self.is_dlc:
+            return 'dlc'
+        if self.is_update:
+            return 'update'
+        return 'base'
+
+
+def extract_title_id(text: str) -> Optional[str]:
+    """从字符串中提取Title ID"""
+    match = _TITLE_ID_BRACKET_RE.search(text) or _TITLE_ID_BARE_RE.search(text)
+    return match.group(1).upper() if match else None
+
+
+def extract_version(text: str) -> Optional[str]:
+    """从字符串中提取版本号，统一为以.分隔的格式"""
+    for pattern in _VERSION_RES:
+        match = pattern.search(text)
+        if match:
+            return match.group(1).replace('_', '.')
+    return None
+
+
+@lru_cache(maxsize=1024)
+def parse_version_tuple(version: Optional[str]) -> Tuple[int, int, int]:
+    """将版本号解析为三元组以便比较，无法解析时返回 (0, 0, 0)"""
+    if not version:
+        return (0, 0, 0)
+    try:
+        parts = [int(part) for part in version.split('.')[:3]]
+    except ValueError:
+        return (0, 0, 0)
+    return tuple(parts + [0] * (3 - len(parts)))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_name(path_str: str) -> ParsedName:
+    """一次性解析文件路径，得到Title ID、版本号、类型和显示名称
+
+    结果会被缓存，相同路径的重复解析（如重新扫描）不再执行正则匹配。
+    """
+    filename = os.path.basename(path_str)
+    lower_path = path_str.lower()
+    lower_name = filename.lower()
+
+    title_id = extract_title_id(path_str)
+    version = extract_version(path_str)
+
+    # DLC: 路径中包含dlc关键字，或Title ID以00X结尾（X > 0）
+    is_dlc = 'dlc' in lower_path or bool(
+        title_id and title_id[13:15] == '00' and title_id[15] != '0')
+
+    # 更新: 文件名中包含更新关键字，或Title ID以800结尾
+    is_update = any(keyword in lower_name for keyword in _UPDATE_KEYWORDS) or bool(
+        title_id and title_id[13:] == '800')
+
+    # 从文件名中提取游戏名称，移除版本号、括号内容和Title ID
+    display_name = _NAME_NOISE_RE.sub('', filename)
+    if title_id:
+        display_name = display_name.replace(title_id, '')
+    display_name = display_name.strip('_.- ')
+
+    return ParsedName(title_id, version, parse_version_tuple(version),
+                      is_update, is_dlc, display_name)
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import math
+import struct
+import hashlib
+import logging
+import threading
+import functools
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+from file_record import fstat
+from rom_header import read_partition_table, read_xci_root
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 内置解压引擎是否可用，zstandard在第一次解压时才导入
+AVAILABLE = importlib.util.find_spec('zstandard') is not None
+
+# 同时解压的块数量
+DEFAULT_BLOCK_WORKERS = os.cpu_count() or 1
+
+# NCZ开头未压缩的NCA头大小
+NCA_HEADER_SIZE = 0x4000
+
+# 非块模式解压、复制普通文件时每次读写的大小
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 输出文件的写缓冲区大小，保证大块顺序写入
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+# XCI中分区和文件数据按0x200（媒体单元）对齐
+MEDIA_UNIT = 0x200
+
+# NCZ分段头: 偏移, 大小, 加密类型, 填充, 密钥, 计数器
+_SECTION = struct.Struct('<QQQQ16s16s')
+# NCZ块头: magic, 版本, 类型, 未使用, 块大小指数, 块数量, 解压后大小
+_BLOCK_HEADER = struct.Struct('<8sBBBBIQ')
+
+# 需要AES-CTR加密的分段类型（3: CTR, 4: BKTR）
+_CTR_CRYPTO_TYPES = (3, 4)
+
+# XCI头中的字段位置
+_XCI_VALID_DATA_END = 0x118
+_XCI_ROOT_HEADER_HASH = 0x140
+
+
+class NczError(RuntimeError):
+    """NCZ数据无效或解压结果校验失败"""
+
+
+class NczUnsupportedError(NczError):
+    """当前环境无法处理该文件（如缺少加密库）"""
+
+
+class _Section(NamedTuple):
+    offset: int
+    size: int
+    crypto_type: int
+    key: bytes
+    counter: bytes
+
+
+class _NczInfo(NamedTuple):
+    """容器中一个NCZ文件的结构"""
+    header: bytes                        # 原样保留的NCA头（0x4000字节）
+    sections: List[_Section]
+    nca_size: int
+    data_offset: int                     # 压缩数据在源文件中的绝对偏移
+    data_end: int
+    block_size: Optional[int]            # 块模式的块大小，None表示整体一个zstd流
+    block_sizes: Optional[List[int]]     # 每个块压缩后的大小
+
+
+def _read_exact(f: BinaryIO, length: int) -> bytes:
+    data = f.read(length)
+    if len(data) != length:
+        raise NczError(f"文件意外结束 (需要 {length} 字节，实际 {len(data)} 字节)")
+    return data
+
+
+def _parse_ncz(f: BinaryIO, offset: int, size: int) -> _NczInfo:
+    """解析位于源文件offset处、大小为size的NCZ"""
+    f.seek(offset)
+    header = _read_exact(f, NCA_HEADER_SIZE)
+    magic, section_count = struct.unpack('<8sQ', _read_exact(f, 16))
+    if magic != b'NCZSECTN':
+        raise NczError("找不到NCZSECTN，不是有效的NCZ文件")
+    if not 0 < section_count <= 0x100:
+        raise NczError(f"NCZ分段数量无效: {section_count}")
+
+    sections = []
+    for _ in range(section_count):
+        sec_offset, sec_size, crypto_type, _, key, counter = _SECTION.unpack(_read_exact(f, _SECTION.size))
+        sections.append(_Section(sec_offset, sec_size, crypto_type, key, counter))
+    sections.sort(key=lambda s: s.offset)
+    if sections[0].offset < NCA_HEADER_SIZE:
+        raise NczError(f"NCZ分段偏移无效: {sections[0].offset:#x}")
+    # NCA头之后、第一个分段之前的数据为明文
+    if sections[0].offset > NCA_HEADER_SIZE:
+        sections.insert(0, _Section(NCA_HEADER_SIZE, sections[0].offset - NCA_HEADER_SIZE, 1, b'', b''))
+    nca_size = max(s.offset + s.size for s in sections)
+
+    block_size = block_sizes = None
+    position = f.tell()
+    if f.read(8) == b'NCZBLOCK':
+        f.seek(position)
+        _, _, _, _, exponent, block_count, decompressed_size = _BLOCK_HEADER.unpack(
+            _read_exact(f, _BLOCK_HEADER.size))
+        if not 14 <= exponent <= 32:
+            raise NczError(f"NCZ块大小无效: 2^{exponent}")
+        block_size = 1 << exponent
+        if decompressed_size != nca_size - NCA_HEADER_SIZE:
+            raise NczError(f"NCZ块头中的解压后大小 {decompressed_size} 与分段大小 {nca_size - NCA_HEADER_SIZE} 不一致")
+        if block_count != math.ceil(decompressed_size / block_size):
+            raise NczError(f"NCZ块数量无效: {block_count}")
+        block_sizes = list(struct.unpack(f'<{block_count}I', _read_exact(f, 4 * block_count)))
+    else:
+        f.seek(position)
+
+    data_offset = f.tell()
+    data_end = offset + size
+    if block_sizes is not None and data_offset + sum(block_sizes) > data_end:
+        raise NczError("NCZ压缩数据超出文件范围")
+    return _NczInfo(header, sections, nca_size, data_offset, data_end, block_size, block_sizes)
+
+
+def _zstd():
+    import zstandard
+    return zstandard
+
+
+@functools.lru_cache(maxsize=None)
+def _aes():
+    """AES-CTR重新加密需要pycryptodomex或pycryptodome，只有加密的分段才需要，未安装时返回None"""
+    try:
+        from Cryptodome.Cipher import AES
+    except ImportError:
+        try:
+            from Crypto.Cipher import AES
+        except ImportError:
+            return None
+    return AES
+
+
+def _ctr_encrypt(section: _Section, nca_offset: int, data) -> bytes:
+    """AES-CTR加密，计数器为分段计数器的前8字节 + (NCA偏移 >> 4)（大端）"""
+    AES = _aes()
+    cipher = AES.new(section.key, AES.MODE_CTR, nonce=section.counter[:8], initial_value=nca_offset >> 4)
+    skip = nca_offset & 0xF
+    if skip:
+        cipher.encrypt(bytes(skip))
+    return cipher.encrypt(data)
+
+
+def _apply_crypto(data: bytes, nca_offset: int, sections: List[_Section]) -> bytes:
+    """对NCA中[nca_offset, nca_offset+len(data))范围内需要加密的部分重新加密"""
+    end = nca_offset + len(data)
+    result = None
+    for section in sections:
+        if section.crypto_type not in _CTR_CRYPTO_TYPES:
+            continue
+        lo = max(nca_offset, section.offset)
+        hi = min(end, section.offset + section.size)
+        if lo >= hi:
+            continue
+        if result is None:
+            result = bytearray(data)
+        result[lo - nca_offset:hi - nca_offset] = _ctr_encrypt(
+            section, lo, memoryview(result)[lo - nca_offset:hi - nca_offset])
+    return data if result is None else bytes(result)
+
+
+def _check_crypto(info: _NczInfo, name: str):
+    if _aes() is None and any(s.crypto_type in _CTR_CRYPTO_TYPES for s in info.sections):
+        raise NczUnsupportedError(f"{name} 包含加密分段，需要安装pycryptodome")
+
+
+_local = threading.local()
+
+
+def _dctx():
+    """每个工作线程复用自己的ZstdDecompressor（解压器对象不能跨线程共享）"""
+    dctx = getattr(_local, 'dctx', None)
+    if dctx is None:
+        dctx = _local.dctx = _zstd().ZstdDecompressor()
+    return dctx
+
+
+def _decompress_block(compressed: bytes, expected: int, nca_offset: int,
+                      sections: List[_Section]) -> bytes:
+    # 压缩后不小于原大小的块以原始数据保存
+    if len(compressed) < expected:
+        data = _dctx().decompress(compressed, max_output_size=expected)
+    else:
+        data = compressed[:expected]
+    if len(data) != expected:
+        raise NczError(f"NCZ块解压后大小错误 (偏移 {nca_offset:#x}: {len(data)} != {expected})")
+    return _apply_crypto(data, nca_offset, sections)
+
+
+class _NcaWriter:
+    """将一个NCZ还原为NCA写入输出流，同时计算SHA256用于校验"""
+
+    def __init__(self, src: BinaryIO, out: BinaryIO, executor: ThreadPoolExecutor, workers: int):
+        self.src = src
+        self.out = out
+        self.executor = executor
+        self.workers = workers
+
+    def write(self, info: _NczInfo, name: str):
+        _check_crypto(info, name)
+        sha = hashlib.sha256(info.header)
+        self.out.write(info.header)
+        try:
+            if info.block_sizes is not None:
+                written = self._write_blocks(info, sha)
+            else:
+                written = self._write_stream(info, sha)
+        except _zstd().ZstdError as e:
+            raise NczError(f"{name} 解压失败: {str(e)}") from e
+
+        if NCA_HEADER_SIZE + written != info.nca_size:
+            raise NczError(f"{name} 解压后大小错误 ({NCA_HEADER_SIZE + written} != {info.nca_size})")
+        # NCA文件名是其SHA256的前16字节
+        nca_id = name.split('.')[0].lower()
+        if len(nca_id) == 32 and sha.hexdigest()[:32] != nca_id:
+            raise NczError(f"{name} 解压后哈希校验失败")
+
+    def _write_blocks(self, info: _NczInfo, sha) -> int:
+        """块模式: 各块独立解压和加密，在线程池中并行处理，按顺序写出"""
+        total = info.nca_size - NCA_HEADER_SIZE
+        pending = deque()
+        written = 0
+        self.src.seek(info.data_offset)
+        for index, compressed_size in enumerate(info.block_sizes):
+            block_offset = index * info.block_size
+            expected = min(info.block_size, total - block_offset)
+            compressed = _read_exact(self.src, compressed_size)
+            pending.append(self.executor.submit(_decompress_block, compressed, expected,
+                                                NCA_HEADER_SIZE + block_offset, info.sections))
+            # 限制同时在内存中的块数量
+            if len(pending) >= self.workers * 2:
+                written += self._flush(pending.popleft().result(), sha)
+        while pending:
+            written += self._flush(pending.popleft().result(), sha)
+        return written
+
+    def _write_stream(self, info: _NczInfo, sha) -> int:
+        """非块模式: 整个数据区为一个zstd流，顺序解压"""
+        total = info.nca_size - NCA_HEADER_SIZE
+        written = 0
+        self.src.seek(info.data_offset)
+        reader = _zstd().ZstdDecompressor().stream_reader(
+            _BoundedReader(self.src, info.data_end - info.data_offset), read_size=STREAM_CHUNK_SIZE,
+            read_across_frames=True, closefd=False)
+        with reader:
+            while written < total:
+                chunk = reader.read(min(STREAM_CHUNK_SIZE, total - written))
+                if not chunk:
+                    break
+                written += self._flush(_apply_crypto(chunk, NCA_HEADER_SIZE + written, info.sections), sha)
+        return written
+
+    def _flush(self, data: bytes, sha) -> int:
+        sha.update(data)
+        self.out.write(data)
+        return len(data)
+
+
+class _BoundedReader:
+    """只允许读取源文件中当前位置起length字节的包装"""
+
+    def __init__(self, f: BinaryIO, length: int):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def _copy_range(src: BinaryIO, out: BinaryIO, offset: int, size: int):
+    src.seek(offset)
+    remaining = size
+    while remaining:
+        chunk = src.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise NczError("文件意外结束")
+        out.write(chunk)
+        remaining -= len(chunk)
+
+
+def _plan_files(src: BinaryIO, entries: List[Tuple[str, int, int]], data_start: int
+                ) -> List[Tuple[str, int, int, Optional[_NczInfo]]]:
+    """返回 [(输出文件名, 源偏移, 输出大小, NCZ信息或None)]"""
+    plan = []
+    for name, rel_offset, size in entries:
+        offset = data_start + rel_offset
+        if name.lower().endswith('.ncz'):
+            info = _parse_ncz(src, offset, size)
+            plan.append((name[:-4] + '.nca', offset, info.nca_size, info))
+        else:
+            plan.append((name, offset, size, None))
+    return plan
+
+
+def _pfs0_header(files: List[Tuple[str, int]]) -> bytes:
+    """生成PFS0头，字符串表补齐使头大小按0x10对齐（与nsz的输出一致）"""
+    string_table = b''.join(name.encode('utf-8') + b'\0' for name, _ in files)
+    header_size = 0x10 + len(files) * 0x18 + len(string_table)
+    padding = 0x10 - header_size % 0x10
+    header = struct.pack('<4sIII', b'PFS0', len(files), len(string_table) + padding, 0)
+    data_offset = name_offset = 0
+    for name, size in files:
+        header += struct.pack('<QQII', data_offset, size, name_offset, 0)
+        data_offset += size
+        name_offset += len(name.encode('utf-8')) + 1
+    return header + string_table + bytes(padding)
+
+
+def _hfs0_header(files: List[Tuple[str, int, int, bytes]]) -> Tuple[bytes, List[int]]:
+    """生成HFS0头，files为 [(文件名, 大小, 哈希区域大小, SHA256)]
+
+    数据按媒体单元对齐，返回 (分区头, 每个文件相对数据区的偏移)。
+    """
+    string_table = b''.join(name.encode('utf-8') + b'\0' for name, _, _, _ in files)
+    header_size = 0x10 + len(files) * 0x40 + len(string_table)
+    string_table += bytes(-header_size % MEDIA_UNIT)
+    header = struct.pack('<4sIII', b'HFS0', len(files), len(string_table), 0)
+    offsets = []
+    data_offset = name_offset = 0
+    for name, size, hash_size, digest in files:
+        offsets.append(data_offset)
+        header += struct.pack('<QQIIQ32s', data_offset, size, name_offset, hash_size, 0, digest)
+        data_offset += size + (-size % MEDIA_UNIT)
+        name_offset += len(name.encode('utf-8')) + 1
+    return header + string_table, offsets
+
+
+def _open_output(output: Path) -> BinaryIO:
+    output.parent.mkdir(exist_ok=True, parents=True)
+    return open(output, 'wb', buffering=WRITE_BUFFER_SIZE)
+
+
+def decompress_nsz(source: Path, output: Path, workers: int = DEFAULT_BLOCK_WORKERS) -> Path:
+    """将NSZ还原为NSP: NCZ还原为NCA，其余文件原样复制，重新生成PFS0头"""
+    if not AVAILABLE:
+        raise NczUnsupportedError("未安装zstandard模块")
+    with open(source, 'rb') as src:
+        entries, header_size = read_partition_table(src, 0, 'PFS0')
+        plan = _plan_files(src, entries, header_size)
+        header = _pfs0_header([(name, size) for name, _, size, _ in plan])
+        expected_size = len(header) + sum(size for _, _, size, _ in plan)
+
+        try:
+            with _open_output(output) as out, \
+                    ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ncz') as executor:
+                writer = _NcaWriter(src, out, executor, workers)
+                out.write(header)
+                for name, offset, size, info in plan:
+                    if info is not None:
+                        writer.write(info, name)
+                    else:
+                        _copy_range(src, out, offset, size)
+            if output.stat().st_size != expected_size:
+                raise NczError(f"输出文件大小错误 ({output.stat().st_size} != {expected_size})")
+        except BaseException:
+            if output.exists():
+                output.unlink()
+            raise
+    return output
+
+
+def _first_bytes(src: BinaryIO, offset: int, length: int) -> bytes:
+    src.seek(offset)
+    return src.read(length)
+
+
+def decompress_xcz(source: Path, output: Path, workers: int = DEFAULT_BLOCK_WORKERS) -> Path:
+    """将XCZ还原为XCI
+
+    保留卡带头和除secure以外的分区，secure分区中的NCZ还原为NCA后重新生成HFS0头，
+    并更新根分区头、卡带头中的根分区头哈希和有效数据结束地址。
+    卡带头的签名不会重新计算（nsz的输出同样如此）。
+    """
+    if not AVAILABLE:
+        raise NczUnsupportedError("未安装zstandard模块")
+    with open(source, 'rb') as src:
+        root_offset, partitions, root_header_size = read_xci_root(src)
+        root_data_start = root_offset + root_header_size
+
+        # 规划secure分区，HFS0条目的哈希为每个文件开头（最多0x200字节）的SHA256
+        secure_plan = None
+        for name, rel_offset, size in partitions:
+            if name == 'secure':
+                secure_start = root_data_start + rel_offset
+                entries, secure_header_size = read_partition_table(src, secure_start, 'HFS0')
+                secure_plan = _plan_files(src, entries, secure_start + secure_header_size)
+        if secure_plan is None:
+            raise NczError("XCZ中找不到secure分区")
+
+        secure_files = []
+        for name, offset, size, info in secure_plan:
+            hash_size = min(MEDIA_UNIT, size)
+            head = info.header[:hash_size] if info is not None else _first_bytes(src, offset, hash_size)
+            secure_files.append((name, size, hash_size, hashlib.sha256(head).digest()))
+        secure_header, secure_offsets = _hfs0_header(secure_files)
+        secure_size = len(secure_header)
+        if secure_files:
+            secure_size += secure_offsets[-1] + secure_files[-1][1]
+
+        # 重新生成根分区头，其他分区的头（作为哈希区域）原样保留
+        root_files = []
+        for name, rel_offset, size in partitions:
+            if name == 'secure':
+                root_files.append((name, secure_size, len(secure_header), hashlib.sha256(secure_header).digest()))
+            else:
+                sub_start = root_data_start + rel_offset
+                _, sub_header_size = read_partition_table(src, sub_start, 'HFS0')
+                root_files.append((name, size, sub_header_size,
+                                   hashlib.sha256(_first_bytes(src, sub_start, sub_header_size)).digest()))
+        root_header, root_offsets = _hfs0_header(root_files)
+        # 根分区头大小发生变化时数据区整体后移，卡带头中的大小字段也需要更新
+        new_root_data_start = root_offset + len(root_header)
+        total_size = new_root_data_start + root_offsets[-1] + root_files[-1][1]
+
+        src.seek(0)
+        card_header = bytearray(_read_exact(src, root_offset))
+        struct.pack_into('<QQ', card_header, 0x130, root_offset, len(root_header))
+        card_header[_XCI_ROOT_HEADER_HASH:_XCI_ROOT_HEADER_HASH + 0x20] = hashlib.sha256(root_header).digest()
+        struct.pack_into('<I', card_header, _XCI_VALID_DATA_END, math.ceil(total_size / MEDIA_UNIT) - 1)
+
+        try:
+            with _open_output(output) as out, \
+                    ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ncz') as executor:
+                writer = _NcaWriter(src, out, executor, workers)
+                out.write(card_header)
+                out.write(root_header)
+                for (name, rel_offset, size), new_offset in zip(partitions, root_offsets):
+                    _pad_to(out, new_root_data_start + new_offset)
+                    if name != 'secure':
+                        _copy_range(src, out, root_data_start + rel_offset, size)
+                        continue
+                    secure_out_start = out.tell()
+                    out.write(secure_header)
+                    for (file_name, offset, file_size, info), file_offset in zip(secure_plan, secure_offsets):
+                        _pad_to(out, secure_out_start + len(secure_header) + file_offset)
+                        if info is not None:
+                            writer.write(info, file_name)
+                        else:
+                            _copy_range(src, out, offset, file_size)
+            if output.stat().st_size != total_size:
+                raise NczError(f"输出文件大小错误 ({output.stat().st_size} != {total_size})")
+        except BaseException:
+            if output.exists():
+                output.unlink()
+            raise
+    return output
+
+
+def _pad_to(out: BinaryIO, position: int):
+    current = out.tell()
+    if current > position:
+        raise NczError(f"输出位置错误 ({current:#x} > {position:#x})")
+    if current < position:
+        out.write(bytes(position - current))
+
+
+def decompressed_size(source: Path) -> Optional[int]:
+    """估计NSZ/XCZ解压后的大小（源文件大小加上各NCZ还原为NCA后增加的大小），只读取文件头
+
+    不需要zstandard，无法解析时返回None。
+    """
+    suffix = Path(source).suffix.lower()
+    try:
+        with open(source, 'rb') as src:
+            size = fstat(src.fileno()).st_size
+            if suffix == '.nsz':
+                entries, data_start = read_partition_table(src, 0, 'PFS0')
+            elif suffix == '.xcz':
+                root_offset, partitions, root_header_size = read_xci_root(src)
+                for name, rel_offset, _ in partitions:
+                    if name == 'secure':
+                        secure_start = root_offset + root_header_size + rel_offset
+                        entries, secure_header_size = read_partition_table(src, secure_start, 'HFS0')
+                        data_start = secure_start + secure_header_size
+                        break
+                else:
+                    return None
+            else:
+                return None
+            for name, rel_offset, entry_size in entries:
+                if name.lower().endswith('.ncz'):
+                    size += _parse_ncz(src, data_start + rel_offset, entry_size).nca_size - entry_size
+            return size
+    except (OSError, ValueError, struct.error, NczError):
+        return None
+
+
+def decompress(source: Path, output: Path, workers: int = DEFAULT_BLOCK_WORKERS) -> Path:
+    """按扩展名解压NSZ或XCZ，容器结构无效时抛出NczError"""
+    suffix = Path(source).suffix.lower()
+    try:
+        if suffix == '.nsz':
+            return decompress_nsz(Path(source), Path(output), workers)
+        if suffix == '.xcz':
+            return decompress_xcz(Path(source), Path(output), workers)
+    except (ValueError, struct.error) as e:
+        raise NczError(f"无法解析 {Path(source).name}: {str(e)}") from e
+    raise NczUnsupportedError(f"不支持的文件类型: {suffix}")
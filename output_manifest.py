@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from file_record import FileRecord
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 清单格式版本，格式变化时旧清单全部视为不匹配
+MANIFEST_VERSION = 1
+
+# 平铺模式下清单集中保存的目录
+FLAT_MANIFEST_DIR = '.manifests'
+
+# 非平铺模式下游戏目录中的清单文件名
+MANIFEST_NAME = '.manifest.json'
+
+
+class OutputManifest:
+    """单个游戏的输出清单
+
+    记录合并时使用的源文件指纹（路径、大小、修改时间）、选中的更新、DLC列表和输出文件。
+    再次运行时输入与输出都未变化的游戏可以直接跳过。
+    """
+
+    def __init__(self, path: Path, sources: List[Tuple[str, FileRecord]],
+                 latest_update: Optional[FileRecord], dlcs: List[FileRecord], options: Dict):
+        self.path = path
+        self.data = {
+            'version': MANIFEST_VERSION,
+            'sources': [{'role': role, 'path': str(record.path), 'size': record.size,
+                         'mtime_ns': record.mtime_ns} for role, record in sources],
+            'update': str(latest_update.path) if latest_update else None,
+            'dlcs': sorted(str(record.path) for record in dlcs),
+            'options': options,
+            'outputs': [],
+        }
+
+    @staticmethod
+    def path_for(output_dir: Path, output_game_dir: Path, game_name: str, flat_output: bool) -> Path:
+        if flat_output:
+            return output_dir / FLAT_MANIFEST_DIR / f"{game_name}.json"
+        return output_game_dir / MANIFEST_NAME
+
+    def load_previous(self) -> Optional[Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_up_to_date(self, previous: Optional[Dict]) -> bool:
+        """上次的清单与本次输入一致，且所有输出文件仍然存在且大小未变"""
+        if not previous:
+            return False
+        for key in ('version', 'sources', 'update', 'dlcs', 'options'):
+            if previous.get(key) != self.data[key]:
+                return False
+        for output in previous.get('outputs', []):
+            try:
+                if os.stat(output['path']).st_size != output['size']:
+                    return False
+            except OSError:
+                return False
+        return bool(previous.get('outputs'))
+
+    @staticmethod
+    def output_bytes(manifest: Dict) -> int:
+        return sum(output['size'] for output in manifest.get('outputs', []))
+
+    def invalidate(self):
+        """开始重新合并前删除旧清单，合并中断时不会被误认为已完成"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def save(self, outputs: List[Path]):
+        self.data['outputs'] = [{'path': str(path), 'size': os.stat(path).st_size} for path in outputs]
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from file_record import stat_calls
+from merge_scheduler import current_game_name
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 扫描阶段可选的详细分析方式
+SCAN_CAPTURES = ('cprofile', 'tracemalloc')
+
+# 详细分析结果中保留的条目数
+_CAPTURE_TOP = 25
+
+# stat调用次数只在扫描阶段统计: 计数来自遍历和读取文件头，合并阶段的stat没有计数
+_STAT_PHASE_PREFIX = 'scan.'
+
+# 当前线程中正在进行的阶段，读写字节数和外部进程耗时记到最内层的阶段上
+_local = threading.local()
+
+
+class PhaseStats:
+    """一个阶段的累计数据"""
+    __slots__ = ('count', 'seconds', 'bytes_read', 'bytes_written', 'subprocess_seconds', 'stat_calls')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.subprocess_seconds = 0.0
+        self.stat_calls = 0
+
+    def add(self, other: 'PhaseStats'):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_dict(self, with_stat_calls: bool = False) -> Dict:
+        result = {
+            'count': self.count,
+            'seconds': round(self.seconds, 6),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'subprocess_seconds': round(self.subprocess_seconds, 6),
+        }
+        if with_stat_calls:
+            result['stat_calls'] = self.stat_calls
+        return result
+
+
+def counts_stat_calls(name: str) -> bool:
+    """该阶段是否统计stat调用次数"""
+    return name.startswith(_STAT_PHASE_PREFIX)
+
+
+class Phase:
+    """进行中的阶段，由Profiler.begin创建"""
+
+    def __init__(self, name: str, game: Optional[str]):
+        self.name = name
+        self.game = game
+        self.stats = PhaseStats()
+        self.stats.count = 1
+        self._start = time.perf_counter()
+        self._stat_start = stat_calls()
+
+    def add_bytes(self, read: int = 0, written: int = 0):
+        self.stats.bytes_read += read
+        self.stats.bytes_written += written
+
+
+def _stack() -> List[Phase]:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def add_bytes(read: int = 0, written: int = 0):
+    """将读写的字节数记到当前线程最内层的阶段，没有进行中的阶段时不记录"""
+    stack = _stack()
+    if stack:
+        stack[-1].add_bytes(read, written)
+
+
+def add_subprocess_time(seconds: float):
+    """将外部进程的运行时间记到当前线程最内层的阶段"""
+    stack = _stack()
+    if stack:
+        stack[-1].stats.subprocess_seconds += seconds
+
+
+class Profiler:
+    """按阶段统计扫描和合并的耗时
+
+    每个阶段记录耗时、读写字节数和外部进程耗时，扫描阶段另外记录stat调用次数，合并阶段按游戏分别汇总。
+    阶段可以在任意线程中开始，字节数和外部进程耗时只记到同一线程最内层的阶段上；
+    stat调用次数为扫描时（遍历和读取文件头）的全局计数差值，合并阶段不计数，报告中不包含该项。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.phases: Dict[str, PhaseStats] = {}
+        self.games: Dict[str, Dict[str, PhaseStats]] = {}
+        self.game_results: Dict[str, Dict] = {}
+        self.captures: Dict[str, Dict] = {}
+
+    def begin(self, name: str, game: Optional[str] = None) -> Phase:
+        """开始一个阶段，未指定游戏时使用当前线程正在合并的游戏"""
+        phase = Phase(name, game if game is not None else current_game_name())
+        _stack().append(phase)
+        return phase
+
+    def end(self, phase: Phase):
+        stack = _stack()
+        if phase in stack:
+            stack.remove(phase)
+        phase.stats.seconds = time.perf_counter() - phase._start
+        if counts_stat_calls(phase.name):
+            phase.stats.stat_calls = stat_calls() - phase._stat_start
+        with self._lock:
+            self.phases.setdefault(phase.name, PhaseStats()).add(phase.stats)
+            if phase.game is not None:
+                self.games.setdefault(phase.game, {}).setdefault(phase.name, PhaseStats()).add(phase.stats)
+
+    @contextmanager
+    def phase(self, name: str, game: Optional[str] = None) -> Iterator[Phase]:
+        phase = self.begin(name, game)
+        try:
+            yield phase
+        finally:
+            self.end(phase)
+
+    def record_game(self, game: str, seconds: float, success: bool):
+        """记录一个游戏的总耗时和结果"""
+        with self._lock:
+            self.game_results[game] = {'seconds': round(seconds, 6), 'success': success}
+
+    @contextmanager
+    def capture(self, mode: str, name: str, dump_path: Optional[Path] = None) -> Iterator[None]:
+        """用cProfile或tracemalloc详细分析一段代码，结果保存在captures[name]中
+
+        cProfile的原始数据另存到dump_path，可用pstats或snakeviz查看。
+        """
+        if mode == 'cprofile':
+            import cProfile
+            import pstats
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                if dump_path:
+                    profile.dump_stats(str(dump_path))
+                stats = pstats.Stats(profile)
+                rows = []
+                for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+                    rows.append({'function': f"{Path(filename).name}:{line}({function})", 'calls': calls,
+                                 'tottime': round(tottime, 6), 'cumtime': round(cumtime, 6)})
+                rows.sort(key=lambda row: -row['cumtime'])
+                self.captures[name] = {'mode': mode, 'dump': str(dump_path) if dump_path else None,
+                                       'top_cumulative': rows[:_CAPTURE_TOP]}
+        elif mode == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                top = [{'location': f"{Path(stat.traceback[0].filename).name}:{stat.traceback[0].lineno}",
+                        'size_bytes': stat.size, 'count': stat.count}
+                       for stat in snapshot.statistics('lineno')[:_CAPTURE_TOP]]
+                self.captures[name] = {'mode': mode, 'current_bytes': current, 'peak_bytes': peak,
+                                       'top_allocations': top}
+        else:
+            raise ValueError(f"不支持的分析方式: {mode}")
+
+    def report(self) -> Dict:
+        with self._lock:
+            games = {}
+            for game in sorted(set(self.games) | set(self.game_results)):
+                phases = self.games.get(game, {})
+                total = PhaseStats()
+                for stats in phases.values():
+                    total.add(stats)
+                games[game] = dict(self.game_results.get(game, {}),
+                                   bytes_read=total.bytes_read, bytes_written=total.bytes_written,
+                                   subprocess_seconds=round(total.subprocess_seconds, 6),
+                                   phases={name: stats.to_dict(counts_stat_calls(name))
+                                           for name, stats in phases.items()})
+            return {
+                'command': sys.argv,
+                'total_seconds': round(time.perf_counter() - self._start, 6),
+                'phases': {name: stats.to_dict(counts_stat_calls(name)) for name, stats in self.phases.items()},
+                'games': games,
+                'captures': self.captures,
+            }
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        logger.info(f"性能报告已保存: {path}")
+
+    def log_summary(self):
+        """在日志中输出各阶段耗时"""
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: -item[1].seconds)
+        for name, stats in phases:
+            stat_text = f", stat {stats.stat_calls} 次" if counts_stat_calls(name) else ""
+            logger.info(f"  {name}: {stats.seconds:.3f} 秒 ({stats.count} 次), "
+                        f"读 {stats.bytes_read / 1048576:.1f} MB, 写 {stats.bytes_written / 1048576:.1f} MB, "
+                        f"外部进程 {stats.subprocess_seconds:.3f} 秒{stat_text}")
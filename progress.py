@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# 字节进度回调，参数为新增的字节数（回退时为负数）
+ByteCallback = Callable[[int], None]
+
+# 两次进度事件之间的最小间隔（秒）
+DEFAULT_EMIT_INTERVAL = 0.25
+
+# 计算速度时使用最近多少秒内的数据
+_RATE_WINDOW = 5.0
+
+# 监视解压输出文件大小的间隔（秒）
+_MONITOR_INTERVAL = 0.5
+
+
+class ProgressEvent(NamedTuple):
+    """进度事件，同时提供当前游戏和整个批次的进度"""
+    game: Optional[str]
+    game_done: int               # 当前游戏已完成的字节数
+    game_total: int
+    game_rate: float             # 当前游戏的速度（字节/秒）
+    game_eta: Optional[float]    # 当前游戏的剩余时间（秒），无法估计时为None
+    done: int                    # 整个批次已完成的字节数
+    total: int
+    rate: float
+    eta: Optional[float]
+    finished: bool               # 当前游戏是否已完成
+
+    @property
+    def game_percent(self) -> float:
+        return 100.0 * self.game_done / self.game_total if self.game_total else 100.0
+
+    @property
+    def percent(self) -> float:
+        return 100.0 * self.done / self.total if self.total else 100.0
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def describe(event: ProgressEvent) -> str:
+    """进度事件的简短描述，供命令行进度条和GUI状态栏共用"""
+    text = (f"总进度 {event.percent:.1f}% {event.rate / 1048576:.1f} MB/s "
+            f"剩余 {format_eta(event.eta)}")
+    if event.game:
+        text = (f"{event.game} {event.game_percent:.1f}% {event.game_rate / 1048576:.1f} MB/s "
+                f"剩余 {format_eta(event.game_eta)} | {text}")
+    return text
+
+
+class _Rate:
+    """最近一段时间内的平均速度"""
+
+    def __init__(self):
+        self.samples = deque()
+
+    def update(self, now: float, done: int) -> float:
+        self.samples.append((now, done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > _RATE_WINDOW:
+            self.samples.popleft()
+        start_time, start_done = self.samples[0]
+        if now - start_time <= 0:
+            return 0.0
+        return max(0.0, (done - start_done) / (now - start_time))
+
+
+class _GameProgress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.rate = _Rate()
+        self.finished = False
+
+
+class ProgressTracker:
+    """按字节统计合并进度
+
+    合并前为每个游戏登记预计要写入的字节数，复制和解压过程中通过回调累加已完成的字节数，
+    按游戏和整个批次计算速度和剩余时间，以ProgressEvent通知所有监听者（命令行进度条、GUI）。
+    监听者在产生进度的线程中被调用，需要自行切换到界面线程。
+    """
+
+    def __init__(self, emit_interval: float = DEFAULT_EMIT_INTERVAL):
+        self.emit_interval = emit_interval
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[ProgressEvent], None]] = []
+        self._games: Dict[str, _GameProgress] = {}
+        self._rate = _Rate()
+        self._last_emit = 0.0
+        self.total = 0
+        self.done = 0
+
+    def add_listener(self, listener: Callable[[ProgressEvent], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[ProgressEvent], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def reset(self):
+        with self._lock:
+            self._games.clear()
+            self._rate = _Rate()
+            self.total = 0
+            self.done = 0
+
+    def plan(self, game: str, total: int):
+        """登记一个游戏预计写入的字节数"""
+        with self._lock:
+            previous = self._games.get(game)
+            if previous:
+                self.total -= previous.total
+                self.done -= previous.done
+            self._games[game] = _GameProgress(total)
+            self.total += total
+
+    def adjust(self, game: str, delta: int):
+        """修正游戏的预计字节数（如解压后的大小与估计不同）"""
+        with self._lock:
+            progress = self._games.get(game)
+            if progress is None:
+                progress = self._games[game] = _GameProgress(0)
+            delta = max(delta, -progress.total)
+            progress.total += delta
+            self.total += delta
+
+    def advance(self, game: str, nbytes: int):
+        """累加已完成的字节数"""
+        if not nbytes:
+            return
+        with self._lock:
+            progress = self._games.get(game)
+            if progress is None:
+                progress = self._games[game] = _GameProgress(0)
+            progress.done += nbytes
+            self.done += nbytes
+        self._emit(game)
+
+    def callback(self, game: str) -> ByteCallback:
+        """返回累加到指定游戏的字节回调"""
+        return lambda nbytes: self.advance(game, nbytes)
+
+    def finish(self, game: str):
+        """游戏完成（包括跳过和失败），未完成的部分不再计入剩余时间"""
+        with self._lock:
+            progress = self._games.get(game)
+            if progress is not None:
+                # 实际写入的字节数与预计不同时，以实际为准
+                self.total += progress.done - progress.total
+                progress.total = progress.done
+                progress.finished = True
+        self._emit(game, force=True)
+
+    def _emit(self, game: Optional[str], force: bool = False):
+        if not self._listeners:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < self.emit_interval:
+                return
+            self._last_emit = now
+            rate = self._rate.update(now, self.done)
+            eta = (self.total - self.done) / rate if rate > 0 else None
+            progress = self._games.get(game) if game is not None else None
+            if progress is not None:
+                game_rate = progress.rate.update(now, progress.done)
+                game_eta = (progress.total - progress.done) / game_rate if game_rate > 0 else None
+                event = ProgressEvent(game, progress.done, progress.total, game_rate, game_eta,
+                                      self.done, self.total, rate, eta, progress.finished)
+            else:
+                event = ProgressEvent(None, 0, 0, 0.0, None, self.done, self.total, rate, eta, False)
+        for listener in list(self._listeners):
+            listener(event)
+
+
+class FileGrowthMonitor:
+    """在后台线程中定期检查文件大小，将增长的字节数报告给回调
+
+    用于无法直接获得进度的解压过程（外部nsz进程、内置引擎），文件被删除或截断时报告负数。
+    """
+
+    def __init__(self, path: Path, callback: Optional[ByteCallback], interval: float = _MONITOR_INTERVAL):
+        self.path = Path(path)
+        self.callback = callback
+        self.interval = interval
+        self.reported = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        try:
+            size = os.stat(self.path).st_size
+        except OSError:
+            size = 0
+        if size != self.reported:
+            delta, self.reported = size - self.reported, size
+            self.callback(delta)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def __enter__(self) -> 'FileGrowthMonitor':
+        if self.callback is not None:
+            self._thread = threading.Thread(target=self._run, name='progress-monitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.poll()
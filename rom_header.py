@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import mmap
+import struct
+import logging
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from file_record import fstat
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 文件头读取的上限，防止损坏的文件头导致读取大量数据
+MAX_HEADER_SIZE = 1 << 20
+
+# PFS0 (NSP/NSZ) 文件头: magic, 文件数, 字符串表大小, 保留
+_PFS0_HEADER = struct.Struct('<4sIII')
+# PFS0 文件条目: 数据偏移, 大小, 文件名偏移, 保留
+_PFS0_ENTRY = struct.Struct('<QQII')
+# HFS0 (XCI/XCZ分区) 文件头与PFS0相同，条目为 偏移, 大小, 文件名偏移, 哈希区域大小, 保留, SHA256
+_HFS0_ENTRY = struct.Struct('<QQIIQ32s')
+
+# XCI卡带头: 0x100处为HEAD魔数，0x130处为根HFS0分区的偏移和头大小
+_XCI_MAGIC_OFFSET = 0x100
+_XCI_ROOT_PARTITION = struct.Struct('<QQ')
+_XCI_ROOT_PARTITION_OFFSET = 0x130
+
+
+class HeaderInfo(NamedTuple):
+    """从容器文件头中读取到的信息"""
+    container: str              # PFS0 或 HFS0
+    entries: Tuple[str, ...]    # 容器内的文件名（XCI为secure分区）
+    title_ids: Tuple[str, ...]  # 从票据(.tik)文件名中得到的Title ID
+
+    @property
+    def has_cnmt(self) -> bool:
+        return any(name.endswith(('.cnmt.nca', '.cnmt.ncz')) for name in self.entries)
+
+
+def title_id_kind(title_id: str) -> str:
+    """根据Title ID的低12位判断类型: 000为基础游戏，800为更新，其余为DLC"""
+    low_bits = int(title_id, 16) & 0xFFF
+    if low_bits == 0:
+        return 'base'
+    if low_bits == 0x800:
+        return 'update'
+    return 'dlc'
+
+
+def base_title_id(title_id: str) -> str:
+    """计算基础游戏的Title ID
+
+    更新为 基础ID + 0x800，DLC为 基础ID + 0x1000 + 序号。
+    """
+    value = int(title_id, 16)
+    if value & 0xFFF in (0, 0x800):
+        return f"{value & ~0xFFF:016X}"
+    return f"{(value - 0x1000) & ~0xFFF:016X}"
+
+
+class _MappedFile:
+    """按需映射文件中的小窗口，只有访问到的页面会被读取"""
+
+    def __init__(self, f, size: int):
+        self.f = f
+        self.size = size
+
+    def read(self, offset: int, length: int) -> bytes:
+        if length <= 0 or length > MAX_HEADER_SIZE or offset < 0 or offset + length > self.size:
+            raise ValueError(f"文件头越界: offset={offset:#x}, length={length:#x}")
+        # mmap的偏移必须按分配粒度对齐
+        aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+        window = mmap.mmap(self.f.fileno(), offset - aligned + length,
+                           access=mmap.ACCESS_READ, offset=aligned)
+        try:
+            return window[offset - aligned:offset - aligned + length]
+        finally:
+            window.close()
+
+
+def _read_partition(mapped: _MappedFile, offset: int, magic: bytes, entry_struct: struct.Struct
+                    ) -> Tuple[List[Tuple[str, int, int]], int]:
+    """读取PFS0/HFS0分区头，返回 ([(文件名, 数据偏移, 大小)], 分区头大小)"""
+    header = mapped.read(offset, _PFS0_HEADER.size)
+    found_magic, count, string_table_size, _ = _PFS0_HEADER.unpack(header)
+    if found_magic != magic:
+        raise ValueError(f"魔数不匹配: {found_magic!r}")
+
+    table_offset = offset + _PFS0_HEADER.size
+    header_size = _PFS0_HEADER.size + count * entry_struct.size + string_table_size
+    # 空分区（如XCI中的normal分区）没有条目和字符串表
+    raw = mapped.read(table_offset, header_size - _PFS0_HEADER.size) if header_size > _PFS0_HEADER.size else b''
+    strings = raw[count * entry_struct.size:]
+
+    entries = []
+    for i in range(count):
+        fields = entry_struct.unpack_from(raw, i * entry_struct.size)
+        data_offset, size, name_offset = fields[0], fields[1], fields[2]
+        end = strings.find(b'\0', name_offset)
+        name = strings[name_offset:end if end >= 0 else None].decode('utf-8', 'replace')
+        entries.append((name, data_offset, size))
+    return entries, header_size
+
+
+def read_partition_table(f, offset: int, container: str) -> Tuple[List[Tuple[str, int, int]], int]:
+    """读取已打开文件中offset处的PFS0/HFS0分区头
+
+    返回 ([(文件名, 相对数据区的偏移, 大小)], 分区头大小)，数据区紧跟在分区头之后。
+    """
+    mapped = _MappedFile(f, fstat(f.fileno()).st_size)
+    if container == 'PFS0':
+        return _read_partition(mapped, offset, b'PFS0', _PFS0_ENTRY)
+    return _read_partition(mapped, offset, b'HFS0', _HFS0_ENTRY)
+
+
+def read_xci_root(f) -> Tuple[int, List[Tuple[str, int, int]], int]:
+    """读取XCI/XCZ的根HFS0分区，返回 (根分区偏移, [(分区名, 相对偏移, 大小)], 根分区头大小)"""
+    mapped = _MappedFile(f, fstat(f.fileno()).st_size)
+    if mapped.read(_XCI_MAGIC_OFFSET, 4) != b'HEAD':
+        raise ValueError("不是有效的XCI文件")
+    root_offset, _ = _XCI_ROOT_PARTITION.unpack(mapped.read(_XCI_ROOT_PARTITION_OFFSET, _XCI_ROOT_PARTITION.size))
+    partitions, root_header_size = _read_partition(mapped, root_offset, b'HFS0', _HFS0_ENTRY)
+    return root_offset, partitions, root_header_size
+
+
+def _ticket_title_ids(names: List[str]) -> Tuple[str, ...]:
+    """票据文件名为Rights ID（Title ID + 密钥版本），取前16位作为Title ID"""
+    title_ids = []
+    for name in names:
+        stem, _, ext = name.rpartition('.')
+        if ext.lower() == 'tik' and len(stem) == 32:
+            try:
+                int(stem, 16)
+            except ValueError:
+                continue
+            title_id = stem[:16].upper()
+            if title_id not in title_ids:
+                title_ids.append(title_id)
+    return tuple(title_ids)
+
+
+def read_header(file_path: Path) -> Optional[HeaderInfo]:
+    """读取NSP/NSZ (PFS0) 或 XCI/XCZ (HFS0) 的文件头
+
+    只映射文件开头和分区头所在的几KB，不读取实际数据，也不调用外部工具。
+    无法识别时返回None。
+    """
+    suffix = file_path.suffix.lower()
+    try:
+        with open(file_path, 'rb') as f:
+            size = fstat(f.fileno()).st_size
+            mapped = _MappedFile(f, size)
+
+            if suffix in ('.nsp', '.nsz'):
+                entries, _ = _read_partition(mapped, 0, b'PFS0', _PFS0_ENTRY)
+                names = [name for name, _, _ in entries]
+                return HeaderInfo('PFS0', tuple(names), _ticket_title_ids(names))
+
+            if suffix in ('.xci', '.xcz'):
+                if mapped.read(_XCI_MAGIC_OFFSET, 4) != b'HEAD':
+                    return None
+                root_offset, partitions, root_header_size = read_xci_root(f)
+                for name, data_offset, _ in partitions:
+                    if name == 'secure':
+                        secure_offset = root_offset + root_header_size + data_offset
+                        entries, _ = _read_partition(mapped, secure_offset, b'HFS0', _HFS0_ENTRY)
+                        names = [entry_name for entry_name, _, _ in entries]
+                        return HeaderInfo('HFS0', tuple(names), _ticket_title_ids(names))
+                return None
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug(f"无法读取文件头 {file_path}: {str(e)}")
+    return None
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from file_walker import walk_files
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 文件大小和修改时间保持不变多少秒后认为写入已完成
+DEFAULT_SETTLE_SECONDS = 10.0
+
+# 文件持续到达时，一批变化最多等待多少秒就开始处理已经稳定的文件
+DEFAULT_BATCH_WINDOW = 120.0
+
+# 轮询方式检查目录的间隔（秒）
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify事件
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE)
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 文件签名: (大小, 修改时间)，文件不存在时为None
+Signature = Optional[Tuple[int, int]]
+
+
+def _signature(path: Path) -> Signature:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class PollingBackend:
+    """定期遍历目录，比较文件大小和修改时间，适用于所有系统和网络共享"""
+
+    name = 'polling'
+
+    def __init__(self, directory: Path, extensions: Iterable[str], interval: float = DEFAULT_POLL_INTERVAL,
+                 exclude: Iterable[Path] = ()):
+        self.directory = Path(directory)
+        self.extensions = set(extensions)
+        self.interval = interval
+        self.exclude = list(exclude)
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        return {record.path: (record.size, record.mtime_ns)
+                for record in walk_files(self.directory, self.extensions, exclude=self.exclude)}
+
+    def wait(self, timeout: float) -> Optional[Set[Path]]:
+        """等待最多timeout秒，返回新增、修改或删除的文件"""
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {path for path, signature in snapshot.items() if self._snapshot.get(path) != signature}
+        changed.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyBackend:
+    """Linux inotify，递归监视所有子目录，新建的子目录自动加入监视，exclude中的目录除外
+
+    事件队列溢出时wait返回None，表示需要完整重新扫描。
+    """
+
+    name = 'inotify'
+
+    def __init__(self, directory: Path, extensions: Iterable[str], exclude: Iterable[Path] = ()):
+        # ctypes只在使用inotify时才导入
+        import ctypes
+        import ctypes.util
+        self.directory = Path(directory)
+        self.extensions = {ext.lower() for ext in extensions}
+        self._exclude = {os.path.abspath(path) for path in exclude}
+        self._get_errno = ctypes.get_errno
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1失败")
+        self._watches: Dict[int, str] = {}
+        self._add_tree(str(self.directory))
+
+    def _add_watch(self, directory: str) -> bool:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = self._get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify监视数量达到上限 (fs.inotify.max_user_watches)")
+            logger.warning(f"无法监视目录 {directory}: {os.strerror(error)}")
+            return False
+        self._watches[wd] = directory
+        return True
+
+    def _add_tree(self, directory: str) -> Set[Path]:
+        """监视directory及其子目录，返回其中已有的文件（监视建立前写入的文件不会产生事件）"""
+        files = set()
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            if not self._add_watch(current):
+                continue
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if os.path.abspath(entry.path) not in self._exclude:
+                                pending.append(entry.path)
+                        elif self._matches(entry.name):
+                            files.add(Path(entry.path))
+            except OSError as e:
+                logger.warning(f"无法访问目录 {current}: {str(e)}")
+        return files
+
+    def _matches(self, name: str) -> bool:
+        return os.path.splitext(name)[1].lower() in self.extensions
+
+    def wait(self, timeout: float) -> Optional[Set[Path]]:
+        """等待最多timeout秒，返回有变化的文件，以及被删除或移走的目录"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                raw_name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length]
+                offset += _EVENT_HEADER.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & _IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                parent = self._watches.get(wd)
+                if parent is None:
+                    continue
+                name = os.fsdecode(raw_name.rstrip(b'\0'))
+                path = os.path.join(parent, name)
+                if mask & _IN_ISDIR:
+                    if os.path.abspath(path) in self._exclude:
+                        continue
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        changed.update(self._add_tree(path))
+                    elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                        # 目录中的文件一起消失，由调用者按路径前缀处理
+                        changed.add(Path(path))
+                elif self._matches(name):
+                    changed.add(Path(path))
+        return None if overflow else changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_backend(directory: Path, extensions: Iterable[str], poll_interval: float = DEFAULT_POLL_INTERVAL,
+                   polling: bool = False, exclude: Iterable[Path] = ()):
+    """Linux上优先使用inotify，不可用时（或polling为True时）改为轮询；exclude中的目录不监视"""
+    exclude = list(exclude)
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend(directory, extensions, exclude)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"无法使用inotify ({str(e)})，改为每 {poll_interval:.0f} 秒轮询一次")
+    return PollingBackend(directory, extensions, poll_interval, exclude)
+
+
+class RomWatcher:
+    """监视ROM目录，把写入完成的文件变化分批交给回调处理
+
+    每个有变化的文件在大小和修改时间保持settle秒不变后才认为写入完成；所有待处理文件都稳定
+    （即settle秒内没有新的变化）时作为一批处理，一次拷入的多个文件（如DLC合集）只触发一次处理。
+    文件持续到达时，一批最多等待batch_window秒，然后先处理已经稳定的文件。
+    on_batch的参数为有变化的路径集合（包括删除的文件和目录）和是否需要完整重新扫描。
+    """
+
+    def __init__(self, backend, on_batch: Callable[[Set[Path], bool], None],
+                 settle: float = DEFAULT_SETTLE_SECONDS, batch_window: float = DEFAULT_BATCH_WINDOW):
+        self.backend = backend
+        self.on_batch = on_batch
+        self.settle = settle
+        self.batch_window = max(batch_window, settle)
+        self._pending: Dict[Path, Tuple[Signature, float]] = {}
+        self._batch_start: Optional[float] = None
+        self._rescan = False
+
+    def run(self, stop: Optional[threading.Event] = None):
+        """持续监视直到stop被设置（或被Ctrl+C中断）"""
+        stop = stop or threading.Event()
+        logger.info(f"开始监视 ({self.backend.name})，写入稳定等待 {self.settle:.0f} 秒，"
+                    f"批处理窗口 {self.batch_window:.0f} 秒")
+        try:
+            while not stop.is_set():
+                self.step(self.backend.wait(self._timeout()))
+        finally:
+            self.backend.close()
+
+    def _timeout(self) -> float:
+        # 有待处理的文件时需要定期检查是否已经稳定
+        return min(1.0, self.settle) if self._pending or self._rescan else self.settle
+
+    def step(self, changed: Optional[Set[Path]], now: Optional[float] = None):
+        """处理一次事件，到达批处理条件时调用on_batch"""
+        now = time.monotonic() if now is None else now
+        if changed is None:
+            logger.warning("文件变化事件过多，将重新扫描整个目录")
+            self._rescan = True
+            changed = set()
+        for path in changed:
+            self._pending[path] = (_signature(path), now)
+        if (changed or self._rescan) and self._batch_start is None:
+            self._batch_start = now
+
+        # 检查写入是否已经稳定: 没有事件的变化（如轮询间隔内的增长）也会被发现
+        for path, (signature, changed_at) in list(self._pending.items()):
+            current = _signature(path)
+            if current != signature:
+                self._pending[path] = (current, now)
+
+        if self._batch_start is None:
+            return
+        stable = {path for path, (_, changed_at) in self._pending.items() if now - changed_at >= self.settle}
+        quiet = len(stable) == len(self._pending) and now - self._batch_start >= self.settle
+        if not quiet and not (now - self._batch_start >= self.batch_window and stable):
+            return
+
+        for path in stable:
+            del self._pending[path]
+        rescan, self._rescan = self._rescan, False
+        self._batch_start = now if self._pending else None
+        if stable or rescan:
+            logger.info(f"检测到 {len(stable)} 个文件变化" + ("，需要完整重新扫描" if rescan else ""))
+            self.on_batch(stable, rescan)
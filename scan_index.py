@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 索引文件默认位置
+DEFAULT_INDEX_PATH = Path('cache') / 'scan_index.db'
+
+
+class ScanIndex:
+    """持久化的扫描索引
+
+    以文件路径为键，记录文件大小、修改时间和inode，以及解析得到的
+    Title ID、文件类型和版本号。重新扫描时只有新增或修改过的文件需要重新解析，
+    已删除的文件会从索引中移除。是否读取了文件头也一并记录，
+    与本次扫描的设置不一致的记录视为已变化，避免--no-header-scan的结果被后续扫描沿用（反之亦然）。
+    """
+
+    # 表结构或解析规则变化时递增，旧索引会被自动重建
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path: Path = DEFAULT_INDEX_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def _init_schema(self):
+        """创建表结构，版本不一致时重建"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            if version:
+                logger.info(f"扫描索引版本已变化 ({version} -> {self.SCHEMA_VERSION})，重建索引")
+            self.conn.execute("DROP TABLE IF EXISTS files")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path     TEXT PRIMARY KEY,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode    INTEGER NOT NULL,
+                headers  INTEGER NOT NULL,
+                title_id TEXT,
+                kind     TEXT NOT NULL,
+                version  TEXT
+            )
+            """
+        )
+        self.conn.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def clear(self):
+        """清空索引（--rebuild-index）"""
+        self.conn.execute("DELETE FROM files")
+        self.conn.commit()
+
+    def load(self, root: Path) -> Dict[str, Tuple]:
+        """读取指定根目录下的全部索引记录"""
+        prefix = str(root).rstrip(os.sep) + os.sep
+        # 利用主键的字典序做前缀范围查询
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        rows = self.conn.execute(
+            "SELECT path, size, mtime_ns, inode, headers, title_id, kind, version "
+            "FROM files WHERE path >= ? AND path < ?",
+            (prefix, upper)
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    @staticmethod
+    def match(entry: Optional[Tuple], record, read_headers: bool) -> Optional[Tuple[Optional[str], str, Optional[str]]]:
+        """索引记录与文件当前的大小、修改时间、inode以及是否读取文件头都一致时返回 (title_id, kind, version)"""
+        if entry is None:
+            return None
+        size, mtime_ns, inode, headers, title_id, kind, version = entry
+        if size != record.size or mtime_ns != record.mtime_ns or inode != record.inode:
+            return None
+        if bool(headers) != read_headers:
+            return None
+        return title_id, kind, version
+
+    def store(self, rows: Iterable[Tuple]):
+        """批量写入 (path, size, mtime_ns, inode, headers, title_id, kind, version)"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files "
+                "(path, size, mtime_ns, inode, headers, title_id, kind, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def remove(self, paths: Iterable[str]):
+        """删除已不存在的文件记录"""
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE path = ?", ((p,) for p in paths))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from decompress_cache import GB
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 每个磁盘保留的空余空间，避免把磁盘写满
+DEFAULT_SPACE_MARGIN = GB // 4
+
+
+class SpaceNeed(NamedTuple):
+    """一个游戏预计占用的空间"""
+    group_id: str
+    name: str
+    output_bytes: int    # 合并后留在输出磁盘上的字节数（包括.part暂存）
+    temp_bytes: int      # 合并期间temp目录中的峰值字节数，游戏完成后释放
+
+
+class SpacePlan(NamedTuple):
+    """预检结果"""
+    accepted: List[str]              # 可以合并的游戏（group_id），保持原顺序
+    refused: Dict[str, str]          # 空间不足的游戏 -> 原因
+    temp_budget: Optional[int]       # 同时进行的游戏在temp中最多占用的字节数，不需要限制时为None
+
+
+def device_of(path: Path) -> int:
+    """路径所在磁盘的设备号，路径尚不存在时使用最近的已存在的上级目录"""
+    path = Path(path).absolute()
+    for candidate in (path, *path.parents):
+        try:
+            return os.stat(candidate).st_dev
+        except OSError:
+            continue
+    return 0
+
+
+def free_bytes(path: Path) -> int:
+    """路径所在磁盘的剩余空间，路径尚不存在时查询最近的已存在的上级目录"""
+    path = Path(path).absolute()
+    for candidate in (path, *path.parents):
+        if candidate.exists():
+            return shutil.disk_usage(candidate).free
+    return 0
+
+
+def format_size(nbytes: int) -> str:
+    if abs(nbytes) >= GB:
+        return f"{nbytes / GB:.2f} GB"
+    return f"{nbytes / 1048576:.1f} MB"
+
+
+def plan_space(needs: List[SpaceNeed], output_dir: Path, temp_dir: Path,
+               temp_budget: Optional[int] = None, margin: int = DEFAULT_SPACE_MARGIN) -> SpacePlan:
+    """检查输出和临时目录所在磁盘的剩余空间，决定哪些游戏可以合并
+
+    输出文件合并后一直保留，按顺序累加，放不下的游戏被拒绝；temp中的文件在游戏完成后删除，
+    只需保证同时进行的游戏不超过预算。temp与输出在同一磁盘时，预算不超过扣除全部输出后的剩余空间。
+    """
+    output_device = device_of(output_dir)
+    temp_device = device_of(temp_dir)
+    shared = output_device == temp_device
+    output_free = free_bytes(output_dir) - margin
+    temp_free = output_free if shared else free_bytes(temp_dir) - margin
+
+    # 输出空间: 按顺序累加
+    refused: Dict[str, str] = {}
+    committed = 0
+    for need in needs:
+        required = need.output_bytes + (need.temp_bytes if shared else 0)
+        if committed + required > output_free:
+            refused[need.group_id] = (f"输出磁盘空间不足: 需要 {format_size(required)}，"
+                                      f"剩余 {format_size(max(0, output_free - committed))}")
+            continue
+        committed += need.output_bytes
+
+    # 临时空间: 扣除输出后剩余的部分，再受配置的预算限制
+    available = temp_free - committed if shared else temp_free
+    budget = available if temp_budget is None else min(temp_budget, available)
+    for need in needs:
+        if need.group_id in refused or need.temp_bytes <= budget:
+            continue
+        if temp_budget is not None and need.temp_bytes > temp_budget:
+            refused[need.group_id] = f"需要 {format_size(need.temp_bytes)} 临时空间，超过预算 {format_size(temp_budget)}"
+        else:
+            refused[need.group_id] = f"临时目录空间不足: 需要 {format_size(need.temp_bytes)}，剩余 {format_size(max(0, available))}"
+
+    accepted = [need.group_id for need in needs if need.group_id not in refused]
+    uses_temp = any(need.temp_bytes for need in needs if need.group_id not in refused)
+    return SpacePlan(accepted, refused, max(0, budget) if uses_temp else None)
+
+
+class TempBudget:
+    """按字节计数的信号量，限制同时进行的游戏在temp中占用的空间
+
+    请求超过预算时按预算计算（即独占），避免永远等待；放得下的请求不必排队，小任务可以先执行。
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int) -> int:
+        """占用nbytes，空间不够时等待，返回实际占用的字节数"""
+        nbytes = min(max(0, nbytes), self.budget)
+        if not nbytes:
+            return 0
+        with self._condition:
+            if self.used + nbytes > self.budget:
+                logger.info(f"等待临时空间: 需要 {format_size(nbytes)}，已占用 {format_size(self.used)} / {format_size(self.budget)}")
+                self._condition.wait_for(lambda: self.used + nbytes <= self.budget)
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+        return nbytes
+
+    def release(self, nbytes: int):
+        if not nbytes:
+            return
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
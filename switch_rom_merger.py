@@ -4,213 +4,278 @@
 import os
 import sys
 import shutil
-import subprocess
 import re
 import argparse
-import platform
-import glob
-import locale
 from pathlib import Path
-from tqdm import tqdm
-import struct
-import hashlib
-from typing import List, Dict, Tuple, Optional
+from typing import Iterable, List, Dict, NamedTuple, Set, Tuple, Optional
 import logging
-import py7zr
-import zipfile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from scan_index import ScanIndex, DEFAULT_INDEX_PATH
+from file_walker import walk_files, DEFAULT_WALK_WORKERS
+from file_record import FileRecord, stat_calls
+from name_parser import parse_name, parse_version_tuple
+from rom_header import HeaderInfo, read_header, title_id_kind, base_title_id
+from merge_scheduler import MergeScheduler, GameResult
+from decompress_pool import DecompressPool, DecompressError, DEFAULT_DECOMPRESS_WORKERS, DECOMPRESS_ENGINES
+import ncz_engine
+from decompress_cache import DecompressCache, GB
+from output_manifest import OutputManifest
+from job_journal import JobJournal
+from file_transfer import transfer_file, LINK_MODES
+from move_journal import MoveJournal
+from tool_registry import ToolRegistry
+from fingerprint import Fingerprinter
+from duplicate_finder import find_duplicates, hardlink_duplicates
+from profiler import Profiler, SCAN_CAPTURES
+from rom_watcher import DEFAULT_SETTLE_SECONDS, DEFAULT_BATCH_WINDOW, DEFAULT_POLL_INTERVAL
+from space_planner import SpaceNeed, TempBudget, plan_space, device_of, format_size
+from progress import ByteCallback, ProgressTracker, describe
 
-# 设置本地化支持中文
-locale.setlocale(locale.LC_ALL, '')
+# 导入本模块不产生任何副作用（不修改全局设置、不创建文件和目录），
+# 命令行和GUI入口调用configure_runtime完成全局设置
+logger = logging.getLogger('SwitchRomMerger')
 
-# 禁用SSL证书验证
-import ssl
-try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    # Legacy Python that doesn't verify HTTPS certificates by default
-    pass
-else:
-    # Handle target environment that doesn't support HTTPS verification
-    ssl._create_default_https_context = _create_unverified_https_context
+# 默认日志文件
+DEFAULT_LOG_FILE = 'rom_merger.log'
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('rom_merger.log', encoding='utf-8')
-    ]
+# 可能的密钥文件位置
+KEY_LOCATIONS = (
+    Path('prod.keys'),
+    Path('~/.switch/prod.keys'),
+    Path('~/switch/prod.keys'),
+    Path('tools/keys.txt'),
 )
-logger = logging.getLogger('SwitchRomMerger')
+
+
+def configure_runtime(log_file: Optional[str] = DEFAULT_LOG_FILE):
+    """程序入口的全局设置: 本地化、SSL证书验证和日志输出"""
+    # 设置本地化支持中文
+    import locale
+    try:
+        locale.setlocale(locale.LC_ALL, '')
+    except locale.Error:
+        pass
+    
+    # 禁用SSL证书验证
+    import ssl
+    os.environ['PYTHONHTTPSVERIFY'] = '0'
+    try:
+        _create_unverified_https_context = ssl._create_unverified_context
+    except AttributeError:
+        # Legacy Python that doesn't verify HTTPS certificates by default
+        pass
+    else:
+        # Handle target environment that doesn't support HTTPS verification
+        ssl._create_default_https_context = _create_unverified_https_context
+    
+    # 配置日志，重复调用时不会重复添加处理器
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
+def find_keys_file() -> Optional[Path]:
+    """查找密钥文件，找不到时返回None"""
+    for key_path in KEY_LOCATIONS:
+        key_path = key_path.expanduser()
+        if key_path.exists():
+            return key_path
+    return None
+
+# 标准化游戏名称时需要移除的字符
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]')
+
+# 合并引擎: threads用线程池调度游戏和解压任务；asyncio在事件循环中调度，解压使用异步子进程
+MERGE_ENGINES = ('threads', 'asyncio')
+
+# asyncio引擎中每个磁盘同时进行的复制和重命名数量
+DEFAULT_DISK_JOBS = 2
+
+
+class OutputLayout(NamedTuple):
+    """一个游戏的输出路径"""
+    output_game_dir: Path
+    output_xci_path: Path
+    output_update_dir: Path
+    output_dlc_dir: Path
+    update_prefix: str
+    dlc_prefix: str
+
+
+class MergePlan(NamedTuple):
+    """一个游戏的合并计划，由_plan_merge生成"""
+    title_id: str
+    game_name: str
+    items: List[Tuple[str, Path, Optional[Path], Path]]   # (说明, 源文件, 解压目标, 输出路径)
+    manifest: OutputManifest
+    previous_manifest: Optional[Dict]
+    up_to_date: bool                                      # 输入未变化，不需要输出
+    # 以下与OutputLayout相同
+    output_game_dir: Path
+    output_xci_path: Path
+    output_update_dir: Path
+    output_dlc_dir: Path
+    update_prefix: str
+    dlc_prefix: str
+    game_temp_dir: Optional[Path]
+
 
 class SwitchRomMerger:
-    def __init__(self, flat_output=False):
+    def __init__(self, flat_output=False, use_index=True, index_path: Path = DEFAULT_INDEX_PATH,
+                 read_headers=True, decompress_workers: int = DEFAULT_DECOMPRESS_WORKERS,
+                 decompress_timeout: Optional[float] = None, link_mode: str = 'copy',
+                 move: bool = False, decompress_cache_bytes: int = 0, stage_in_temp: bool = False,
+                 force: bool = False, resume: bool = False, decompress_engine: str = 'auto',
+                 merge_engine: str = 'threads', disk_jobs: int = DEFAULT_DISK_JOBS,
+                 space_check: bool = True, temp_budget_bytes: Optional[int] = None):
         self.supported_extensions = {'.xci', '.xcz', '.nsp', '.nsz'}
+        # 输出和临时目录在第一次写入时才创建
         self.output_dir = Path('output')
-        self.output_dir.mkdir(exist_ok=True)
         self.temp_dir = Path('temp')
-        self.temp_dir.mkdir(exist_ok=True)
         self.flat_output = flat_output
         
-        # 密钥和固件路径
-        self.keys_file = None
-        self.title_keys_file = None
-        
-        # 查找密钥文件
-        possible_key_locations = [
-            Path('prod.keys'),
-            Path(os.path.expanduser('~/.switch/prod.keys')),
-            Path(os.path.expanduser('~/switch/prod.keys')),
-            Path('tools/keys.txt'),
-            Path('tools/keys.txt'),
-        ]
-        
-        for key_path in possible_key_locations:
-            if key_path.exists():
-                self.keys_file = key_path
-                logger.info(f"找到密钥文件: {self.keys_file}")
-                break
-        
-        # 工具路径
+        # 文件输出方式: copy/hardlink/reflink/symlink/auto
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"不支持的输出方式: {link_mode}")
+        self.link_mode = link_mode
+        
+        # 移动模式: 源文件直接移动到输出目录，并记录回滚日志
+        self.move = move
+        self.move_journal = MoveJournal() if move else None
+        
+        # 扫描索引，记录已解析过的文件，避免重复解析
+        self.use_index = use_index
+        self.index_path = Path(index_path)
+        
+        # 读取NSP/XCI文件头获取准确的Title ID
+        self.read_headers = read_headers
+        
+        # 最近一次扫描得到的文件记录
+        self.scanned_records: List[FileRecord] = []
+        
+        # NSZ/XCZ解压池，整个批次共享
+        self.decompress_workers = decompress_workers
+        self.decompress_timeout = decompress_timeout
+        if decompress_engine not in DECOMPRESS_ENGINES:
+            raise ValueError(f"不支持的解压引擎: {decompress_engine}")
+        self.decompress_engine = decompress_engine
+        self._decompress_pool = None
+        self._pool_lock = threading.Lock()
+        
+        # 合并引擎，asyncio引擎按CPU和磁盘分别限制并发
+        if merge_engine not in MERGE_ENGINES:
+            raise ValueError(f"不支持的合并引擎: {merge_engine}")
+        self.merge_engine = merge_engine
+        self.disk_jobs = disk_jobs
+        
+        # 合并前检查磁盘空间，拒绝放不下的游戏；stage_in_temp时限制同时进行的游戏占用的临时空间
+        self.space_check = space_check
+        self.temp_budget_bytes = temp_budget_bytes
+        self._temp_budget: Optional[TempBudget] = None
+        self._temp_needs: Dict[str, int] = {}
+        # 本批次中NSZ/XCZ解压后的大小，空间预检和进度估计共用，每个文件头只解析一次
+        self._output_sizes: Dict[Path, int] = {}
+        
+        # 增量合并: 根据输出清单跳过未变化的游戏，force为True时全部重新合并
+        self.force = force
+        self.skipped_games = 0
+        self.skipped_bytes = 0
+        self._skip_lock = threading.Lock()
+        
+        # 任务日志，记录每个步骤的完成情况，resume为True时从上次中断处继续
+        self.job_journal = JobJournal(resume=resume)
+        
+        # 解压结果默认直接写入输出目录（.part暂存后重命名），stage_in_temp为True时先解压到temp再输出
+        self.stage_in_temp = stage_in_temp
+        
+        # 解压结果缓存，预算为0时不启用
+        self.decompress_cache = DecompressCache(decompress_cache_bytes) if decompress_cache_bytes > 0 else None
+        
+        # 外部工具在第一次使用时才查找，扫描不需要任何工具
         self.tools_dir = Path('tools')
-        self.hactoolnet_path = None
+        self.tools = ToolRegistry(self.tools_dir)
         
-        # 查找hactoolnet.exe
-        if (self.tools_dir / "hactoolnet.exe").exists():
-            self.hactoolnet_path = self.tools_dir / "hactoolnet.exe"
-        else:
-            # 查找子目录
-            for item in self.tools_dir.glob("**/hactoolnet.exe"):
-                self.hactoolnet_path = item
-                break
-        
-        if self.hactoolnet_path:
-            logger.info(f"找到hactoolnet工具: {self.hactoolnet_path}")
-        
-        # 查找nsz.exe，现在直接放在tools目录下
-        self.nsz_path = None
-        if (self.tools_dir / "nsz.exe").exists():
-            self.nsz_path = self.tools_dir / "nsz.exe"
-        else:
-            # 兼容性查找，以防nsz.exe在子目录中
-            for item in self.tools_dir.glob("**/nsz.exe"):
-                self.nsz_path = item
-                break
-        
-        if self.nsz_path:
-            logger.info(f"找到nsz工具: {self.nsz_path}")
-        
-        # 检查必要的工具
-        self._setup_tools()
-        
-    def _setup_tools(self):
-        """检查必要的工具"""
-        # 创建tools目录
-        self.tools_dir.mkdir(exist_ok=True)
-        
-        # 确保hactoolnet可用
-        if not self.hactoolnet_path:
-            logger.error("找不到hactoolnet.exe，请手动下载并放置在tools目录下")
-            logger.info("您可以从 https://github.com/Thealexbarney/libhac/releases 下载")
-            raise FileNotFoundError("找不到hactoolnet.exe")
-            
-        # 确保nsz工具可用
-        if not self.nsz_path:
-            logger.error("找不到nsz.exe，请手动下载并放置在tools目录下")
-            logger.info("您可以从 https://github.com/nicoboss/nsz/releases 下载")
-            raise FileNotFoundError("找不到nsz.exe")
+        # 各阶段耗时统计，--profile时保存为报告
+        self.profiler = Profiler()
+        
+        # 按字节统计的合并进度，命令行进度条和GUI都通过监听进度事件显示
+        self.progress = ProgressTracker()
+        
+        # 密钥文件在第一次访问时才查找
+        self._keys_file = None
         
+    @property
+    def keys_file(self) -> Optional[Path]:
+        if self._keys_file is None:
+            self._keys_file = find_keys_file()
+            if self._keys_file:
+                logger.info(f"找到密钥文件: {self._keys_file}")
+        return self._keys_file
+    
+    def _check_decompressor(self, games: List[Tuple[str, Dict]]):
+        """有NSZ/XCZ文件需要解压时，确认至少有一种解压方式可用"""
+        if self.decompress_engine != 'nsz' and ncz_engine.AVAILABLE:
+            return
+        for _, files_dict in games:
+            records = [files_dict['base']] + files_dict['updates'] + files_dict['dlcs']
+            if any(record and record.suffix.lower() in ('.nsz', '.xcz') for record in records):
+                self.tools.require('nsz')
+                return
+    
     def extract_title_id(self, filename: str) -> Optional[str]:
         """从文件名中提取Title ID"""
-        # 常见的Title ID格式模式：[01XXXXXXXXXXXXXX] 或 01XXXXXXXXXXXXXX
-        patterns = [
-            r'\[([0-9A-Fa-f]{16})\]',  # [0100000000000XXX]
-            r'(?<!\[)([0-9A-Fa-f]{16})(?!\])'  # 0100000000000XXX 但不在括号内
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, filename)
-            if match:
-                return match.group(1).upper()
-        return None
+        return parse_name(filename).title_id
     
     def extract_base_title_id(self, title_id: str) -> str:
         """提取基础游戏的Title ID（去除DLC和更新的特定部分）"""
-        # 通常主游戏ID格式为: 01XXXXXXXXXXX000
-        # DLC ID格式为:      01XXXXXXXXXXX00X (X > 0)
-        # 更新ID格式为:      01XXXXXXXXXXX800
+        # 主游戏ID格式为: 01XXXXXXXXXXX000
+        # 更新ID格式为:   主游戏ID + 0x800
+        # DLC ID格式为:   主游戏ID + 0x1000 + DLC序号
         if not title_id or len(title_id) != 16:
             return title_id
-            
-        # 取前13位 + "000" 作为基础游戏ID
-        base_id = title_id[:13] + "000"
-        return base_id
+        
+        return base_title_id(title_id)
     
     def is_dlc_file(self, file_path: Path) -> bool:
         """判断文件是否为DLC"""
-        file_str = str(file_path).lower()
-        filename = file_path.name.lower()
-        
-        # 检查文件名中是否包含DLC相关关键字
-        if 'dlc' in filename or 'dlc' in file_str:
-            return True
-        
-        # 检查TitleID是否是DLC格式（通常以00X结尾，X > 0）
-        title_id = self.extract_title_id(file_str)
-        if title_id and len(title_id) == 16:
-            # 通常DLC的ID是以非零数字结尾的00X格式
-            if title_id[13:15] == '00' and title_id[15] != '0':
-                return True
-        
-        return False
+        return parse_name(str(file_path)).is_dlc
     
     def is_update_file(self, file_path: Path) -> bool:
         """判断文件是否为更新文件"""
-        file_str = str(file_path).lower()
-        filename = file_path.name.lower()
-        
-        # 检查文件名中是否包含更新相关关键字
-        if ('upd' in filename or 'update' in filename or
-           '更新' in filename or 'patch' in filename or
-           '补丁' in filename or 'v1.' in filename or 'v2.' in filename):
-            return True
-        
-        # 检查TitleID是否是更新格式（通常以800结尾）
-        title_id = self.extract_title_id(file_str)
-        if title_id and len(title_id) == 16:
-            # 通常更新的ID是以800结尾
-            if title_id[13:] == '800':
-                return True
-        
-        return False
+        return parse_name(str(file_path)).is_update
     
-    def scan_directory(self, directory: Path) -> Dict[str, Dict]:
-        """扫描目录并返回按游戏Title ID/名称分组的文件列表"""
-        game_files = {}           # 存储最终整合后的游戏信息
-        raw_files = {}            # 存储原始按Title ID分组的文件信息
-        title_id_map = {}         # 存储TitleID到游戏名称的映射
-        base_id_map = {}          # 存储基础ID到完整ID的映射
+    def scan_directory(self, directory: Path, rebuild_index: bool = False,
+                       exclude: Iterable[Path] = ()) -> Dict[str, Dict]:
+        """扫描目录并返回按游戏Title ID/名称分组的文件列表，exclude中的目录不扫描"""
         dir_files = {}            # 按目录分组的文件
-        name_id_map = {}          # 存储游戏名称到ID的映射，用于去重
         
         logger.info(f"扫描目录: {directory}")
         
-        # 只处理特定类型的文件
-        all_files = []
-        for ext in self.supported_extensions:
-            all_files.extend(list(directory.rglob(f"*{ext}")))
+        # 只处理特定类型的文件，单次遍历，遍历时每个文件只stat一次（读取文件头时的fstat另计）
+        walk_start = time.perf_counter()
+        stat_calls_before = stat_calls()
+        with self.profiler.phase('scan.walk'):
+            all_files = walk_files(directory, self.supported_extensions, exclude=exclude)
+            if self.move and self.job_journal.resume:
+                all_files = self._with_moved_records(directory, all_files)
         
-        logger.info(f"找到 {len(all_files)} 个Switch游戏文件...")
+        logger.info(f"找到 {len(all_files)} 个Switch游戏文件... (遍历耗时 {time.perf_counter() - walk_start:.3f} 秒)")
         
         # 首先按目录分组
-        for file_path in all_files:
-            rel_path = file_path.relative_to(directory)
+        for record in all_files:
+            rel_path = record.path.relative_to(directory)
             if len(rel_path.parts) > 0:
                 top_dir = rel_path.parts[0]
                 if top_dir not in dir_files:
                     dir_files[top_dir] = []
-                dir_files[top_dir].append(file_path)
+                dir_files[top_dir].append(record)
         
         # 记录找到的目录
         if dir_files:
@@ -218,21 +283,59 @@ class SwitchRomMerger:
             for dir_name, files in dir_files.items():
                 logger.info(f"  - {dir_name}: {len(files)}个文件")
         
-        # 第一遍扫描：提取所有文件的Title ID并分类
-        for file_path in tqdm(all_files, desc="识别游戏文件"):
+        # 提取所有文件的Title ID、类型和版本号（优先使用扫描索引）
+        with self.profiler.phase('scan.classify'):
+            self._classify_files(directory, all_files, rebuild_index)
+        
+        with self.profiler.phase('scan.group'):
+            final_games = self._group_records(directory, all_files)
+            
+            logger.info(f"stat调用: {stat_calls() - stat_calls_before} 次 (文件 {len(all_files)} 个)")
+            
+            # 按游戏名称整理并日志输出
+            if final_games:
+                logger.info(f"\n成功识别 {len(final_games)} 个游戏:")
+                self._log_games(final_games)
+            else:
+                logger.warning("未能识别到任何游戏文件")
+        
+        # 监视模式在本次扫描的记录上增量更新
+        self.scanned_records = all_files
+        return final_games
+    
+    def _with_moved_records(self, directory: Path, records: List[FileRecord]) -> List[FileRecord]:
+        """移动模式继续时，补回上次运行中已移动到输出目录的源文件（按原路径，使用输出文件的状态）
+
+        否则这些文件所在的游戏在继续时会缺少已移动的部分（如基础游戏），无法按任务日志跳过已完成的步骤。
+        """
+        root = directory.absolute()
+        known = {record.path for record in records}
+        restored = [FileRecord.from_stat(source, st) for source, st in self.job_journal.moved_sources()
+                    if source not in known and root in source.absolute().parents]
+        if restored:
+            logger.info(f"继续移动模式: {len(restored)} 个文件已在上次运行中移动到输出目录")
+        return sorted(records + restored, key=lambda record: record.path)
+    
+    def _group_records(self, directory: Path, all_files: List[FileRecord], show_progress: bool = True
+                       ) -> Dict[str, Dict]:
+        """将已识别的文件按Title ID、目录和游戏名称分组，每个游戏只保留最新的更新"""
+        game_files = {}           # 存储最终整合后的游戏信息
+        raw_files = {}            # 存储原始按Title ID分组的文件信息
+        title_id_map = {}         # 存储TitleID到游戏名称的映射
+        base_id_map = {}          # 存储基础ID到完整ID的映射
+        
+        # 第一遍扫描：按Title ID分类
+        if show_progress:
+            from tqdm import tqdm
+            all_files = tqdm(all_files, desc="识别游戏文件")
+        for record in all_files:
             try:
-                file_str = str(file_path)
-                filename = file_path.name
-                
-                # 尝试提取Title ID
-                title_id = self.extract_title_id(file_str)
-                
-                # 判断文件类型
-                is_dlc = self.is_dlc_file(file_path)
-                is_update = self.is_update_file(file_path)
+                title_id = record.title_id
+                is_dlc = record.kind == 'dlc'
+                is_update = record.kind == 'update'
                 
                 # 获取父目录名
-                rel_path = file_path.relative_to(directory)
+                rel_path = record.path.relative_to(directory)
                 parent_dir = rel_path.parts[0] if len(rel_path.parts) > 0 else ""
                 
                 # 如果有Title ID
@@ -245,12 +348,8 @@ class SwitchRomMerger:
                     
                     # 如果从目录没找到合适的，尝试从文件名提取
                     if not game_name or game_name == title_id:
-                        # 从文件名中提取游戏名称，移除版本号、括号内容等
-                        game_name = re.sub(r'\[.*?\]', '', filename)  # 移除方括号内容
-                        game_name = re.sub(r'\(.*?\)', '', game_name)  # 移除圆括号内容
-                        game_name = re.sub(r'v\d+(\.\d+)*', '', game_name)  # 移除版本号
-                        game_name = game_name.replace(title_id, '')  # 移除Title ID
-                        game_name = game_name.strip('_.- ')  # 移除前后的特殊字符
+                        # 从文件名中提取游戏名称，移除版本号、括号内容和Title ID
+                        game_name = parse_name(str(record.path)).display_name
                     
                     # 如果游戏名称为空，使用Title ID作为名称
                     if not game_name or len(game_name) < 2:
@@ -279,13 +378,13 @@ class SwitchRomMerger:
                     
                     # 归类文件
                     if is_dlc:
-                        raw_files[title_id]['dlcs'].append(file_path)
+                        raw_files[title_id]['dlcs'].append(record)
                     elif is_update:
-                        raw_files[title_id]['updates'].append(file_path)
+                        raw_files[title_id]['updates'].append(record)
                     else:
                         # 基础游戏，选择最大的文件
-                        if not raw_files[title_id]['base'] or file_path.stat().st_size > raw_files[title_id]['base'].stat().st_size:
-                            raw_files[title_id]['base'] = file_path
+                        if not raw_files[title_id]['base'] or record.size > raw_files[title_id]['base'].size:
+                            raw_files[title_id]['base'] = record
                 
                 else:
                     # 没有Title ID的情况下，尝试从文件名和目录名提取信息
@@ -308,20 +407,20 @@ class SwitchRomMerger:
                         
                         # 根据文件名归类
                         if is_dlc:
-                            raw_files[fake_id]['dlcs'].append(file_path)
+                            raw_files[fake_id]['dlcs'].append(record)
                         elif is_update:
-                            raw_files[fake_id]['updates'].append(file_path)
+                            raw_files[fake_id]['updates'].append(record)
                         else:
                             # 基础游戏，选择最大的文件
-                            if not raw_files[fake_id]['base'] or file_path.stat().st_size > raw_files[fake_id]['base'].stat().st_size:
-                                raw_files[fake_id]['base'] = file_path
+                            if not raw_files[fake_id]['base'] or record.size > raw_files[fake_id]['base'].size:
+                                raw_files[fake_id]['base'] = record
                         
                         # 添加到映射
                         if fake_id not in base_id_map:
                             base_id_map[fake_id] = [fake_id]
                 
             except Exception as e:
-                logger.error(f"处理文件 {file_path} 时出错: {str(e)}")
+                logger.error(f"处理文件 {record.path} 时出错: {str(e)}")
         
         # 特殊处理：合并同名目录下的文件
         dir_groups = {}  # 目录名到文件ID的映射
@@ -351,8 +450,8 @@ class SwitchRomMerger:
                     if raw_files[title_id]['base']:
                         # 如果当前没有基础游戏或找到更大的，更新它
                         if not game_files[dir_group_id]['base'] or (
-                            raw_files[title_id]['base'].stat().st_size > 
-                            game_files[dir_group_id]['base'].stat().st_size):
+                            raw_files[title_id]['base'].size > 
+                            game_files[dir_group_id]['base'].size):
                             game_files[dir_group_id]['base'] = raw_files[title_id]['base']
                     
                     # 添加更新和DLC
@@ -422,34 +521,153 @@ class SwitchRomMerger:
                         game_files[base_id]['base'] = raw_files[title_id]['base']
 
         # 处理重复游戏，确保每个真实游戏只有一个条目
-        final_games = {}
-        processed_names = set()
+        final_games = self._merge_same_name_games(game_files)
         
-        # 首先整合所有同名游戏
-        for game_id, game_data in game_files.items():
-            game_name = game_data['name']
+        # 对于每个游戏，只保留最新版本的更新文件
+        for game_id, game_data in final_games.items():
+            if game_data['updates']:
+                # 按照以下标准排序更新文件:
+                # 1. 尝试提取版本号并比较
+                # 2. 如果版本号提取失败，按文件大小排序
+                # 3. 最后按修改时间排序
+                
+                # 为每个更新文件提取版本信息，版本号解析为元组以便比较
+                update_info = []
+                for update_file in game_data['updates']:
+                    version_tuple = parse_version_tuple(update_file.version)
+                    update_info.append((update_file, version_tuple, update_file.size, update_file.mtime_ns))
+                
+                # 按版本号、大小和修改时间排序，取最高版本
+                sorted_updates = sorted(update_info, key=lambda x: (x[1], x[2], x[3]), reverse=True)
+                
+                if sorted_updates:
+                    # 只保留最高版本的更新文件
+                    game_data['updates'] = [sorted_updates[0][0]]
+        
+        return final_games
+    
+    def _log_games(self, games: Dict[str, Dict]):
+        """在日志中列出游戏及其文件"""
+        for group_id, files_dict in games.items():
+            base_file = files_dict['base']
+            updates = files_dict['updates']
+            dlcs = files_dict['dlcs']
+            game_name = files_dict['name']
             
-            # 标准化游戏名，忽略大小写和特殊字符
-            norm_name = self._normalize_game_name(game_name)
+            if updates:
+                logger.info(f"游戏 {game_name} 使用最新的更新文件: {updates[0].name}")
+            logger.info(f"游戏: {game_name} (ID: {group_id})")
+            logger.info(f"  基础游戏: {base_file.name if base_file else '无'}")
+            logger.info(f"  更新文件: {len(updates)} 个")
+            logger.info(f"  DLC文件: {len(dlcs)} 个")
             
-            if norm_name in processed_names:
-                # 已存在同名游戏，跳过
-                continue
-                
-            # 查找所有同名游戏
-            same_games = []
-            for other_id, other_data in game_files.items():
-                other_name = other_data['name']
-                if self._normalize_game_name(other_name) == norm_name:
-                    same_games.append((other_id, other_data))
+            # 详细记录更新和DLC文件
+            if updates:
+                logger.debug(f"  更新文件列表:")
+                for upd in updates:
+                    logger.debug(f"    - {upd}")
+            
+            if dlcs:
+                logger.debug(f"  DLC文件列表:")
+                for dlc in dlcs:
+                    logger.debug(f"    - {dlc}")
+    
+    def _classify_file(self, file_path: Path, header: Optional[HeaderInfo] = None) -> Tuple[Optional[str], str, Optional[str]]:
+        """解析单个文件，返回 (title_id, 类型, 版本号)，类型为 base/update/dlc
+        
+        文件头中读取到的Title ID优先于文件名，类型也由Title ID决定。
+        """
+        parsed = parse_name(str(file_path))
+        if header and header.title_ids:
+            # 多个票据时（如合集包）优先取基础游戏，其次更新，最后DLC
+            kind_order = {'base': 0, 'update': 1, 'dlc': 2}
+            title_id = min(header.title_ids, key=lambda tid: (kind_order[title_id_kind(tid)], tid))
+            return title_id, title_id_kind(title_id), parsed.version
+        return parsed.title_id, parsed.kind, parsed.version
+    
+    def _classify_records(self, records: List[FileRecord]) -> List[Tuple[Optional[str], str, Optional[str]]]:
+        """解析一批文件，文件头在线程池中并发读取"""
+        if not self.read_headers or not records:
+            return [self._classify_file(record.path) for record in records]
+        
+        with ThreadPoolExecutor(max_workers=DEFAULT_WALK_WORKERS) as pool:
+            headers = list(pool.map(read_header, (record.path for record in records)))
+        
+        header_count = sum(1 for header in headers if header and header.title_ids)
+        logger.info(f"文件头识别: {header_count}/{len(records)} 个文件通过文件头确定Title ID")
+        return [self._classify_file(record.path, header) for record, header in zip(records, headers)]
+    
+    def _classify_files(self, directory: Path, records: List[FileRecord], rebuild_index: bool = False):
+        """批量解析文件并写入记录，未变化的文件直接复用扫描索引中的结果"""
+        if not self.use_index:
+            for record, result in zip(records, self._classify_records(records)):
+                record.title_id, record.kind, record.version = result
+            return
+        
+        start_time = time.perf_counter()
+        index = ScanIndex(self.index_path)
+        try:
+            if rebuild_index:
+                logger.info("重建扫描索引...")
+                index.clear()
+            
+            root = directory.absolute()
+            indexed = index.load(root)
+            changed = []
+            seen = set()
+            
+            for record in records:
+                key = str(record.path.absolute())
+                seen.add(key)
+                cached = index.match(indexed.get(key), record, self.read_headers)
+                if cached is None:
+                    changed.append((key, record))
+                else:
+                    record.title_id, record.kind, record.version = cached
+            
+            # 只有新增或修改过的文件需要重新解析
+            changed_rows = []
+            results = self._classify_records([record for _, record in changed])
+            for (key, record), result in zip(changed, results):
+                record.title_id, record.kind, record.version = result
+                changed_rows.append((key, record.size, record.mtime_ns, record.inode, self.read_headers) + result)
+            
+            # 移除已删除文件的记录
+            removed = [path for path in indexed if path not in seen]
+            if changed_rows:
+                index.store(changed_rows)
+            if removed:
+                index.remove(removed)
+            
+            elapsed = time.perf_counter() - start_time
+            logger.info(f"扫描索引: 共 {len(records)} 个文件，复用 {len(records) - len(changed_rows)} 个，"
+                        f"重新解析 {len(changed_rows)} 个，移除 {len(removed)} 个，耗时 {elapsed:.3f} 秒")
+        finally:
+            index.close()
+    
+    def _merge_same_name_games(self, game_files: Dict[str, Dict]) -> Dict[str, Dict]:
+        """整合标准化名称相同的游戏条目
+
+        先按标准化名称建立哈希索引（每个名称只标准化一次），
+        再用集合对更新和DLC去重，整体为线性复杂度。
+        """
+        final_games = {}
+        
+        # 标准化名称 -> 同名游戏列表，保持首次出现的顺序
+        name_groups = {}
+        for game_id, game_data in game_files.items():
+            norm_name = self._normalize_game_name(game_data['name'])
+            name_groups.setdefault(norm_name, []).append((game_id, game_data))
+        
+        for same_games in name_groups.values():
+            game_id, game_data = same_games[0]
             
             # 如果只有一个，直接添加
             if len(same_games) == 1:
                 final_games[game_id] = game_data
-                processed_names.add(norm_name)
                 continue
-                
-            # 有多个同名游戏，合并它们
+            
+            game_name = game_data['name']
             logger.info(f"发现{len(same_games)}个同名游戏 '{game_name}'，将合并为一个条目")
             
             # 创建合并后的游戏条目
@@ -459,104 +677,31 @@ class SwitchRomMerger:
                 'dlcs': [],
                 'name': game_name
             }
+            seen_updates = set()
+            seen_dlcs = set()
             
             # 整合所有文件
             for _, data in same_games:
                 # 基础游戏取最大的
                 if data['base'] and (not merged_game['base'] or 
-                                    data['base'].stat().st_size > merged_game['base'].stat().st_size):
+                                    data['base'].size > merged_game['base'].size):
                     merged_game['base'] = data['base']
                 
-                # 更新和DLC都合并
+                # 更新和DLC都合并，按路径去重
                 for update in data['updates']:
-                    if update not in merged_game['updates']:
+                    if update.path not in seen_updates:
+                        seen_updates.add(update.path)
                         merged_game['updates'].append(update)
                 
                 for dlc in data['dlcs']:
-                    if dlc not in merged_game['dlcs']:
+                    if dlc.path not in seen_dlcs:
+                        seen_dlcs.add(dlc.path)
                         merged_game['dlcs'].append(dlc)
             
             # 使用目录ID或者第一个游戏的ID
-            merged_id = None
-            for temp_id, _ in same_games:
-                if temp_id.startswith("DIR_"):
-                    merged_id = temp_id
-                    break
-            
-            if not merged_id:
-                merged_id = same_games[0][0]
-                
+            merged_id = next((temp_id for temp_id, _ in same_games if temp_id.startswith("DIR_")),
+                             same_games[0][0])
             final_games[merged_id] = merged_game
-            processed_names.add(norm_name)
-        
-        # 对于每个游戏，只保留最新版本的更新文件
-        for game_id, game_data in final_games.items():
-            if game_data['updates']:
-                # 按照以下标准排序更新文件:
-                # 1. 尝试提取版本号并比较
-                # 2. 如果版本号提取失败，按文件大小排序
-                # 3. 最后按修改时间排序
-                
-                # 为每个更新文件提取版本信息
-                update_info = []
-                for update_file in game_data['updates']:
-                    version = self._extract_version(update_file)
-                    size = update_file.stat().st_size
-                    mtime = update_file.stat().st_mtime
-                    
-                    # 将版本号解析为元组以便比较
-                    version_tuple = (0, 0, 0)
-                    if version:
-                        try:
-                            # 处理不同格式的版本号
-                            parts = version.split('.')
-                            if len(parts) == 1:
-                                version_tuple = (int(parts[0]), 0, 0)
-                            elif len(parts) == 2:
-                                version_tuple = (int(parts[0]), int(parts[1]), 0)
-                            elif len(parts) >= 3:
-                                version_tuple = (int(parts[0]), int(parts[1]), int(parts[2]))
-                        except ValueError:
-                            # 无法解析版本号，保持默认值
-                            pass
-                    
-                    update_info.append((update_file, version_tuple, size, mtime))
-                
-                # 按版本号、大小和修改时间排序，取最高版本
-                sorted_updates = sorted(update_info, key=lambda x: (x[1], x[2], x[3]), reverse=True)
-                
-                if sorted_updates:
-                    # 只保留最高版本的更新文件
-                    latest_update = sorted_updates[0][0]
-                    logger.info(f"游戏 {game_data['name']} 使用最新的更新文件: {latest_update.name}")
-                    game_data['updates'] = [latest_update]
-                
-        # 按游戏名称整理并日志输出
-        if final_games:
-            logger.info(f"\n成功识别 {len(final_games)} 个游戏:")
-            for group_id, files_dict in final_games.items():
-                base_file = files_dict['base']
-                updates = files_dict['updates']
-                dlcs = files_dict['dlcs']
-                game_name = files_dict['name']
-                
-                logger.info(f"游戏: {game_name} (ID: {group_id})")
-                logger.info(f"  基础游戏: {base_file.name if base_file else '无'}")
-                logger.info(f"  更新文件: {len(updates)} 个")
-                logger.info(f"  DLC文件: {len(dlcs)} 个")
-                
-                # 详细记录更新和DLC文件
-                if updates:
-                    logger.debug(f"  更新文件列表:")
-                    for upd in updates:
-                        logger.debug(f"    - {upd}")
-                
-                if dlcs:
-                    logger.debug(f"  DLC文件列表:")
-                    for dlc in dlcs:
-                        logger.debug(f"    - {dlc}")
-        else:
-            logger.warning("未能识别到任何游戏文件")
         
         return final_games
     
@@ -565,8 +710,7 @@ class SwitchRomMerger:
         if not name:
             return ""
         # 转换为小写，移除所有特殊字符和空格
-        import re
-        return re.sub(r'[^a-z0-9]', '', name.lower())
+        return _NON_ALNUM_RE.sub('', name.lower())
     
     def _extract_game_info(self, file_path: Path) -> Optional[Tuple[str, bool, bool]]:
         """
@@ -626,231 +770,554 @@ class SwitchRomMerger:
         # 默认方法：使用文件名第一部分
         return file_path.stem.split('_')[0]
     
-    def merge_files(self, title_id: str, files_dict: Dict):
-        """合并同一游戏的文件"""
-        game_temp_dir = None
+    def merge_files(self, title_id: str, files_dict: Dict) -> bool:
+        """合并同一游戏的文件，成功返回True"""
+        plan = None
+        temp_reserved = 0
+        success = False
+        game_start = time.perf_counter()
+        progress = self.progress.callback(files_dict['name'])
         try:
-            base_file = files_dict['base']
-            updates = files_dict['updates']
-            dlcs = files_dict['dlcs']
-            game_name = files_dict['name']
-            
-            # 如果没有基础游戏文件，无法合并
-            if not base_file:
-                logger.warning(f"游戏 {game_name} 没有基础文件，无法合并")
-                return
-            
-            # 使用最新版本的更新文件
-            latest_update = None
-            if updates:
-                # 按照文件大小排序，选择最大的（通常是最新的）
-                latest_update = max(updates, key=lambda f: f.stat().st_size)
-                logger.info(f"找到最新的更新文件: {latest_update.name}")
-            
-            # 合并为单一XCI功能
-            logger.info(f"开始合并游戏 {game_name}")
-            logger.info(f"基础游戏: {base_file}")
-            if latest_update:
-                logger.info(f"更新文件: {latest_update}")
-            logger.info(f"DLC文件: {len(dlcs)} 个")
-            
-            # 构建输出文件名
-            output_filename = f"{game_name}"
-            if latest_update:
-                # 尝试从更新文件名中提取版本号
-                update_version = self._extract_version(latest_update)
-                if update_version:
-                    output_filename += f"_v{update_version}"
-                else:
-                    output_filename += "_更新版"
-            
-            if dlcs:
-                output_filename += f"_{len(dlcs)}DLC"
-            
-            # 清理文件名称中的特殊字符
-            output_filename = re.sub(r'[\\/:*?"<>|]', '', output_filename)
-            output_filename += ".xci"
-            
-            # 根据平铺设置决定输出目录结构
-            if self.flat_output:
-                # 平铺模式：所有文件直接放在output目录下
-                output_game_dir = self.output_dir
-                output_xci_path = output_game_dir / output_filename
-                output_update_dir = output_game_dir
-                output_dlc_dir = output_game_dir
-                
-                # 更新和DLC文件名添加游戏前缀，防止不同游戏文件重名
-                update_prefix = f"{game_name}_"
-                dlc_prefix = f"{game_name}_"
-                
-                logger.info(f"使用平铺输出模式")
-            else:
-                # 默认模式：按游戏名创建子目录
-                output_game_dir = self.output_dir / game_name
-                output_game_dir.mkdir(exist_ok=True, parents=True)
-                
-                # 创建UPDATE和DLC子目录
-                output_update_dir = output_game_dir / "UPDATE"
-                output_dlc_dir = output_game_dir / "DLC"
-                
-                # 主要输出XCI文件路径
-                output_xci_path = output_game_dir / f"{game_name}.xci"
-                
-                # 不需要添加前缀
-                update_prefix = ""
-                dlc_prefix = ""
-            
-            logger.info(f"输出目录: {output_game_dir}")
-            logger.info(f"主XCI文件: {output_xci_path}")
-            
-            # 为该游戏创建临时工作目录
-            game_temp_dir = self.temp_dir / game_name
-            game_temp_dir.mkdir(exist_ok=True, parents=True)
-            
-            # 使用hactoolnet进行XCI合并
-            # 注意: 这里使用的方法是创建一个组合XCI文件，但实际上是将原始XCI游戏复制并提供单独的更新和DLC
-            # 对于YUZU/Ryujinx模拟器，可能需要安装更新和DLC，而不是仅加载XCI
-            # 真正组合的XCI文件需要使用高级工具如SAK或NSC_BUILDER
-            logger.info(f"创建XCI文件: {output_xci_path}")
-            
-            # 提取并准备所有文件
-            secure_dir = game_temp_dir / "secure"
-            secure_dir.mkdir(exist_ok=True, parents=True)
+            plan = self._plan_merge(title_id, files_dict)
+            if plan is None:
+                return False
+            if plan.up_to_date:
+                success = True
+                return True
+            temp_reserved = self._reserve_temp(plan)
             
-            # 首先，提取基础游戏内容
+            pending = {}
             try:
-                # 如果基础游戏是XCZ，需要先解压
-                if base_file.suffix.lower() == '.xcz':
-                    base_xci_path = game_temp_dir / base_file.with_suffix('.xci').name
-                    if not base_xci_path.exists():
-                        self._decompress_xcz(base_file, base_xci_path)
-                else:
-                    base_xci_path = base_file
-                
-                # 复制基础游戏到主XCI文件
-                logger.info(f"复制基础游戏 {base_xci_path} 到 {output_xci_path}")
-                shutil.copy2(base_xci_path, output_xci_path)
+                remaining = self._pending_items(plan, progress)
                 
-                # 处理更新文件
-                if updates:
-                    logger.info(f"处理更新文件...")
-                    if not self.flat_output:
-                        output_update_dir.mkdir(exist_ok=True, parents=True)
-                    
-                    for update_file in updates:
-                        if update_file.suffix.lower() == '.nsz':
-                            logger.info(f"更新文件 {update_file.name} 是NSZ格式，需要先解压...")
-                            # 解压NSZ到临时目录
-                            update_nsp_path = game_temp_dir / update_file.with_suffix('.nsp').name
-                            if not update_nsp_path.exists():
-                                self._decompress_nsz(update_file, update_nsp_path)
-                            update_copy = update_nsp_path
-                        else:
-                            update_copy = update_file
-                        
-                        # 添加游戏名前缀（平铺模式）
-                        output_name = f"{update_prefix}{update_copy.name}"
-                        update_output = output_update_dir / output_name
-                        shutil.copy2(update_copy, update_output)
-                        logger.info(f"更新文件复制完成: {update_output}")
+                # 先提交所有解压任务，解压在后台并发进行
+                for item in remaining:
+                    label, source, staged, output = item
+                    if staged is not None:
+                        self.job_journal.begin(title_id, f"解压{label}", source, output)
+                        pending[self.decompress_pool.submit(source, staged, progress)] = item
                 
-                # 处理DLC文件
-                if dlcs:
-                    logger.info(f"处理 {len(dlcs)} 个DLC文件...")
-                    if not self.flat_output:
-                        output_dlc_dir.mkdir(exist_ok=True, parents=True)
-                    
-                    for dlc_file in dlcs:
-                        if dlc_file.suffix.lower() == '.nsz':
-                            logger.info(f"DLC文件 {dlc_file.name} 是NSZ格式，需要先解压...")
-                            # 解压NSZ到临时目录
-                            dlc_nsp_path = game_temp_dir / dlc_file.with_suffix('.nsp').name
-                            if not dlc_nsp_path.exists():
-                                self._decompress_nsz(dlc_file, dlc_nsp_path)
-                            dlc_copy = dlc_nsp_path
-                        else:
-                            dlc_copy = dlc_file
-                        
-                        # 添加游戏名前缀（平铺模式）
-                        output_name = f"{dlc_prefix}{dlc_copy.name}"
-                        dlc_output = output_dlc_dir / output_name
-                        shutil.copy2(dlc_copy, dlc_output)
-                    
-                    logger.info(f"DLC文件复制完成")
-                
-                # 显示详细的SAK使用提示
-                logger.info("\n使用SAK合并此游戏的步骤:")
-                logger.info(f"1. 下载SAK工具 (https://github.com/dezem/SAK)")
-                logger.info(f"2. 将以下文件添加到SAK工具:")
-                logger.info(f"   - 基础游戏: {output_xci_path}")
-                
-                update_pattern = f"{update_prefix}*.*sp" if self.flat_output else "*.*sp"
-                update_files = list(output_update_dir.glob(update_pattern)) if output_update_dir.exists() else []
-                if update_files:
-                    logger.info(f"   - 更新文件: 位于 {output_update_dir} 目录")
+                # 不需要解压的文件直接输出
+                for label, source, staged, output in remaining:
+                    if staged is None:
+                        self._output_direct(plan, label, source, output, progress)
                 
-                dlc_pattern = f"{dlc_prefix}*.*sp" if self.flat_output else "*.*sp"
-                dlc_files = list(output_dlc_dir.glob(dlc_pattern)) if output_dlc_dir.exists() else []
-                if dlc_files:
-                    logger.info(f"   - DLC文件: 位于 {output_dlc_dir} 目录")
+                if self.move and pending:
+                    logger.info(f"{len(pending)} 个NSZ/XCZ源文件解压后保留在原位置，不会被移动")
                 
-                logger.info(f"3. 使用SAK工具进行合并，选择'完整合并'选项")
-                logger.info(f"4. 或者在YUZU中分别安装基础游戏后，通过'文件->安装文件到NAND'安装更新和DLC")
+                # 解压完成一个输出一个
+                for future in as_completed(list(pending)):
+                    label, source, staged, output = pending.pop(future)
+                    future.result()
+                    self._output_decompressed(plan, label, source, staged, output)
                 
-                # 推荐使用NSC_BUILDER的详细提示
-                logger.info("\n使用NSC_BUILDER合并此游戏的步骤:")
-                logger.info(f"1. 下载NSC_BUILDER工具汉化版 (https://github.com/zdm65477730/NSC_BUILDER/releases)")
-                logger.info(f"2. 将基础游戏、更新文件和DLC文件放在同一个文件夹中")
-                logger.info(f"3. 使用NSC_BUILDER的'多文件处理'功能(输入2)")
-                logger.info(f"4. 将包含所有文件的文件夹拖拽到窗口中")
-                logger.info(f"5. 选择'重新打包列表为XCI'选项")
-                logger.info(f"6. 这将创建一个真正包含更新和DLC的XCI文件，可以被YUZU正确识别")
+                self._finish_merge(plan)
+                success = True
                 
             except Exception as e:
                 logger.error(f"创建XCI文件失败: {str(e)}")
                 import traceback
                 logger.error(traceback.format_exc())
+            finally:
+                # 清理临时目录前取消或等待尚未完成的解压任务
+                for future in pending:
+                    future.cancel()
+                wait(list(pending))
             
-            logger.info(f"游戏 {game_name} 处理完成，输出目录: {output_game_dir}")
+            logger.info(f"游戏 {plan.game_name} 处理完成，输出目录: {plan.output_game_dir}")
             
         except Exception as e:
-            logger.error(f"合并游戏 {game_name} 时出错: {str(e)}")
+            logger.error(f"合并游戏 {files_dict['name']} 时出错: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
         finally:
-            # 清理游戏临时目录
-            if game_temp_dir and game_temp_dir.exists():
+            if plan is not None:
+                self._cleanup_merge(plan)
+            self._release_temp(temp_reserved)
+            self.profiler.record_game(files_dict['name'], time.perf_counter() - game_start, success)
+            self.progress.finish(files_dict['name'])
+        return success
+    
+    def _plan_merge(self, title_id: str, files_dict: Dict) -> Optional[MergePlan]:
+        """确定一个游戏的输出路径和所有需要输出的文件
+
+        没有基础游戏文件时返回None；输入与上次一致时返回up_to_date为True的计划，不需要再输出。
+        线程引擎和asyncio引擎共用。
+        """
+        base_file = files_dict['base']
+        updates = files_dict['updates']
+        dlcs = files_dict['dlcs']
+        game_name = files_dict['name']
+        
+        # 如果没有基础游戏文件，无法合并
+        if not base_file:
+            logger.warning(f"游戏 {game_name} 没有基础文件，无法合并")
+            return None
+        
+        # 使用最新版本的更新文件
+        latest_update = self._latest_update(files_dict)
+        if latest_update:
+            logger.info(f"找到最新的更新文件: {latest_update.name}")
+        
+        # 合并为单一XCI功能
+        logger.info(f"开始合并游戏 {game_name}")
+        logger.info(f"基础游戏: {base_file}")
+        if latest_update:
+            logger.info(f"更新文件: {latest_update}")
+        logger.info(f"DLC文件: {len(dlcs)} 个")
+        
+        layout = self._output_layout(files_dict)
+        layout.output_game_dir.mkdir(exist_ok=True, parents=True)
+        if self.flat_output:
+            logger.info(f"使用平铺输出模式")
+        
+        logger.info(f"输出目录: {layout.output_game_dir}")
+        logger.info(f"主XCI文件: {layout.output_xci_path}")
+        
+        # 增量合并: 输入与上次一致且输出文件完好时跳过
+        with self.profiler.phase('merge.manifest', game_name):
+            manifest = OutputManifest(
+                OutputManifest.path_for(self.output_dir, layout.output_game_dir, game_name, self.flat_output),
+                [('base', base_file)] + [('update', record) for record in updates] + [('dlc', record) for record in dlcs],
+                latest_update, dlcs, {'link_mode': self.link_mode})
+            previous_manifest = manifest.load_previous()
+            up_to_date = not self.force and manifest.is_up_to_date(previous_manifest)
+            if not up_to_date:
+                manifest.invalidate()
+        
+        if up_to_date:
+            skipped_bytes = OutputManifest.output_bytes(previous_manifest)
+            with self._skip_lock:
+                self.skipped_games += 1
+                self.skipped_bytes += skipped_bytes
+            logger.info(f"游戏 {game_name} 的源文件未变化，跳过 ({skipped_bytes / GB:.2f} GB)")
+            return MergePlan(title_id, game_name, [], manifest, previous_manifest, True, *layout, None)
+        
+        # 解压结果暂存在临时目录时，为该游戏创建临时工作目录
+        game_temp_dir = self._game_temp_dir(game_name)
+        if game_temp_dir:
+            game_temp_dir.mkdir(exist_ok=True, parents=True)
+        
+        # 使用hactoolnet进行XCI合并
+        # 注意: 这里使用的方法是创建一个组合XCI文件，但实际上是将原始XCI游戏复制并提供单独的更新和DLC
+        # 对于YUZU/Ryujinx模拟器，可能需要安装更新和DLC，而不是仅加载XCI
+        # 真正组合的XCI文件需要使用高级工具如SAK或NSC_BUILDER
+        logger.info(f"创建XCI文件: {layout.output_xci_path}")
+        
+        items = self._merge_items(files_dict, layout, game_temp_dir)
+        for label, source, staged, output in items[1:]:
+            if staged is not None:
+                logger.info(f"{label} {source.name} 是NSZ格式，需要先解压...")
+        
+        if updates and not self.flat_output:
+            layout.output_update_dir.mkdir(exist_ok=True, parents=True)
+        if dlcs and not self.flat_output:
+            layout.output_dlc_dir.mkdir(exist_ok=True, parents=True)
+        return MergePlan(title_id, game_name, items, manifest, previous_manifest, False, *layout, game_temp_dir)
+    
+    @staticmethod
+    def _latest_update(files_dict: Dict) -> Optional[FileRecord]:
+        """按照文件大小选择最大的更新文件（通常是最新的）"""
+        if not files_dict['updates']:
+            return None
+        return max(files_dict['updates'], key=lambda f: f.size)
+    
+    def _game_temp_dir(self, game_name: str) -> Optional[Path]:
+        """解压结果暂存在临时目录时使用的游戏临时目录"""
+        return self.temp_dir / game_name if self.stage_in_temp else None
+    
+    def _output_layout(self, files_dict: Dict) -> OutputLayout:
+        """计算游戏的输出路径，不创建目录"""
+        game_name = files_dict['name']
+        latest_update = self._latest_update(files_dict)
+        
+        # 构建输出文件名
+        output_filename = f"{game_name}"
+        if latest_update:
+            # 尝试从更新文件名中提取版本号
+            update_version = latest_update.version
+            if update_version:
+                output_filename += f"_v{update_version}"
+            else:
+                output_filename += "_更新版"
+        
+        if files_dict['dlcs']:
+            output_filename += f"_{len(files_dict['dlcs'])}DLC"
+        
+        # 清理文件名称中的特殊字符
+        output_filename = re.sub(r'[\\/:*?"<>|]', '', output_filename)
+        output_filename += ".xci"
+        
+        # 根据平铺设置决定输出目录结构
+        if self.flat_output:
+            # 平铺模式：所有文件直接放在output目录下，
+            # 更新和DLC文件名添加游戏前缀，防止不同游戏文件重名
+            output_game_dir = self.output_dir
+            return OutputLayout(output_game_dir, output_game_dir / output_filename, output_game_dir, output_game_dir,
+                                f"{game_name}_", f"{game_name}_")
+        
+        # 默认模式：按游戏名创建子目录，更新和DLC放在UPDATE和DLC子目录中，不需要添加前缀
+        output_game_dir = self.output_dir / game_name
+        return OutputLayout(output_game_dir, output_game_dir / f"{game_name}.xci",
+                            output_game_dir / "UPDATE", output_game_dir / "DLC", "", "")
+    
+    def _merge_items(self, files_dict: Dict, layout: OutputLayout,
+                     game_temp_dir: Optional[Path]) -> List[Tuple[str, Path, Optional[Path], Path]]:
+        """规划所有需要输出的文件: (说明, 源文件, 解压目标, 输出路径)
+
+        NSZ/XCZ文件需要先解压，解压目标为None表示直接复制。
+        """
+        return [(label, record.path, staged, output)
+                for label, record, staged, output in self._merge_records(files_dict, layout, game_temp_dir)]
+    
+    def _merge_records(self, files_dict: Dict, layout: OutputLayout,
+                       game_temp_dir: Optional[Path]) -> List[Tuple[str, FileRecord, Optional[Path], Path]]:
+        """与_merge_items相同，但源文件为扫描得到的FileRecord（带有大小和设备号）"""
+        base_file = files_dict['base']
+        items = []
+        if base_file.suffix.lower() == '.xcz':
+            # 如果基础游戏是XCZ，需要先解压
+            items.append(("基础游戏", base_file,
+                          self._staging_path(base_file.path.with_suffix('.xci').name, layout.output_xci_path,
+                                             game_temp_dir),
+                          layout.output_xci_path))
+        else:
+            items.append(("基础游戏", base_file, None, layout.output_xci_path))
+        
+        for label, files, output_dir, prefix in (
+                ("更新文件", files_dict['updates'], layout.output_update_dir, layout.update_prefix),
+                ("DLC文件", files_dict['dlcs'], layout.output_dlc_dir, layout.dlc_prefix)):
+            for record in files:
+                if record.suffix.lower() == '.nsz':
+                    decompressed_name = record.path.with_suffix('.nsp').name
+                    # 添加游戏名前缀（平铺模式）
+                    output = output_dir / f"{prefix}{decompressed_name}"
+                    staged = self._staging_path(decompressed_name, output, game_temp_dir)
+                else:
+                    output = output_dir / f"{prefix}{record.name}"
+                    staged = None
+                items.append((label, record, staged, output))
+        return items
+    
+    def _pending_items(self, plan: MergePlan, progress: ByteCallback) -> List[Tuple[str, Path, Optional[Path], Path]]:
+        """继续上次中断的任务时，跳过已完成的步骤，返回还需要输出的文件"""
+        remaining = []
+        for item in plan.items:
+            label, source, staged, output = item
+            if self.job_journal.is_done(plan.title_id, source, output):
+                logger.info(f"{label} {output} 已在上次运行中完成，跳过")
+                progress(output.stat().st_size)
+            else:
+                remaining.append(item)
+        return remaining
+    
+    def _output_direct(self, plan: MergePlan, label: str, source: Path, output: Path,
+                       progress: ByteCallback):
+        """输出不需要解压的文件（复制、链接或移动）"""
+        self.job_journal.begin(plan.title_id, f"输出{label}", source, output)
+        with self.profiler.phase('merge.output', plan.game_name):
+            if self.move:
+                strategy = self.move_journal.move(source, output)
+                progress(output.stat().st_size)
+            else:
+                strategy = transfer_file(source, output, self.link_mode, progress=progress)
+        self.job_journal.done(plan.title_id, f"输出{label}", source, output, moved=self.move)
+        logger.info(f"输出{label} {source} 到 {output} (方式: {strategy})")
+    
+    def _output_decompressed(self, plan: MergePlan, label: str, source: Path, staged: Path, output: Path):
+        """输出解压完成的文件，对应的解压步骤由调用者开始"""
+        with self.profiler.phase('merge.output', plan.game_name):
+            strategy = self._output_staged(staged, output)
+        self.job_journal.done(plan.title_id, f"解压{label}", source, output)
+        logger.info(f"输出{label} {staged} 到 {output} (方式: {strategy})")
+    
+    def _finish_merge(self, plan: MergePlan):
+        """所有文件输出后保存输出清单、删除过期输出并显示合并提示"""
+        logger.info(f"{len(plan.items)} 个文件复制完成")
+        
+        outputs = [output for label, source, staged, output in plan.items]
+        with self.profiler.phase('merge.finalize', plan.game_name):
+            plan.manifest.save(outputs)
+            self._remove_stale_outputs(plan.previous_manifest, outputs)
+        
+        output_update_dir = plan.output_update_dir
+        output_dlc_dir = plan.output_dlc_dir
+        
+        # 显示详细的SAK使用提示
+        logger.info("\n使用SAK合并此游戏的步骤:")
+        logger.info(f"1. 下载SAK工具 (https://github.com/dezem/SAK)")
+        logger.info(f"2. 将以下文件添加到SAK工具:")
+        logger.info(f"   - 基础游戏: {plan.output_xci_path}")
+        
+        update_pattern = f"{plan.update_prefix}*.*sp" if self.flat_output else "*.*sp"
+        update_files = list(output_update_dir.glob(update_pattern)) if output_update_dir.exists() else []
+        if update_files:
+            logger.info(f"   - 更新文件: 位于 {output_update_dir} 目录")
+        
+        dlc_pattern = f"{plan.dlc_prefix}*.*sp" if self.flat_output else "*.*sp"
+        dlc_files = list(output_dlc_dir.glob(dlc_pattern)) if output_dlc_dir.exists() else []
+        if dlc_files:
+            logger.info(f"   - DLC文件: 位于 {output_dlc_dir} 目录")
+        
+        logger.info(f"3. 使用SAK工具进行合并，选择'完整合并'选项")
+        logger.info(f"4. 或者在YUZU中分别安装基础游戏后，通过'文件->安装文件到NAND'安装更新和DLC")
+        
+        # 推荐使用NSC_BUILDER的详细提示
+        logger.info("\n使用NSC_BUILDER合并此游戏的步骤:")
+        logger.info(f"1. 下载NSC_BUILDER工具汉化版 (https://github.com/zdm65477730/NSC_BUILDER/releases)")
+        logger.info(f"2. 将基础游戏、更新文件和DLC文件放在同一个文件夹中")
+        logger.info(f"3. 使用NSC_BUILDER的'多文件处理'功能(输入2)")
+        logger.info(f"4. 将包含所有文件的文件夹拖拽到窗口中")
+        logger.info(f"5. 选择'重新打包列表为XCI'选项")
+        logger.info(f"6. 这将创建一个真正包含更新和DLC的XCI文件，可以被YUZU正确识别")
+    
+    def _cleanup_merge(self, plan: MergePlan):
+        """删除未完成的.part暂存目录和游戏临时目录，所有解压任务结束后调用"""
+        if not self.stage_in_temp:
+            with self.profiler.phase('merge.cleanup', plan.game_name):
+                for label, source, staged, output in plan.items:
+                    if staged is not None and staged.parent.exists():
+                        shutil.rmtree(staged.parent, ignore_errors=True)
+        
+        # 清理游戏临时目录
+        game_temp_dir = plan.game_temp_dir
+        if game_temp_dir and game_temp_dir.exists():
+            with self.profiler.phase('merge.cleanup', plan.game_name):
                 try:
                     logger.info(f"清理临时文件: {game_temp_dir}")
                     shutil.rmtree(game_temp_dir)
                 except Exception as e:
                     logger.warning(f"清理临时文件失败: {str(e)}")
     
-    def _decompress_nsz(self, nsz_file: Path, output_nsp: Path) -> bool:
-        """将NSZ文件解压为NSP"""
-        try:
-            logger.info(f"解压NSZ文件: {nsz_file}")
-            # 确保输出目录存在
-            output_nsp.parent.mkdir(exist_ok=True, parents=True)
+    def _remove_stale_outputs(self, previous_manifest: Optional[Dict], outputs: List[Path]):
+        """删除上次合并输出、本次不再需要的文件（如被新版本替换的更新）"""
+        if not previous_manifest:
+            return
+        current = {str(path) for path in outputs}
+        for output in previous_manifest.get('outputs', []):
+            if output['path'] in current:
+                continue
+            if self.move:
+                # 移动模式下旧输出就是用户的源文件，不能删除
+                logger.info(f"保留上次移动的文件: {output['path']}")
+                continue
+            try:
+                os.unlink(output['path'])
+                logger.info(f"删除过期的输出文件: {output['path']}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除过期的输出文件失败: {str(e)}")
+    
+    @staticmethod
+    def _part_dir(output: Path) -> Path:
+        """输出文件旁边的暂存目录，与输出文件位于同一文件系统"""
+        return output.with_name(f".{output.name}.part")
+    
+    def _staging_path(self, decompressed_name: str, output: Path, game_temp_dir: Optional[Path]) -> Path:
+        """解压目标路径: 默认解压到输出文件旁的.part目录，完成后原子重命名"""
+        if self.stage_in_temp:
+            return game_temp_dir / decompressed_name
+        return self._part_dir(output) / decompressed_name
+    
+    def _output_staged(self, staged: Path, output: Path) -> str:
+        """输出解压结果
+
+        直接输出模式下解压结果已在目标文件系统上，重命名即可；
+        暂存在临时目录时，临时文件会被清理，不能使用符号链接。
+        """
+        if not self.stage_in_temp:
+            os.replace(staged, output)
+            staged.parent.rmdir()
+            return 'rename'
+        if self.move:
+            try:
+                os.replace(staged, output)
+                return 'rename'
+            except OSError:
+                pass
+        return transfer_file(staged, output, self.link_mode, allow_symlink=False)
+    
+    def merge_games(self, games: List[Tuple[str, Dict]], jobs: int = 1) -> List[GameResult]:
+        """合并多个游戏，jobs大于1时多个游戏并发处理，按merge_engine选择线程或asyncio引擎"""
+        self.skipped_games = 0
+        self.skipped_bytes = 0
+        self._check_decompressor(games)
+        self._output_sizes = {}
+        refused = []
+        if self.space_check:
+            games, refused = self._preflight_space(games)
+        self.job_journal.start_batch()
+        self.progress.reset()
+        for _, files_dict in games:
+            self.progress.plan(files_dict['name'], self._planned_bytes(files_dict))
+        
+        # 进度条按字节显示，附带当前游戏的进度和剩余时间
+        from tqdm import tqdm
+        with tqdm(total=self.progress.total, unit='B', unit_scale=True, unit_divisor=1024,
+                  desc=f"合并游戏 0/{len(games)}") as bar:
+            finished = []
             
-            # 构建解压命令
-            cmd = [
-                str(self.nsz_path),
-                "-D", "-w",  # -w表示覆盖现有文件
-                "-o", str(output_nsp.parent),
-                str(nsz_file)
-            ]
+            def on_progress(event):
+                bar.total = event.total
+                bar.update(event.done - bar.n)
+                if event.game:
+                    bar.set_postfix_str('' if event.finished else describe(event).split(' | ')[0], refresh=False)
             
-            logger.debug(f"执行命令: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            def on_done(result):
+                finished.append(result)
+                bar.set_description(f"合并游戏 {len(finished)}/{len(games)}")
             
-            if result.returncode == 0:
-                logger.info(f"NSZ解压成功: {output_nsp}")
-                return True
+            self.progress.add_listener(on_progress)
+            try:
+                if self.merge_engine == 'asyncio':
+                    from async_merge import AsyncMergeEngine
+                    results = AsyncMergeEngine(self, jobs, self.disk_jobs).run(games, on_done=on_done)
+                else:
+                    results = MergeScheduler(self.merge_files, jobs=jobs).run(games, on_done=on_done)
+            finally:
+                self.progress.remove_listener(on_progress)
+        if refused:
+            logger.error(f"磁盘空间不足，{len(refused)} 个游戏未合并")
+            results = results + refused
+        if self.skipped_games:
+            logger.info(f"增量合并: 跳过 {self.skipped_games} 个未变化的游戏，避免写入 {self.skipped_bytes / GB:.2f} GB")
+        if self.job_journal.resumed_steps:
+            logger.info(f"断点续传: 跳过 {self.job_journal.resumed_steps} 个已完成的步骤 "
+                        f"({self.job_journal.resumed_bytes / GB:.2f} GB)")
+        # 全部成功后任务日志不再需要
+        if all(result.success for result in results):
+            self.job_journal.clear()
+        return results
+    
+    def _preflight_space(self, games: List[Tuple[str, Dict]]) -> Tuple[List[Tuple[str, Dict]], List[GameResult]]:
+        """合并前估计每个游戏需要的空间，拒绝放不下的游戏并设置临时空间预算
+
+        返回可以合并的游戏和被拒绝游戏的结果。
+        """
+        with self.profiler.phase('merge.preflight'):
+            needs = [self._space_need(group_id, files_dict) for group_id, files_dict in games]
+            plan = plan_space(needs, self.output_dir, self.temp_dir, self.temp_budget_bytes)
+        
+        output_bytes = sum(need.output_bytes for need in needs if need.group_id not in plan.refused)
+        message = f"空间预检: {len(plan.accepted)} 个游戏预计写入 {format_size(output_bytes)}"
+        if plan.temp_budget is not None:
+            message += f"，临时空间预算 {format_size(plan.temp_budget)}"
+        logger.info(message)
+        
+        self._temp_needs = {need.group_id: need.temp_bytes for need in needs}
+        self._temp_budget = TempBudget(plan.temp_budget) if plan.temp_budget is not None else None
+        
+        accepted, refused = [], []
+        for group_id, files_dict in games:
+            reason = plan.refused.get(group_id)
+            if reason is None:
+                accepted.append((group_id, files_dict))
             else:
-                logger.error(f"NSZ解压失败: {result.stderr}")
+                logger.error(f"跳过游戏 {files_dict['name']}: {reason}")
+                refused.append(GameResult(group_id, files_dict['name'], False, (reason,)))
+        return accepted, refused
+    
+    def _space_need(self, group_id: str, files_dict: Dict) -> SpaceNeed:
+        """估计合并一个游戏需要的输出和临时空间
+
+        源文件的大小和设备号使用扫描时的记录，只读取NSZ/XCZ的文件头和已有输出的大小，不创建任何文件。
+        """
+        layout = self._output_layout(files_dict)
+        items = self._merge_records(files_dict, layout, self._game_temp_dir(files_dict['name']))
+        output_device = device_of(self.output_dir)
+        output_bytes = temp_bytes = 0
+        for label, source, staged, output in items:
+            size = self._output_size(source) if staged is not None else source.size
+            try:
+                # 输出已存在且大小相同（如未变化的游戏）时不需要新的空间
+                if output.stat().st_size == size:
+                    continue
+            except OSError:
+                pass
+            if staged is not None:
+                if self.stage_in_temp:
+                    temp_bytes += size
+                output_bytes += size
+            elif not self._shares_blocks(source, output_device):
+                output_bytes += size
+        return SpaceNeed(group_id, files_dict['name'], output_bytes, temp_bytes)
+    
+    def _shares_blocks(self, source: FileRecord, output_device: int) -> bool:
+        """直接输出的文件是否不占用新的空间（符号链接，或同一磁盘上的硬链接和移动）"""
+        if not self.move:
+            if self.link_mode == 'symlink':
+                return True
+            if self.link_mode not in ('hardlink', 'auto'):
                 return False
-                
+        # 遍历时未获得设备号（Windows）才需要stat
+        return (source.device or device_of(source.path)) == output_device
+    
+    def _temp_need(self, plan: MergePlan) -> int:
+        """游戏需要占用的临时空间预算（预检时估计），不需要限制时为0"""
+        if self._temp_budget is None or plan.up_to_date:
+            return 0
+        return self._temp_needs.get(plan.title_id, 0)
+    
+    def _reserve_temp(self, plan: MergePlan) -> int:
+        """按预检估计的临时空间占用预算，预算不足时等待其他游戏完成，返回占用的字节数"""
+        need = self._temp_need(plan)
+        return self._temp_budget.acquire(need) if need else 0
+    
+    def _release_temp(self, nbytes: int):
+        if self._temp_budget is not None:
+            self._temp_budget.release(nbytes)
+    
+    def _output_size(self, record: FileRecord) -> int:
+        """文件输出后的大小: NSZ/XCZ按文件头估计解压后的大小（本批次内缓存），其余为文件大小"""
+        if record.suffix.lower() not in ('.nsz', '.xcz'):
+            return record.size
+        size = self._output_sizes.get(record.path)
+        if size is None:
+            size = ncz_engine.decompressed_size(record.path)
+            if size is None:
+                size = record.size
+            self._output_sizes[record.path] = size
+        return size
+    
+    def _planned_bytes(self, files_dict: Dict) -> int:
+        """估计合并一个游戏要写入的字节数，NSZ/XCZ按解压后的大小估计"""
+        records = [files_dict['base']] + files_dict['dlcs']
+        if files_dict['updates']:
+            records.append(max(files_dict['updates'], key=lambda f: f.size))
+        return sum(self._output_size(record) for record in records if record is not None)
+    
+    @property
+    def decompress_pool(self) -> DecompressPool:
+        """所有游戏共享的解压池，首次使用时创建"""
+        with self._pool_lock:
+            if self._decompress_pool is None:
+                self._decompress_pool = DecompressPool(self.tools, max_workers=self.decompress_workers,
+                                                       timeout=self.decompress_timeout,
+                                                       cache=self.decompress_cache,
+                                                       engine=self.decompress_engine,
+                                                       profiler=self.profiler)
+            return self._decompress_pool
+    
+    def close(self):
+        """关闭解压池并输出解压缓存统计"""
+        with self._pool_lock:
+            if self._decompress_pool is not None:
+                self._decompress_pool.shutdown()
+                self._decompress_pool = None
+        if self.decompress_cache:
+            self.decompress_cache.report()
+    
+    def _decompress_nsz(self, nsz_file: Path, output_nsp: Path) -> bool:
+        """将NSZ文件解压为NSP"""
+        try:
+            logger.info(f"解压NSZ文件: {nsz_file}")
+            self.decompress_pool.decompress(nsz_file, output_nsp)
+            logger.info(f"NSZ解压成功: {output_nsp}")
+            return True
+        except DecompressError as e:
+            logger.error(f"NSZ解压失败: {str(e)}")
+            return False
         except Exception as e:
             logger.error(f"解压NSZ文件 {nsz_file} 时出错: {str(e)}")
             import traceback
@@ -861,27 +1328,12 @@ class SwitchRomMerger:
         """将XCZ文件解压为XCI"""
         try:
             logger.info(f"解压XCZ文件: {xcz_file}")
-            # 确保输出目录存在
-            output_xci.parent.mkdir(exist_ok=True, parents=True)
-            
-            # 构建解压命令
-            cmd = [
-                str(self.nsz_path),
-                "-D", "-w",  # -w表示覆盖现有文件
-                "-o", str(output_xci.parent),
-                str(xcz_file)
-            ]
-            
-            logger.debug(f"执行命令: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                logger.info(f"XCZ解压成功: {output_xci}")
-                return True
-            else:
-                logger.error(f"XCZ解压失败: {result.stderr}")
-                return False
-                
+            self.decompress_pool.decompress(xcz_file, output_xci)
+            logger.info(f"XCZ解压成功: {output_xci}")
+            return True
+        except DecompressError as e:
+            logger.error(f"XCZ解压失败: {str(e)}")
+            return False
         except Exception as e:
             logger.error(f"解压XCZ文件 {xcz_file} 时出错: {str(e)}")
             import traceback
@@ -890,55 +1342,217 @@ class SwitchRomMerger:
     
     def _extract_version(self, file_path: Path) -> Optional[str]:
         """从文件名中提取版本号"""
-        # 首先尝试匹配常见的版本号格式
-        patterns = [
-            r'v(\d+\.\d+(\.\d+)?)',  # v1.2.3 格式
-            r'v(\d+_\d+(_\d+)?)',    # v1_2_3 格式
-            r'[vV](\d+)',            # v1 格式
-            r'(\d+\.\d+(\.\d+)?)',   # 1.2.3 格式
-            r'(\d+_\d+(_\d+)?)'      # 1_2_3 格式
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, str(file_path))
-            if match:
-                version = match.group(1)
-                # 标准化版本号格式（将_替换为.）
-                return version.replace('_', '.')
-        
-        return None
+        return parse_name(str(file_path)).version
     
-    def process_directory(self, directory: Path):
+    def process_directory(self, directory: Path, jobs: int = 1) -> List[GameResult]:
         """处理指定目录下的所有Switch游戏文件"""
         logger.info(f"开始处理目录: {directory}")
         
         # 扫描文件
         game_files = self.scan_directory(directory)
         
-        # 移除没有基础游戏的条目（除非显式指定了游戏ID）
-        if not args.game_id:
-            for game_id in list(game_files.keys()):
-                if not game_files[game_id]['base']:
-                    logger.warning(f"游戏 {game_id} 没有基础游戏文件，将被跳过")
-                    del game_files[game_id]
+        # 移除没有基础游戏的条目
+        for game_id in list(game_files.keys()):
+            if not game_files[game_id]['base']:
+                logger.warning(f"游戏 {game_id} 没有基础游戏文件，将被跳过")
+                del game_files[game_id]
         
         # 处理每个游戏
-        for game_id, files_dict in tqdm(game_files.items(), desc="合并游戏"):
-            self.merge_files(game_id, files_dict)
+        results = self.merge_games(list(game_files.items()), jobs=jobs)
         
         logger.info("处理完成")
+        return results
+    
+    def watch_directory(self, directory: Path, jobs: int = 1, settle: float = DEFAULT_SETTLE_SECONDS,
+                        batch_window: float = DEFAULT_BATCH_WINDOW, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                        polling: bool = False, stop: Optional[threading.Event] = None):
+        """监视模式: 先处理一次整个目录，之后只重新识别有变化的文件、只重新合并受影响的游戏
+
+        一直运行到stop被设置或按Ctrl+C。
+        """
+        from rom_watcher import RomWatcher, create_backend
+        
+        # 输出、临时和缓存目录由合并本身写入，位于监视目录中时（如没有rom目录时监视当前目录）
+        # 必须排除，否则合并产生的文件又会触发合并
+        exclude = self._own_dirs()
+        
+        # 先建立监视再扫描，扫描和首次合并期间到达的文件不会遗漏
+        backend = create_backend(directory, self.supported_extensions, poll_interval, polling, exclude)
+        games = self.scan_directory(directory, exclude=exclude)
+        records = {record.path: record for record in self.scanned_records}
+        self.merge_games([(group_id, files_dict) for group_id, files_dict in games.items() if files_dict['base']],
+                         jobs=jobs)
+        
+        def is_own(path: Path) -> bool:
+            path = path.absolute()
+            return any(own == path or own in path.parents for own in exclude)
+        
+        def on_batch(changed: Set[Path], rescan: bool):
+            nonlocal games
+            if rescan:
+                new_games = self.scan_directory(directory, exclude=exclude)
+                records.clear()
+                records.update((record.path, record) for record in self.scanned_records)
+            else:
+                self._update_records(records, {path for path in changed if not is_own(path)})
+                with self.profiler.phase('scan.group'):
+                    new_games = self._group_records(directory, sorted(records.values(), key=lambda r: r.path),
+                                                    show_progress=False)
+            
+            # 文件组成或任一文件的大小、修改时间有变化的游戏需要重新合并
+            affected = [(group_id, files_dict) for group_id, files_dict in new_games.items()
+                        if files_dict['base'] and self._game_signature(files_dict) != self._game_signature(games.get(group_id))]
+            games = new_games
+            if not affected:
+                logger.info("没有需要重新合并的游戏")
+                return
+            logger.info(f"重新合并 {len(affected)} 个受影响的游戏:")
+            self._log_games(dict(affected))
+            self.merge_games(affected, jobs=jobs)
+            logger.info("继续监视...")
+        
+        RomWatcher(backend, on_batch, settle=settle, batch_window=batch_window).run(stop)
+    
+    def _own_dirs(self) -> List[Path]:
+        """合并过程自己写入的目录（输出、临时、缓存），绝对路径"""
+        return [self.output_dir.absolute(), self.temp_dir.absolute(), Path('cache').absolute()]
+    
+    def _update_records(self, records: Dict[Path, FileRecord], changed: Set[Path]):
+        """只重新识别有变化的文件，删除的文件（包括被删除或移走的目录中的文件）从记录中移除"""
+        updated, removed = [], []
+        for path in changed:
+            record = None
+            if path.suffix.lower() in self.supported_extensions:
+                try:
+                    record = FileRecord.from_path(path)
+                except OSError:
+                    pass
+            if record is not None:
+                records[path] = record
+                updated.append(record)
+                continue
+            for known in [known for known in records if known == path or path in known.parents]:
+                del records[known]
+                removed.append(known)
+        
+        with self.profiler.phase('scan.classify'):
+            results = self._classify_records(updated)
+            for record, result in zip(updated, results):
+                record.title_id, record.kind, record.version = result
+            if self.use_index and (updated or removed):
+                index = ScanIndex(self.index_path)
+                try:
+                    index.store([(str(record.path.absolute()), record.size, record.mtime_ns, record.inode,
+                                  self.read_headers) + result
+                                 for record, result in zip(updated, results)])
+                    index.remove([str(path.absolute()) for path in removed])
+                finally:
+                    index.close()
+        logger.info(f"增量识别: 重新解析 {len(updated)} 个文件，移除 {len(removed)} 个文件")
+    
+    @staticmethod
+    def _game_signature(files_dict: Optional[Dict]) -> Optional[Tuple]:
+        """游戏的名称和所有文件的路径、大小、修改时间，用于判断游戏是否受文件变化影响"""
+        if files_dict is None:
+            return None
+        records = [files_dict['base']] + files_dict['updates'] + sorted(files_dict['dlcs'], key=lambda r: r.path)
+        return (files_dict['name'],) + tuple((record.path, record.size, record.mtime_ns) if record else None
+                                             for record in records)
+
+def find_library_duplicates(library_dir: Path, output_dir: Path, hardlink: bool = False):
+    """查找游戏库和输出目录中的重复文件，可选将输出目录中的重复文件替换为硬链接"""
+    extensions = {'.xci', '.xcz', '.nsp', '.nsz'}
+    cache_dir = Path('cache').absolute()
+    records = walk_files(library_dir, extensions)
+    if output_dir.exists() and output_dir.absolute() not in library_dir.absolute().parents \
+            and library_dir.absolute() not in output_dir.absolute().parents and library_dir != output_dir:
+        records += walk_files(output_dir, extensions)
+    # 解压缓存中的文件不属于游戏库
+    records = [record for record in records if cache_dir not in record.path.absolute().parents]
+    
+    fingerprinter = Fingerprinter()
+    try:
+        groups = find_duplicates(records, fingerprinter)
+        fingerprinter.report()
+    finally:
+        fingerprinter.close()
+    
+    wasted = sum(group.wasted_bytes for group in groups)
+    for group in groups:
+        logger.info(f"重复文件 ({len(group.paths)} 份, 每份 {group.size / GB:.2f} GB):")
+        for path in group.paths:
+            logger.info(f"  {path}")
+    logger.info(f"重复检测完成: {len(groups)} 组重复文件，浪费 {wasted / GB:.2f} GB")
+    
+    if hardlink:
+        linked, freed = hardlink_duplicates(groups, output_dir)
+        logger.info(f"硬链接去重: 替换 {linked} 个文件，释放 {freed / GB:.2f} GB")
 
 def main():
+    configure_runtime()
     try:
-        # 全局禁用SSL证书验证
-        os.environ['PYTHONHTTPSVERIFY'] = '0'
-        
         # 解析命令行参数
         parser = argparse.ArgumentParser(description='Switch游戏合并工具')
         parser.add_argument('--scan-only', action='store_true', help='仅扫描游戏文件，不执行合并')
         parser.add_argument('--game-id', type=str, help='仅处理指定ID的游戏')
         parser.add_argument('--flat-output', action='store_true', help='平铺所有输出文件到output根目录，不创建游戏子目录')
+        parser.add_argument('--rebuild-index', action='store_true', help='忽略已有的扫描索引，重新解析所有文件')
+        parser.add_argument('--no-header-scan', action='store_true', help='不读取文件头，仅根据文件名识别Title ID')
+        parser.add_argument('--jobs', type=int, default=1, help='同时合并的游戏数量（默认1）')
+        parser.add_argument('--decompress-workers', type=int, default=DEFAULT_DECOMPRESS_WORKERS,
+                            help=f'同时运行的NSZ/XCZ解压进程数（默认为CPU核心数 {DEFAULT_DECOMPRESS_WORKERS}）')
+        parser.add_argument('--decompress-timeout', type=float, default=None, help='单个文件解压超时时间（秒，仅对nsz工具有效）')
+        parser.add_argument('--decompress-engine', choices=DECOMPRESS_ENGINES, default='auto',
+                            help='解压引擎: auto优先使用内置引擎、失败时改用nsz工具，builtin仅内置引擎，nsz仅nsz工具（默认auto）')
+        parser.add_argument('--engine', choices=MERGE_ENGINES, default='threads',
+                            help='合并引擎: threads线程池，asyncio事件循环（解压使用异步子进程，按CPU和磁盘分别限制并发）（默认threads）')
+        parser.add_argument('--disk-jobs', type=int, default=DEFAULT_DISK_JOBS,
+                            help=f'asyncio引擎中每个磁盘同时进行的复制数量（默认{DEFAULT_DISK_JOBS}）')
+        parser.add_argument('--link-mode', choices=LINK_MODES, default='copy',
+                            help='文件输出方式: copy复制, hardlink硬链接, reflink写时复制克隆, symlink符号链接, '
+                                 'auto自动选择文件系统支持的最快方式（默认copy）')
+        parser.add_argument('--move', action='store_true',
+                            help='将源文件移动到输出目录（同一磁盘时直接重命名），并记录回滚日志')
+        parser.add_argument('--decompress-cache-gb', type=float, default=0,
+                            help='NSZ/XCZ解压结果缓存的大小上限（GB），再次合并时直接复用，默认0表示不缓存')
+        parser.add_argument('--stage-in-temp', action='store_true',
+                            help='NSZ/XCZ先解压到temp目录再输出（默认直接解压到输出目录，数据只写一次）')
+        parser.add_argument('--temp-budget-gb', type=float, default=None,
+                            help='与--stage-in-temp一起使用，同时进行的游戏在temp中最多占用的空间（GB），默认为temp所在磁盘的剩余空间')
+        parser.add_argument('--no-space-check', action='store_true', help='合并前不检查磁盘剩余空间')
+        parser.add_argument('--force', action='store_true', help='忽略输出清单，重新合并所有游戏')
+        parser.add_argument('--resume', action='store_true', help='根据任务日志从上次中断处继续，跳过已完成的步骤')
+        parser.add_argument('--find-duplicates', action='store_true',
+                            help='查找ROM目录和output中内容相同的文件，报告浪费的空间')
+        parser.add_argument('--hardlink-duplicates', action='store_true',
+                            help='与--find-duplicates一起使用，将output中的重复文件替换为硬链接')
+        parser.add_argument('--profile', type=Path, metavar='OUT.json',
+                            help='将扫描和合并各阶段的耗时、读写字节数、外部进程耗时和stat次数保存为JSON报告')
+        parser.add_argument('--profile-scan', choices=SCAN_CAPTURES,
+                            help='与--profile一起使用，用cProfile或tracemalloc详细分析扫描阶段')
+        parser.add_argument('--watch', action='store_true',
+                            help='监视模式: 持续监视ROM目录，新增或修改的文件写入完成后只重新合并受影响的游戏，Ctrl+C停止')
+        parser.add_argument('--watch-settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                            help=f'文件大小保持不变多少秒后认为写入完成，这段时间内到达的文件合为一批处理（默认{DEFAULT_SETTLE_SECONDS:.0f}）')
+        parser.add_argument('--watch-batch', type=float, default=DEFAULT_BATCH_WINDOW,
+                            help=f'文件持续到达时一批最多等待的秒数（默认{DEFAULT_BATCH_WINDOW:.0f}）')
+        parser.add_argument('--watch-poll', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help=f'轮询方式检查目录的间隔秒数（默认{DEFAULT_POLL_INTERVAL:.0f}）')
+        parser.add_argument('--watch-polling', action='store_true',
+                            help='不使用inotify，始终轮询（适用于网络共享等不产生文件事件的目录）')
+        parser.add_argument('--rollback-moves', action='store_true', help='根据回滚日志将移动过的文件恢复到原位置')
         args = parser.parse_args()
+        if args.profile_scan and not args.profile:
+            parser.error('--profile-scan需要与--profile一起使用')
+        if args.watch and (args.scan_only or args.game_id or args.find_duplicates):
+            parser.error('--watch不能与--scan-only、--game-id或--find-duplicates一起使用')
+        
+        # 恢复移动前的文件布局
+        if args.rollback_moves:
+            journal = MoveJournal()
+            restored, failed = journal.rollback()
+            logger.info(f"回滚完成: 恢复 {restored} 个文件，失败 {failed} 个")
+            return
         
         # 获取当前目录
         current_dir = Path.cwd()
@@ -952,15 +1566,58 @@ def main():
             logger.info(f"未找到ROM目录，使用当前目录: {current_dir}")
             target_dir = current_dir
         
+        # 重复文件检测不需要外部工具
+        if args.find_duplicates:
+            find_library_duplicates(target_dir, current_dir / 'output', hardlink=args.hardlink_duplicates)
+            return
+        
         # 创建合并器实例
-        merger = SwitchRomMerger(flat_output=args.flat_output)
+        merger = SwitchRomMerger(flat_output=args.flat_output, read_headers=not args.no_header_scan,
+                                 decompress_workers=args.decompress_workers,
+                                 decompress_timeout=args.decompress_timeout,
+                                 link_mode=args.link_mode,
+                                 move=args.move,
+                                 decompress_cache_bytes=int(args.decompress_cache_gb * GB),
+                                 stage_in_temp=args.stage_in_temp,
+                                 force=args.force,
+                                 resume=args.resume,
+                                 decompress_engine=args.decompress_engine,
+                                 merge_engine=args.engine,
+                                 disk_jobs=args.disk_jobs,
+                                 space_check=not args.no_space_check,
+                                 temp_budget_bytes=int(args.temp_budget_gb * GB) if args.temp_budget_gb else None)
+        
+        if args.move:
+            previous_moves = len(merger.move_journal.entries())
+            if previous_moves:
+                logger.warning(f"回滚日志中已有 {previous_moves} 条移动记录，可使用 --rollback-moves 恢复原始布局")
+        
+        # 监视模式一直运行到按Ctrl+C
+        if args.watch:
+            try:
+                merger.watch_directory(target_dir, jobs=args.jobs, settle=args.watch_settle,
+                                       batch_window=args.watch_batch, poll_interval=args.watch_poll,
+                                       polling=args.watch_polling)
+            except KeyboardInterrupt:
+                logger.info("监视已停止")
+            merger.close()
+            return
         
         # 扫描游戏文件
-        game_files = merger.scan_directory(target_dir)
+        if args.profile_scan:
+            with merger.profiler.capture(args.profile_scan, 'scan', args.profile.with_suffix('.scan.prof')
+                                         if args.profile_scan == 'cprofile' else None):
+                game_files = merger.scan_directory(target_dir, rebuild_index=args.rebuild_index)
+        else:
+            game_files = merger.scan_directory(target_dir, rebuild_index=args.rebuild_index)
         
         # 如果只需要扫描，直接返回
         if args.scan_only:
             logger.info("仅扫描模式，不执行合并")
+            if args.profile:
+                logger.info("各阶段耗时:")
+                merger.profiler.log_summary()
+                merger.profiler.save(args.profile)
             return
         
         # 如果指定了游戏ID，只处理该游戏
@@ -984,7 +1641,7 @@ def main():
                 if len(matching_games) == 1:
                     group_id, files_dict = matching_games[0]
                     logger.info(f"处理游戏: {files_dict['name']}")
-                    merger.merge_files(group_id, files_dict)
+                    merger.merge_games([(group_id, files_dict)])
                 else:
                     # 如果有多个匹配，提示用户选择
                     logger.info(f"找到多个匹配的游戏，请使用更精确的游戏ID")
@@ -992,13 +1649,21 @@ def main():
             else:
                 logger.error(f"找不到匹配的游戏: {args.game_id}")
         else:
-            # 处理所有游戏
-            for group_id, files_dict in tqdm(game_files.items(), desc="合并游戏"):
-                # 只处理有基础游戏文件的游戏
+            # 处理所有游戏，只处理有基础游戏文件的游戏
+            games = []
+            for group_id, files_dict in game_files.items():
                 if files_dict['base']:
-                    merger.merge_files(group_id, files_dict)
+                    games.append((group_id, files_dict))
                 else:
                     logger.warning(f"跳过没有基础游戏文件的游戏: {files_dict['name']}")
+            merger.merge_games(games, jobs=args.jobs)
+        
+        merger.close()
+        
+        if args.profile:
+            logger.info("各阶段耗时:")
+            merger.profiler.log_summary()
+            merger.profiler.save(args.profile)
         
         # 处理完成后清理所有临时文件
         temp_dir = Path('temp')
@@ -1006,7 +1671,6 @@ def main():
             try:
                 logger.info("清理所有临时文件...")
                 shutil.rmtree(temp_dir)
-                temp_dir.mkdir(exist_ok=True)
                 logger.info("临时文件清理完成")
             except Exception as e:
                 logger.error(f"清理临时文件失败: {str(e)}")
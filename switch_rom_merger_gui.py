@@ -12,22 +12,10 @@ from pathlib import Path
 import logging
 import queue
 import re
-from switch_rom_merger import SwitchRomMerger, logger
-
-# 设置本地化支持中文
-import locale
-locale.setlocale(locale.LC_ALL, '')
-
-# 禁用SSL证书验证
-import ssl
-try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    # Legacy Python that doesn't verify HTTPS certificates by default
-    pass
-else:
-    # Handle target environment that doesn't support HTTPS verification
-    ssl._create_default_https_context = _create_unverified_https_context
+from switch_rom_merger import SwitchRomMerger, logger, configure_runtime, find_keys_file
+from progress import describe
+from tool_registry import ToolRegistry
+import ncz_engine
 
 # 用于GUI和后台线程通信的队列
 log_queue = queue.Queue()
@@ -41,11 +29,12 @@ class QueueHandler(logging.Handler):
     def emit(self, record):
         self.log_queue.put(record)
 
-# 设置日志处理器
-queue_handler = QueueHandler(log_queue)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-queue_handler.setFormatter(formatter)
-logger.addHandler(queue_handler)
+def install_queue_handler():
+    """设置日志处理器，将日志发送到GUI队列"""
+    queue_handler = QueueHandler(log_queue)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    queue_handler.setFormatter(formatter)
+    logger.addHandler(queue_handler)
 
 class SwitchRomMergerGUI:
     def __init__(self, root):
@@ -166,6 +155,11 @@ class SwitchRomMergerGUI:
         self.log_text = scrolledtext.ScrolledText(self.log_frame, height=15)
         self.log_text.pack(fill=tk.BOTH, expand=True)
         
+        # 合并进度条（按字节）
+        self.progress_var = tk.DoubleVar(value=0)
+        self.progress_bar = ttk.Progressbar(self.main_frame, variable=self.progress_var, maximum=100)
+        self.progress_bar.pack(fill=tk.X, pady=5)
+        
         # 状态栏
         self.status_var = tk.StringVar(value="就绪")
         self.status_bar = ttk.Label(self.main_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
@@ -186,8 +180,8 @@ class SwitchRomMergerGUI:
         # 设置日志处理定时器
         self.root.after(100, self.check_log_queue)
         
-        # 检查工具和目录
-        self.check_environment()
+        # 检查工具和目录，窗口显示后再执行
+        self.root.after_idle(self.check_environment)
         
     def check_environment(self):
         """检查工具环境"""
@@ -200,30 +194,24 @@ class SwitchRomMergerGUI:
         # 检查工具
         tools_ok = True
         
-        if not self.find_tool("hactoolnet.exe"):
-            self.log_message("警告: 未找到hactoolnet.exe工具，请下载并放到tools目录")
-            tools_ok = False
+        tools = ToolRegistry()
+        # hactoolnet是可选工具，合并流程不会调用，缺少时不影响处理
+        if not tools.available("hactoolnet"):
+            self.log_message("提示: 未找到hactoolnet工具（可选），合并不需要该工具")
             
-        if not self.find_tool("nsz.exe"):
-            self.log_message("警告: 未找到nsz.exe工具，请下载并放到tools目录")
-            tools_ok = False
+        if not tools.available("nsz"):
+            if ncz_engine.AVAILABLE:
+                self.log_message("未找到nsz工具，将使用内置解压引擎")
+            else:
+                self.log_message("警告: 未找到nsz工具，请下载并放到tools目录，或安装zstandard模块")
+                tools_ok = False
             
         # 检查密钥文件
-        keys_found = False
-        possible_key_locations = [
-            Path('prod.keys'),
-            Path(os.path.expanduser('~/.switch/prod.keys')),
-            Path(os.path.expanduser('~/switch/prod.keys')),
-            Path('tools/keys.txt'),
-        ]
-        
-        for key_path in possible_key_locations:
-            if key_path.exists():
-                keys_found = True
-                self.log_message(f"找到密钥文件: {key_path}")
-                break
-                
-        if not keys_found:
+        keys_file = find_keys_file()
+        keys_found = keys_file is not None
+        if keys_found:
+            self.log_message(f"找到密钥文件: {keys_file}")
+        else:
             self.log_message("警告: 未找到prod.keys密钥文件，请将其放在工具根目录下")
             
         if tools_ok and keys_found:
@@ -234,20 +222,6 @@ class SwitchRomMergerGUI:
         # 检查output目录内容，决定是否启用打开输出目录按钮
         self.update_output_button_state()
             
-    def find_tool(self, tool_name):
-        """查找指定的工具"""
-        tools_dir = Path("tools")
-        
-        # 直接在tools目录中查找
-        if (tools_dir / tool_name).exists():
-            return True
-            
-        # 在子目录中查找
-        for item in tools_dir.glob(f"**/{tool_name}"):
-            return True
-            
-        return False
-        
     def browse_directory(self):
         """打开文件夹选择对话框"""
         dir_path = filedialog.askdirectory(title="选择ROM目录")
@@ -357,19 +331,21 @@ class SwitchRomMergerGUI:
             self.log_message("使用平铺输出模式，所有文件将直接放在output目录下")
         
         # 启动后台线程
+        self.progress_var.set(0)
         threading.Thread(target=self.merge_thread, args=(rom_dir, flat_output), daemon=True).start()
         
     def merge_thread(self, rom_dir, flat_output):
         """后台合并线程"""
+        merger = None
         try:
             merger = SwitchRomMerger(flat_output=flat_output)
+            # 进度事件在合并线程中产生，切换到GUI线程更新进度条
+            merger.progress.add_listener(lambda event: self.root.after(0, self.update_progress, event))
             game_files = merger.scan_directory(rom_dir)
             
-            # 处理所有游戏
-            for game_id, files_dict in game_files.items():
-                # 只处理有基础游戏文件的游戏
-                if files_dict['base']:
-                    merger.merge_files(game_id, files_dict)
+            # 处理所有游戏，只处理有基础游戏文件的游戏
+            games = [(game_id, files_dict) for game_id, files_dict in game_files.items() if files_dict['base']]
+            merger.merge_games(games)
                 
             # 在GUI线程中更新状态
             self.root.after(0, lambda: self.merge_complete(len(game_files)))
@@ -379,7 +355,16 @@ class SwitchRomMergerGUI:
             error_msg = f"处理过程中出错: {str(e)}\n{traceback.format_exc()}"
             # 在GUI线程中更新状态
             self.root.after(0, lambda: self.merge_error(error_msg))
+        finally:
+            # 与命令行一致: 关闭解压池并输出解压缓存统计
+            if merger is not None:
+                merger.close()
             
+    def update_progress(self, event):
+        """显示合并进度、速度和剩余时间"""
+        self.progress_var.set(event.percent)
+        self.update_status(describe(event))
+        
     def merge_complete(self, game_count):
         """合并完成后的回调"""
         self.log_message(f"处理完成，共处理 {game_count} 个游戏")
@@ -539,8 +524,9 @@ class SwitchRomMergerGUI:
             self.open_output_btn.config(state=tk.DISABLED)
 
 def main():
-    # 全局设置
-    os.environ['PYTHONHTTPSVERIFY'] = '0'  # 禁用SSL证书验证
+    # 全局设置: 本地化、SSL证书验证和日志
+    configure_runtime()
+    install_queue_handler()
     
     # 创建GUI窗口
     root = tk.Tk()
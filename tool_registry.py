@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import logging
+import time
+import threading
+import subprocess
+import importlib.util
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import profiler
+
+logger = logging.getLogger('SwitchRomMerger')
+
+# 已找到的工具路径缓存在此文件中，也可以手动编辑指定工具命令
+DEFAULT_TOOLS_CONFIG = Path('cache') / 'tools.json'
+
+# 同时运行的外部进程上限
+DEFAULT_MAX_PROCESSES = os.cpu_count() or 1
+
+# 确认找到的工具可以启动时最多等待的秒数
+_PROBE_TIMEOUT = 30
+
+
+class ToolSpec(NamedTuple):
+    """外部工具的查找方式"""
+    executables: Tuple[str, ...]     # 可执行文件名，按优先顺序
+    python_module: Optional[str]     # 可用 python -m 运行的模块
+    download_url: str
+
+
+def _executables(name: str) -> Tuple[str, ...]:
+    # Windows优先查找.exe；其他系统只查找原生可执行文件，tools目录中自带的Windows程序无法运行
+    if sys.platform == 'win32':
+        return (f"{name}.exe", name)
+    return (name,)
+
+
+def _is_executable(path: Path) -> bool:
+    """文件存在且当前系统可以执行（Windows以外要求有执行权限且不是.exe）"""
+    if not path.is_file():
+        return False
+    if sys.platform == 'win32':
+        return True
+    return path.suffix.lower() != '.exe' and os.access(path, os.X_OK)
+
+
+def _runs(command: List[str]) -> bool:
+    """确认命令可以启动（如文件格式不对会在这里失败），只在查找工具时执行一次"""
+    try:
+        subprocess.run(command + ['--help'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       stdin=subprocess.DEVNULL, timeout=_PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return True
+    except OSError as e:
+        logger.debug(f"无法运行 {' '.join(command)}: {str(e)}")
+        return False
+    return True
+
+
+TOOL_SPECS: Dict[str, ToolSpec] = {
+    'hactoolnet': ToolSpec(_executables('hactoolnet'), None, 'https://github.com/Thealexbarney/libhac/releases'),
+    'nsz': ToolSpec(_executables('nsz'), 'nsz', 'https://github.com/nicoboss/nsz/releases'),
+}
+
+
+class ToolNotFoundError(FileNotFoundError):
+    """找不到所需的外部工具"""
+
+
+class ToolRegistry:
+    """外部工具注册表
+
+    工具在第一次使用时才查找，依次尝试: 配置文件中缓存的命令、tools目录
+    （先直接查找，再递归查找子目录）、Python模块、PATH。Windows以外的系统只接受有执行权限的
+    原生程序，不会选中tools目录中自带的.exe。找到的命令确认可以启动后才写入配置文件，
+    之后的运行不再重复查找。所有外部进程共享一个并发上限。
+    """
+
+    def __init__(self, tools_dir: Path = Path('tools'), config_path: Path = DEFAULT_TOOLS_CONFIG,
+                 max_processes: int = DEFAULT_MAX_PROCESSES):
+        self.tools_dir = Path(tools_dir)
+        self.config_path = Path(config_path)
+        self._lock = threading.Lock()
+        self._resolved: Dict[str, Optional[List[str]]] = {}
+        self._config: Optional[Dict[str, Dict]] = None
+        self._process_slots = threading.BoundedSemaphore(max(1, max_processes))
+
+    def _load_config(self) -> Dict[str, Dict]:
+        if self._config is None:
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    self._config = json.load(f)
+            except (OSError, ValueError):
+                self._config = {}
+        return self._config
+
+    def _save_config(self):
+        self.config_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.config_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.config_path)
+
+    def _candidates(self, name: str) -> Iterator[Tuple[List[str], str]]:
+        """按优先顺序列出可能的 (命令, 来源)"""
+        spec = TOOL_SPECS[name]
+        if self.tools_dir.is_dir():
+            for executable in spec.executables:
+                candidate = self.tools_dir / executable
+                if _is_executable(candidate):
+                    yield [str(candidate)], 'tools'
+            for executable in spec.executables:
+                for candidate in self.tools_dir.glob(f"**/{executable}"):
+                    if _is_executable(candidate):
+                        yield [str(candidate)], 'tools'
+        if spec.python_module and importlib.util.find_spec(spec.python_module) is not None:
+            yield [sys.executable, '-m', spec.python_module], 'python'
+        for executable in spec.executables:
+            found = shutil.which(executable)
+            if found:
+                yield [found], 'path'
+
+    def _discover(self, name: str) -> Optional[Tuple[List[str], str]]:
+        """返回第一个可以启动的 (命令, 来源)"""
+        for command, source in self._candidates(name):
+            if _runs(command):
+                return command, source
+        return None
+
+    def resolve(self, name: str) -> Optional[List[str]]:
+        """返回运行工具的命令前缀，找不到时返回None"""
+        with self._lock:
+            if name in self._resolved:
+                return self._resolved[name]
+
+            config = self._load_config()
+            cached = config.get(name)
+            command = None
+            if cached and _is_executable(Path(cached['command'][0])):
+                command = cached['command']
+            else:
+                found = self._discover(name)
+                if found:
+                    command, source = found
+                    config[name] = {'command': command, 'source': source}
+                    try:
+                        self._save_config()
+                    except OSError as e:
+                        logger.debug(f"无法保存工具配置: {str(e)}")
+                elif cached:
+                    # 缓存的路径已失效
+                    del config[name]
+
+            if command:
+                logger.info(f"找到{name}工具: {' '.join(command)}")
+            self._resolved[name] = command
+            return command
+
+    def available(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def require(self, name: str) -> List[str]:
+        command = self.resolve(name)
+        if command is None:
+            spec = TOOL_SPECS[name]
+            logger.error(f"找不到{name}，请手动下载并放置在{self.tools_dir}目录下，或加入PATH")
+            logger.info(f"您可以从 {spec.download_url} 下载")
+            raise ToolNotFoundError(f"找不到{name}")
+        return command
+
+    @contextmanager
+    def process(self, name: str, args: List[str], **popen_kwargs) -> Iterator[subprocess.Popen]:
+        """在并发上限内启动工具进程，退出时确保进程已结束"""
+        command = self.require(name) + [str(arg) for arg in args]
+        logger.debug(f"执行命令: {' '.join(command)}")
+        with self._process_slots:
+            start_time = time.perf_counter()
+            process = subprocess.Popen(command, **popen_kwargs)
+            try:
+                yield process
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+                profiler.add_subprocess_time(time.perf_counter() - start_time)